@@ -76,6 +76,7 @@ CREATE TABLE book_genres (
 DROP TABLE IF EXISTS recommendations;
 DROP TABLE IF EXISTS initial_preferences;
 DROP TABLE IF EXISTS bad_recommendations;
+DROP TABLE IF EXISTS dirty_users;
 
 CREATE TABLE recommendations (
     recommendation_id INT NOT NULL AUTO_INCREMENT,
@@ -107,10 +108,20 @@ CREATE TABLE bad_recommendations (
     FOREIGN KEY (book_id) REFERENCES books(book_id)
 );
 
+CREATE TABLE dirty_users (
+    user_id INT NOT NULL,
+    date_added DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id),
+    FOREIGN KEY (user_id) REFERENCES users(user_id)
+);
+-- Users that have interacted with something since recommendations were last
+-- generated for them. The user_id is the primary key, so each is only stored once
+
 -- -----------------------------------
 -- Books
 -- -----------------------------------
 DROP TABLE IF EXISTS books;
+DROP TABLE IF EXISTS book_similarities;
 
 CREATE TABLE books (
     book_id INT NOT NULL AUTO_INCREMENT,
@@ -127,6 +138,17 @@ CREATE TABLE books (
     PRIMARY KEY (book_id),
     FOREIGN KEY (author_id) REFERENCES authors(author_id)
 );
+
+CREATE TABLE book_similarities (
+    book_id INT NOT NULL,
+    similar_book_id INT NOT NULL,
+    similarity FLOAT NOT NULL,
+    PRIMARY KEY (book_id, similar_book_id)
+);
+-- The most similar books to each book, from the users that have read, reviewed
+-- or listed both. Generated by maintenance, and replaced all at once, so it has
+-- no foreign keys. The primary key means the similar books of a book can be
+-- found with a single index lookup.
 -- cover_image, purchase_link and isbn should have a unique constraint, but it
 -- is not possible to add a unique constraint to a TINYTEXT but varchar are
 -- slow so no unique constraint
@@ -218,6 +240,7 @@ CREATE TABLE sessions (
 -- Information retrieval
 -- -----------------------------------
 DROP TABLE IF EXISTS unique_words;
+DROP TABLE IF EXISTS search_index_changes;
 
 CREATE TABLE unique_words (
     word_id INT NOT NULL AUTO_INCREMENT,
@@ -226,6 +249,18 @@ CREATE TABLE unique_words (
     PRIMARY KEY (word_id)
 );
 
+CREATE TABLE search_index_changes (
+    change_id INT NOT NULL AUTO_INCREMENT,
+    document_type CHAR(1) NOT NULL,
+    document_id INT NOT NULL,
+    words TEXT, -- NULL if the document was removed
+    date_added DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (change_id)
+);
+-- Documents added, updated or removed since the search index was made, in
+-- order. Each server process makes them on its copy of the index, and they are
+-- deleted once they are in a newly made index
+
 SET FOREIGN_KEY_CHECKS=@OLD_FOREIGN_KEY_CHECKS;
 SET UNIQUE_CHECKS=@OLD_UNIQUE_CHECKS;
  -- Restore original checks and constraint settings --
\ No newline at end of file
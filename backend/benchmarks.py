@@ -0,0 +1,355 @@
+# -----------------------------------------------------------------------------
+# Standard Python library imports
+# -----------------------------------------------------------------------------
+import os
+import sys
+import json
+import time
+
+# -----------------------------------------------------------------------------
+# Third party Python library imports
+# -----------------------------------------------------------------------------
+import numpy as np
+import scipy.sparse
+
+# -----------------------------------------------------------------------------
+# Project imports
+# -----------------------------------------------------------------------------
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import components.information_retrieval
+import components.recommendations
+
+import evaluation
+import ml_utilities
+import nearest_neighbours
+
+# -----------------------------------------------------------------------------
+# Synthetic data
+# -----------------------------------------------------------------------------
+# The benchmarks use generated data rather than the database, so they can be run anywhere, and are repeatable.
+def synthetic_ratings(num_users, num_books, density, seed):
+    generator = np.random.default_rng(seed)
+    ratings = scipy.sparse.random(num_users, num_books, density=density, format="csr", random_state=generator,
+                                  data_rvs=lambda n: generator.integers(1, 6, n).astype(np.float64))
+    return ratings
+
+
+# -----------------------------------------------------------------------------
+# Benchmarks
+# -----------------------------------------------------------------------------
+def parallel_training(workers=4, num_users=20000, num_books=5000, num_factors=20, density=0.01, iterations=5,
+                      solver="implicit", seed=0):
+    # Runs the same sweeps from the same starting factors in this process, and over a pool of workers.
+    ratings = synthetic_ratings(num_users, num_books, density, seed)
+    if solver != "implicit":
+        ratings = ratings.toarray()  # wals is trained on the dense matrix
+    transposed = ratings.T.tocsr() if solver == "implicit" else ratings.T
+    generator = np.random.default_rng(seed)
+    initial_books = generator.random((num_books, num_factors))
+    initial_users = generator.random((num_users, num_factors))
+    hyperparam, confidence_weight = 0.1, 10
+
+    start = time.perf_counter()
+    book_factors = initial_books
+    for i in range(iterations):
+        user_factors = components.recommendations.als_step(ratings, book_factors, solver, hyperparam,
+                                                           confidence_weight)
+        book_factors = components.recommendations.als_step(transposed, user_factors, solver, hyperparam,
+                                                           confidence_weight)
+    serial_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    trainer = components.recommendations.ParallelTrainer(ratings, transposed, initial_users, initial_books, workers,
+                                                         solver, hyperparam, confidence_weight)
+    for i in range(iterations):
+        trainer.sweep()
+    parallel_user_factors = np.array(trainer.user_factors)
+    parallel_book_factors = np.array(trainer.book_factors)
+    trainer.close()
+    parallel_time = time.perf_counter() - start  # Includes starting the workers
+
+    return {
+        "workers": workers,
+        "solver": solver,
+        "serial_seconds": serial_time,
+        "parallel_seconds": parallel_time,
+        "speedup": serial_time / parallel_time,
+        "max_difference": float(max(
+            np.abs(parallel_user_factors - user_factors).max(),
+            np.abs(parallel_book_factors - book_factors).max()
+        ))  # Should only be floating point error, as each row is solved the same way
+    }
+
+
+def ranking_evaluation(num_users=20000, num_books=5000, num_factors=20, density=0.01, iterations=5, number=10,
+                       solver="implicit", seed=0):
+    # Times evaluation.evaluate over every user, for a model trained on 80% of the ratings, to check it is cheap
+    # enough to run every iteration as an early stopping measure.
+    ratings = synthetic_ratings(num_users, num_books, density, seed)
+    held_out = np.random.default_rng(seed).random(ratings.nnz) < 0.2
+    train = ratings.copy()
+    train.data[held_out] = 0
+    train.eliminate_zeros()
+    test = ratings - train
+    transposed = train.T.tocsr()
+
+    book_factors = np.random.default_rng(seed).random((num_books, num_factors))
+    for i in range(iterations):
+        user_factors = components.recommendations.als_step(train, book_factors, solver, 0.1, 10)
+        book_factors = components.recommendations.als_step(transposed, user_factors, solver, 0.1, 10)
+
+    start = time.perf_counter()
+    top = components.recommendations.top_books(user_factors, book_factors, train != 0, number)
+    ranking_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = evaluation.evaluate(top, test > 0)
+    measure_time = time.perf_counter() - start
+
+    results.update({
+        "users": num_users,
+        "ranking_seconds": ranking_time,
+        "measure_seconds": measure_time
+    })
+    return results
+
+
+def serving_precision(num_users=20000, num_books=5000, num_factors=20, density=0.01, iterations=5, number=10,
+                      solver="implicit", block_size=1024, seed=0):
+    # Compares the memory, scoring time and top books of the factors at each serving precision, against float64.
+    ratings = synthetic_ratings(num_users, num_books, density, seed)
+    transposed = ratings.T.tocsr()
+    book_factors = np.random.default_rng(seed).random((num_books, num_factors))
+    for i in range(iterations):
+        user_factors = components.recommendations.als_step(ratings, book_factors, solver, 0.1, 10)
+        book_factors = components.recommendations.als_step(transposed, user_factors, solver, 0.1, 10)
+
+    results = dict()
+    for precision in ("float64", "float32", "int8"):
+        users, user_scales = ml_utilities.compact_factors(user_factors, precision)
+        books, book_scales = ml_utilities.compact_factors(book_factors, precision)
+        book_norms = ml_utilities.factor_norms(books, book_scales)
+
+        start = time.perf_counter()
+        top = []
+        for block in range(0, num_users, block_size):
+            top.append(components.recommendations.top_recommendations(
+                ml_utilities.expand_factors(users, user_scales, np.arange(block, min(block + block_size, num_users))),
+                books,
+                ratings[block:block + block_size].toarray() != 0,
+                number,
+                book_norms,
+                book_scales
+            )[0])
+        seconds = time.perf_counter() - start
+        top = np.concatenate(top)
+
+        if precision == "float64":
+            exact = top
+        results[precision] = {
+            "bytes": sum(i.nbytes for i in (users, books, user_scales, book_scales) if i is not None),
+            "seconds": seconds,
+            "same_ranking": float(np.mean(np.all(top == exact, axis=1))),  # Fraction of users with the same order.
+            # int8 changes the order for most users, as their closest scores are nearer than its rounding, but keeps
+            # nearly all of the same books, see same_books
+            "same_books": float(np.mean([len(np.intersect1d(i, j)) / max(len(i), 1) for i, j in zip(top, exact)]))
+        }
+
+    return results
+
+
+def nearest_neighbours_index(num_books=100000, num_factors=20, number=10, queries=200, num_tables=16, num_bits=10,
+                             probes=3, max_candidates=0, clusters=0, seed=0):
+    # Compares the nearest neighbour index with scoring every book, for the closest books to some of the books.
+    # With clusters=0 the factors are random, which has less structure than trained factors, so the recall is a lower
+    # bound. Otherwise each book is near one of that many centres, like books of the same genres.
+    generator = np.random.default_rng(seed)
+    book_factors = generator.normal(size=(num_books, num_factors))
+    if clusters:
+        centres = generator.normal(size=(clusters, num_factors))
+        book_factors = centres[generator.integers(0, clusters, num_books)] + book_factors * 0.4
+    norms = np.linalg.norm(book_factors, axis=1)
+
+    start = time.perf_counter()
+    index = nearest_neighbours.RandomProjectionIndex(book_factors, num_tables=num_tables, num_bits=num_bits,
+                                                     probes=probes, max_candidates=max_candidates, seed=seed)
+    build_time = time.perf_counter() - start
+
+    exact_time = index_time = 0
+    recall = []
+    for book in range(queries):
+        start = time.perf_counter()
+        scores = book_factors.dot(book_factors[book]) / (norms * norms[book])
+        scores[book] = -np.inf
+        exact = np.argpartition(-scores, number)[:number]
+        exact_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        found = index.query_index(book, number)[0]
+        index_time += time.perf_counter() - start
+        recall.append(len(np.intersect1d(found, exact)) / number)
+
+    return {
+        "books": num_books,
+        "build_seconds": build_time,
+        "exact_query_seconds": exact_time / queries,
+        "index_query_seconds": index_time / queries,
+        "recall": float(np.mean(recall))
+    }
+
+
+class _QueryResults:
+    # Stands in for mysql_handler.Connection, giving the same rows for any query that contains a key
+    def __init__(self, results):
+        self._results = results
+
+    def query(self, query):
+        for key, rows in self._results.items():
+            if key in query:
+                return rows
+        return []
+
+
+def lookup_tables(num_users=20000, num_books=20000, num_genres=20, genres_per_book=3, interactions=200000, seed=0):
+    # Times loading the book factors from book_genres, and finding the matrix index of every interaction, with the
+    # index tables and with the list.index search they replaced.
+    generator = np.random.default_rng(seed)
+    user_ids = (np.arange(num_users) + 1).tolist()
+    book_ids = (np.arange(num_books) + 1).tolist()
+    genre_ids = (np.arange(num_genres) + 1).tolist()
+    book_genres = [
+        (book_id, ",".join(str(float(i)) for i in generator.random(genres_per_book)),
+         ",".join(str(i) for i in sorted(generator.choice(genre_ids, genres_per_book, replace=False))))
+        for book_id in book_ids
+    ]
+    interacted = generator.choice(book_ids, interactions).tolist()
+
+    recommendations = components.recommendations.Recommendations.__new__(components.recommendations.Recommendations)
+    recommendations._connection = _QueryResults({"FROM book_genres": book_genres})
+    recommendations._num_users, recommendations._num_books, recommendations._num_factors = (num_users, num_books,
+                                                                                          num_genres)
+    recommendations._serving_precision = "float64"
+
+    start = time.perf_counter()
+    recommendations._set_lookup_tables(user_ids, book_ids, genre_ids)
+    tables_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    recommendations._load_book_factors()
+    load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    list_factors = np.zeros((num_books, num_genres))
+    for i, j, k in book_genres:
+        book = list(recommendations.book_lookup_table.values()).index(i)
+        genres = [list(recommendations.genre_lookup_table.values()).index(int(z)) for z in k.split(",")]
+        for genre, match in zip(genres, (float(z) for z in j.split(","))):
+            list_factors[book][genre] = match
+    list_load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    indexes = [recommendations.book_index_table[i] for i in interacted]
+    index_time = time.perf_counter() - start
+
+    sample = interacted[:max(interactions // 100, 1)]  # list.index is too slow to run on all of them
+    start = time.perf_counter()
+    list_indexes = [list(recommendations.book_lookup_table.values()).index(i) for i in sample]
+    list_index_time = (time.perf_counter() - start) * len(interacted) / len(sample)
+
+    return {
+        "make_tables_seconds": tables_time,
+        "load_book_factors_seconds": load_time,
+        "list_load_book_factors_seconds": list_load_time,
+        "interaction_indexes_seconds": index_time,
+        "list_interaction_indexes_seconds": list_index_time,  # Estimated from a sample
+        "same_result": bool(np.array_equal(recommendations.book_factors, list_factors) and
+                            indexes[:len(sample)] == list_indexes)
+    }
+
+
+def search_engines(num_documents=100000, num_words=50000, document_length=8, queries=200, query_length=2, number=50,
+                   seed=0):
+    # Times both search engines of DocumentCollection on generated documents, with word frequencies like a natural
+    # language's (a few words are in many documents). Each search is for some of the words of one of the documents.
+    # The engines rank documents the same way, so overlap, the fraction of the top results they have in common, should
+    # be 1.
+    generator = np.random.default_rng(seed)
+    words = np.array(["w" + str(i) for i in range(num_words)])
+    lengths = generator.integers(1, 2 * document_length, num_documents)
+    word_ids = np.minimum(generator.zipf(1.3, lengths.sum()), num_words) - 1
+    documents = np.split(words[word_ids], np.cumsum(lengths)[:-1])
+
+    collection = components.information_retrieval.DocumentCollection(None, None, None, None, number, engine="matrix",
+                                                                     load=False)
+    collection._documents_dict = [
+        {"type": "bga"[i % 3], "words": " ".join(document), "id": i, "similarity": 0}
+        for i, document in enumerate(documents)
+    ]
+    collection._documents = [i["words"] for i in collection._documents_dict]
+    frequencies = np.bincount(np.unique(np.repeat(np.arange(num_documents), lengths) * num_words + word_ids) %
+                              num_words, minlength=num_words)
+    collection._idf_values = {
+        str(word): float(np.log10(num_documents / frequency)) for word, frequency in zip(words, frequencies)
+        if frequency
+    }
+
+    start = time.perf_counter()
+    collection.gen_tf_values()
+    collection._index = collection._make_index()  # Without any changes, as there is no database
+    collection._index.matrix = collection._index.make_matrix()
+    build_time = time.perf_counter() - start
+
+    searches = [" ".join(generator.choice(documents[i], min(query_length, len(documents[i])), replace=False))
+                for i in generator.integers(0, num_documents, queries)]
+    index_time = matrix_time = 0
+    overlap = []
+    for search in searches:
+        start = time.perf_counter()
+        index_results = collection.tfidf_search(search, number)
+        index_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        matrix_results = collection.matrix_search(search, number)
+        matrix_time += time.perf_counter() - start
+
+        overlap.append(len({(i["type"], i["id"]) for i in index_results} &
+                           {(i["type"], i["id"]) for i in matrix_results}) / max(len(index_results), 1))
+
+    return {
+        "documents": num_documents,
+        "build_seconds": build_time,
+        "index_query_seconds": index_time / queries,
+        "matrix_query_seconds": matrix_time / queries,
+        "overlap": float(np.mean(overlap))
+    }
+
+
+BENCHMARKS = {
+    "parallel_training": parallel_training,
+    "ranking_evaluation": ranking_evaluation,
+    "serving_precision": serving_precision,
+    "nearest_neighbours_index": nearest_neighbours_index,
+    "lookup_tables": lookup_tables,
+    "search_engines": search_engines
+}
+
+# -----------------------------------------------------------------------------
+# Command line
+# -----------------------------------------------------------------------------
+# python3 benchmarks.py <benchmark> [<argument>=<value> ...]
+# e.g. python3 benchmarks.py parallel_training workers=8 solver=wals
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print("Benchmarks: " + ", ".join(BENCHMARKS))
+        sys.exit(1)
+
+    arguments = dict()
+    for argument in sys.argv[2:]:
+        key, value = argument.split("=", 1)
+        try:
+            arguments[key] = json.loads(value)  # Numbers etc.
+        except json.JSONDecodeError:
+            arguments[key] = value
+
+    print(json.dumps(BENCHMARKS[sys.argv[1]](**arguments), indent=4))
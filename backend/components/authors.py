@@ -16,10 +16,11 @@ class AuthorNotFoundError(Exception):
 # Objects
 # -----------------------------------------------------------------------------
 class Authors:
-    def __init__(self, connection, number_genres, number_summaries_home):
+    def __init__(self, connection, number_genres, number_summaries_home, recommendations=None):
         self._number_summaries_home = number_summaries_home
         self._number_genres = number_genres
         self._connection = connection
+        self._recommendations = recommendations  # Notified when a user follows or unfollows an author
 
     def follow(self, user_id, author_id):
         try:
@@ -29,6 +30,9 @@ class Authors:
             """.format(user_id=user_id, author_id=author_id))
         except mysql.connector.errors.IntegrityError:
             pass
+        else:
+            if self._recommendations is not None:
+                self._recommendations.notify_interaction(user_id)
 
     def unfollow(self, user_id, author_id):
         self._connection.query("""
@@ -37,6 +41,9 @@ class Authors:
                 AND author_id={author_id};
         """.format(user_id=user_id, author_id=author_id))
 
+        if self._recommendations is not None:
+            self._recommendations.notify_interaction(user_id)
+
     def get_number_followers(self, author_id):
         return self._connection.query("""
         SELECT COUNT(author_id) FROM author_followers
@@ -27,14 +27,26 @@ class BookNotFoundError(Exception):
 # Objects
 # -----------------------------------------------------------------------------
 class Books:
-    def __init__(self, connection, reading_lists, number_similarities_about, number_summaries_home, num_display_genres):
+    def __init__(self, connection, reading_lists, number_similarities_about, number_summaries_home, num_display_genres, recommendations=None, similar_from_factors=False):
         self._reading_lists = reading_lists
+        self._recommendations = recommendations
+        self._similar_from_factors = similar_from_factors
         self._num_display_genres = num_display_genres
         self._number_summaries_home = number_summaries_home
         self._number_similarities_about = number_similarities_about
         self._connection = connection
 
     def get_similar_items(self, book_id):
+        if self._similar_from_factors and self._recommendations is not None:
+            # The closest books by their trained factors, which start from their genres but also follow what users
+            # read, so the results differ from the genre similarity below. From the nearest neighbour index, rather
+            # than comparing every book.
+            res = self._recommendations.nearest_books(self._number_similarities_about, book_id=book_id)
+            if res:
+                return [self.get_summary(i[0]) for i in res]
+            # Otherwise the book was added since the model was trained, so it is compared by its genres
+
+
         res = self._connection.query("""
             SELECT books.book_id,
                 GROUP_CONCAT(book_genres.genre_id
@@ -74,6 +86,33 @@ class Books:
 
         return [self.get_summary(i["book_id"]) for i in result]
 
+    def get_read_together_items(self, book_id):
+        # Similar books from what other users have read, from the table made by
+        # Recommendations.save_book_similarities. Empty if the book has not been read with any others, so
+        # get_similar_items should be used instead.
+        res = self._connection.query("""
+            SELECT books.title,
+                books.book_id,
+                books.cover_image,
+                authors.first_name,
+                authors.surname,
+                authors.alias
+            FROM book_similarities
+            INNER JOIN books ON book_similarities.similar_book_id=books.book_id
+            INNER JOIN authors ON books.author_id=authors.author_id
+            WHERE book_similarities.book_id={book_id}
+            ORDER BY book_similarities.similarity DESC
+            LIMIT {limit};
+        """.format(book_id=book_id, limit=self._number_similarities_about))  # The summaries are found with the
+        # similarities, rather than with a query for each book
+
+        return [{
+            "author": components.authors.names_to_display(i[3], i[4], i[5]),
+            "title": i[0],
+            "book_id": i[1],
+            "cover": i[2],
+        } for i in res]
+
     def get_summary(self, book_id=None, isbn=None):
         if book_id is not None:
             res = self._connection.query("""
@@ -324,6 +363,9 @@ class Books:
                 AND review_id={review_id};
         """.format(user_id=user_id, review_id=review_id))
 
+        if self._recommendations is not None:
+            self._recommendations.notify_interaction(user_id)
+
     def leave_review(self, user_id, book_id, overall_rating, plot_rating, character_rating, summary, thoughts):
         params = locals()
         params = {i: "null" if k is None else k for i, k in zip(params.keys(), params.values())}
@@ -351,6 +393,9 @@ class Books:
             summary=params["summary"],
             rating_body=params["thoughts"]
         ))
+
+        if self._recommendations is not None:
+            self._recommendations.notify_interaction(user_id)
     
     def get_highly_rated(self):
         res = self._connection.query("""
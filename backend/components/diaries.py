@@ -17,8 +17,9 @@ import data_structures
 # Objects
 # -----------------------------------------------------------------------------
 class Diaries:
-    def __init__(self, connection):
+    def __init__(self, connection, recommendations=None):
         self._connection = connection
+        self._recommendations = recommendations  # Notified when a user adds or deletes an entry
 
     def add_entry(self, user_id, book_id, overall_rating, character_rating, plot_rating, summary, thoughts, pages_read):
         params = locals()
@@ -63,6 +64,9 @@ class Diaries:
             )
         )
 
+        if self._recommendations is not None:
+            self._recommendations.notify_interaction(user_id)
+
     def delete_entry(self, user_id, entry_id):
         # The user id is just a way of helping preventing a random deletion of a list. The corresponding user_id must be
         # known.
@@ -72,6 +76,9 @@ class Diaries:
                 AND entry_id={entry_id};
         """.format(user_id=user_id, entry_id=entry_id))
 
+        if self._recommendations is not None:
+            self._recommendations.notify_interaction(user_id)
+
     def get_entries(self, user_id):
         res = self._connection.query("""
             SELECT diary_entries.entry_id,
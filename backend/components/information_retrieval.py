@@ -1,14 +1,35 @@
 # -----------------------------------------------------------------------------
 # Standard Python library imports
 # -----------------------------------------------------------------------------
+import collections
+import copy
+import heapq
 import itertools
 import math
+import time
+import threading
+
+# -----------------------------------------------------------------------------
+# Third party Python library imports
+# -----------------------------------------------------------------------------
+import numpy as np
+import scipy.sparse
 
 # -----------------------------------------------------------------------------
 # Project imports
 # -----------------------------------------------------------------------------
 import components.books
 
+import model_store
+
+# -----------------------------------------------------------------------------
+# Exceptions
+# -----------------------------------------------------------------------------
+class DocumentNotFoundError(Exception):
+    def __init__(self, document_type, document_id):
+        message = f"Document of type '{document_type}' with ID '{document_id}' was not found."
+        super().__init__(message)
+
 # -----------------------------------------------------------------------------
 # Functions
 # -----------------------------------------------------------------------------
@@ -19,18 +40,188 @@ def clean_data(string):
 # -----------------------------------------------------------------------------
 # Objects
 # -----------------------------------------------------------------------------
+# The arrays of a SearchIndex, which are the files it is saved as, see DocumentCollection.gen_index
+INDEX_ARRAYS = ("vocabulary", "pointers", "positions", "tf", "idf", "document_types", "document_ids",
+                "document_rows", "document_pointers")
+# Decimal places the similarities are rounded to. Documents that match the search equally well can get similarities
+# that differ in the last bits, depending on the order they were added up in, so they are rounded to be tied, and are
+# then ordered by type and document order by both search engines
+SIMILARITY_DIGITS = 12
+
+
+class SearchIndex:
+    # The inverted index, and the documents that have been changed since it was made. A SearchIndex is not changed
+    # once it is made: each change to the documents gives a new one, which shares the arrays. DocumentCollection holds
+    # it behind a single reference, so a search that reads the reference once sees one whole index, even if another
+    # thread changes a document or swaps in a newer index.
+    def __init__(self, arrays, version=None):
+        for name in INDEX_ARRAYS:
+            setattr(self, name, arrays[name])
+        self.version = version
+        self.matrix = None  # Only made for matrix_search, see make_matrix
+        self.last_change = int(arrays["last_change"][0]) if "last_change" in arrays else 0  # change_id of the
+        # last row of search_index_changes that is in the index
+
+        # Documents added, updated or removed after the index was made are searchable straight away, without making
+        # the index again. Added documents are kept after the ones in the index, and removed ones are left in it but
+        # are never returned. Only the idf of the words in the changed document are worked out again (from their new
+        # document frequencies), so the small change to the idf of every other word, from the number of documents
+        # changing, waits until the index is next made.
+        self.added = ()  # (type, id, tf) of each added document, in order of position
+        self.added_postings = dict()  # word -> (positions, tf values) in the added documents
+        self.removed = frozenset()  # Positions of removed documents, including the old versions of updated ones
+        self.frequency_changes = dict()  # word -> change in the number of documents containing it
+        self.idf_changes = dict()  # word -> idf, for the words whose document frequency has changed
+        self._document_positions = None  # (type, id) -> position, made the first time a document is changed. Only
+        # used to make changes, which DocumentCollection makes one at a time, so it is shared by the indexes made by
+        # the changes and kept up to date, rather than copied for each one.
+
+    def arrays(self):
+        arrays = {name: getattr(self, name) for name in INDEX_ARRAYS}
+        arrays["last_change"] = np.array([self.last_change], dtype=np.int64)
+        return arrays
+
+    def replace(self, **fields):
+        index = copy.copy(self)  # The arrays and the change containers are shared, as they are never changed
+        index.__dict__.update(fields)
+        return index
+
+    def make_matrix(self):
+        # Document by word matrix of the tf values, which is the inverted index (word by document) transposed. It is
+        # kept by column, so the columns of the search words are taken without going through every document. The idf
+        # values are not in it, as they change when documents are changed.
+        return scipy.sparse.csr_matrix(
+            (self.tf, self.positions, self.pointers),
+            shape=(len(self.vocabulary), len(self.document_ids))
+        ).T
+
+    def word_row(self, word):
+        # The word's row of the index, or None if it is not in it
+        key = word.encode()
+        row = int(np.searchsorted(self.vocabulary, key))
+        if row < len(self.vocabulary) and self.vocabulary[row] == key:
+            return row
+        return None
+
+    def word_idf(self, word, row):
+        # None if the word has never been in a document
+        if word in self.idf_changes:
+            return self.idf_changes[word]
+        if row is not None:
+            return float(self.idf[row])
+        return None
+
+    def document_position(self, document_type, document_id):
+        if self._document_positions is None:
+            self._document_positions = {
+                key: position for position, key in enumerate(zip(self.document_types.tolist(),
+                                                                  self.document_ids.tolist()))
+            }
+        return self._document_positions.get((document_type, document_id))
+
+    def document_keys(self, positions):
+        # The types and ids of the documents at the positions, which can be in the index or added after it
+        num_indexed = len(self.document_ids)
+        if len(positions) == 0 or positions.max() < num_indexed:
+            return self.document_types[positions].tolist(), self.document_ids[positions].tolist()
+        keys = [(str(self.document_types[i]), int(self.document_ids[i])) if i < num_indexed
+                else self.added[i - num_indexed][:2] for i in positions.tolist()]
+        return [i[0] for i in keys], [i[1] for i in keys]
+
+    def _change_frequencies(self, words, change, added, removed):
+        # The frequency and idf changes once the words' document frequencies have changed by change
+        frequency_changes = dict(self.frequency_changes)
+        idf_changes = dict(self.idf_changes)
+        num_documents = len(self.document_ids) + len(added) - len(removed)
+        for word in words:
+            frequency_changes[word] = frequency_changes.get(word, 0) + change
+            row = self.word_row(word)
+            frequency = frequency_changes[word]
+            if row is not None:
+                frequency += int(self.pointers[row + 1] - self.pointers[row])
+            idf_changes[word] = math.log10(num_documents / frequency) if frequency > 0 else 0.0
+        return {"frequency_changes": frequency_changes, "idf_changes": idf_changes}
+
+    def with_document(self, document_type, document_id, tf):
+        # A new index with the document added, replacing the document with the same type and id if there is one
+        index = self
+        if self.document_position(document_type, document_id) is not None:
+            index = self.without_document(document_type, document_id)
+
+        position = len(index.document_ids) + len(index.added)
+        added = index.added + ((document_type, document_id, tf),)
+        added_postings = dict(index.added_postings)
+        for word, word_tf in tf.items():
+            positions, tf_values = added_postings.get(word, ((), ()))
+            added_postings[word] = (positions + (position,), tf_values + (word_tf,))
+
+        index = index.replace(added=added, added_postings=added_postings,
+                              **index._change_frequencies(tf, 1, added, index.removed))
+        index._document_positions[(document_type, document_id)] = position
+        return index
+
+    def without_document(self, document_type, document_id):
+        position = self.document_position(document_type, document_id)
+        if position is None:
+            raise DocumentNotFoundError(document_type, document_id)
+
+        if position < len(self.document_ids):
+            start, end = self.document_pointers[position], self.document_pointers[position + 1]
+            words = [i.decode() for i in self.vocabulary[self.document_rows[start:end]].tolist()]
+        else:
+            words = list(self.added[position - len(self.document_ids)][2])
+
+        removed = self.removed | {position}
+        index = self.replace(removed=removed, **self._change_frequencies(words, -1, self.added, removed))
+        del index._document_positions[(document_type, document_id)]
+        return index
+
+
 class DocumentCollection:
-    def __init__(self, connection, books, authors, genres, result_limit):
+    def __init__(self, connection, books, authors, genres, result_limit, engine="index", index_directory=None,
+                 reload_interval=5, load=True):
         self._authors = authors
         self._genres = genres
         self._books = books
         self._result_limit = result_limit
         self._connection = connection
+        self._engine = engine  # "index" searches with tfidf_search, "matrix" with matrix_search
+        self._index_directory = index_directory or None  # The index is saved here by maintenance.py, and loaded from
+        # here if there is one, rather than being made from the database
+        self._reload_interval = reload_interval  # Seconds between checks for a newer saved index
+        self._last_refresh = time.monotonic()
+        self._idf_values = None
+        self._index = None  # Only ever replaced as a whole, see SearchIndex
+        self._changes_lock = threading.Lock()  # Held while changes are made, so they are made one at a time
+        self._documents_change = 0  # change_id of the last change before the documents were read
+
+        if not load:
+            return  # The index is made by the caller, e.g. with make_index
+        if self._index_directory is not None and model_store.current_version(self._index_directory) is not None:
+            self.load_index()
+        else:
+            self.load_documents()
+
+    @property
+    def index_version(self):
+        return None if self._index is None else self._index.version
+
+    def load_documents(self):
         self.load_documents_dict()
         self.gen_tf_values()
-        self._idf_values = None
+        self.gen_index()
+
+    def make_index(self):
+        # Makes the index from the documents in the database, with the idf values worked out again from them, rather
+        # than the ones in unique_words, which are from when they were last made. Used by maintenance.py.
+        self.load_documents_dict()
+        self.gen_tf_values()
+        self.gen_unique_words()
+        self.gen_idf_values()  # Makes the index
 
     def load_documents_dict(self):
+        self._documents_change = self._connection.query("SELECT MAX(change_id) FROM search_index_changes")[0][0] or 0
+        # Found first, so a change made while the documents are read is made on the index again
         self._documents_dict = []
         self._documents = []
         res = self._connection.query("""
@@ -75,15 +266,7 @@ class DocumentCollection:
         unique_words = set(words)
 
         self._connection.query("DELETE FROM unique_words")
-        values = ""
-
-        for i in unique_words:
-            if i != "":
-                if values != "":
-                    values += ","
-                values += f'("{i}")'
-        
-        self._connection.query(f"INSERT INTO unique_words (word) VALUES {values}")
+        self._connection.insert_rows("unique_words", ("word",), [f'("{i}")' for i in unique_words if i != ""])
     
     def gen_tf_values(self, term=None):
         if term is None:
@@ -111,23 +294,35 @@ class DocumentCollection:
             return tf
     
     def num_documents_containing(self, string):
-        return sum(string in i for i in self._documents)
+        return sum(string in i.split(" ") for i in self._documents)
+
+    def document_frequencies(self):
+        # The number of documents containing each word, from one pass over the documents
+        return collections.Counter(itertools.chain(*[set(i.split(" ")) for i in self._documents]))
 
     def gen_idf_values(self):
         num_documents = len(self._documents)
+        frequencies = self.document_frequencies()
         self._idf_values = dict()
+        values = []
+        unused = []
         for word_id, word in self._connection.query("SELECT word_id, word FROM unique_words"):
-            idf = math.log10(num_documents / self.num_documents_containing(word))
-            self._connection.query("""
-                UPDATE unique_words
-                    SET idf_values={idf}
-                WHERE word_id={word_id}
-            """.format(
-                idf=idf,
-                word_id=word_id
-            ))
+            if frequencies[word] == 0:
+                unused.append(str(word_id))  # No longer in any document, so is never searched for
+                continue
+            idf = math.log10(num_documents / frequencies[word])
+            values.append(f'({word_id}, "{word}", {idf})')
 
             self._idf_values[word] = idf
+
+        if unused:
+            self._connection.query("DELETE FROM unique_words WHERE word_id IN ({})".format(",".join(unused)))  # So
+            # their old idf values are not read by idf_values
+        self._connection.insert_rows("unique_words", ("word_id", "word", "idf_values"), values,
+                                     update_columns=("idf_values",))  # Every row already exists, so only their idf
+        # values are updated
+
+        self.gen_index()  # The idf of every word may have changed
     
     @property
     def idf_values(self):
@@ -162,37 +357,267 @@ class DocumentCollection:
                 if i in self.idf_values and i in document_words:
                     res[i] = tf[i] * self.idf_values[i]
             return res
-    
-    def tfidf_search(self, terms):
+
+    def gen_index(self):
+        self._set_index(self._make_index())
+
+    def _make_index(self):
+        # Inverted index, so a search only looks at the documents that contain its words. Each word with an idf value
+        # is a row, in sorted order, so a word's row is found with a binary search. The postings of each word are the
+        # positions of the documents containing it, in document order, with the word's tf in each, stored one word
+        # after another (the postings of row r are from pointers[r] to pointers[r + 1]). The tf is multiplied by the
+        # idf when searching.
+        words = sorted(self.idf_values)
+        rows = {word: row for row, word in enumerate(words)}
+        postings = [[] for i in words]
+        for position, document in enumerate(self._documents_dict):
+            for word, tf in document["tf"].items():
+                if word in rows:
+                    postings[rows[word]].append((position, tf))
+
+        arrays = {
+            "vocabulary": np.array([i.encode() for i in words], dtype=bytes),
+            "pointers": np.cumsum([0] + [len(i) for i in postings], dtype=np.int64),
+            "positions": np.array([i[0] for i in itertools.chain(*postings)], dtype=np.int64),
+            "tf": np.array([i[1] for i in itertools.chain(*postings)], dtype=np.float64),
+            "idf": np.array([self.idf_values[word] for word in words], dtype=np.float64),
+            "document_types": np.array([i["type"] for i in self._documents_dict], dtype="U1"),
+            "document_ids": np.array([i["id"] for i in self._documents_dict], dtype=np.int64),
+            "last_change": np.array([self._documents_change], dtype=np.int64)
+        }
+
+        # The rows of the words in each document, the other way round to the postings, so the words of a document
+        # can be found when it is removed
+        arrays["document_rows"] = np.repeat(np.arange(len(words), dtype=np.int64), np.diff(arrays["pointers"]))[
+            np.argsort(arrays["positions"], kind="stable")]
+        arrays["document_pointers"] = np.cumsum(
+            np.concatenate(([0], np.bincount(arrays["positions"], minlength=len(arrays["document_ids"])))),
+            dtype=np.int64
+        )
+
+        return SearchIndex(arrays)
+
+    def _set_index(self, index):
+        if self._engine == "matrix":
+            index.matrix = index.make_matrix()  # Before it is used by any search
+        with self._changes_lock:
+            self._index = self._apply_changes(index)  # One assignment, so a search never sees part of each index
+
+    def save_index(self):
+        # Saved by maintenance.py, and loaded by each server process instead of reading the documents from the database
+        version = model_store.save_snapshot(self._index_directory, self._index.arrays())
+        self._index = self._index.replace(version=version)
+
+    def load_index(self, version=None):
+        self._set_index(self._read_index(version))
+
+    def _read_index(self, version=None):
+        version, arrays = model_store.load_snapshot(self._index_directory, version=version)
+        # Memory mapped, so the arrays are shared by every process through the page cache
+        return SearchIndex(arrays, version)
+
+    def refresh_index(self):
+        # Called between requests by each server process
+        if time.monotonic() - self._last_refresh < self._reload_interval:
+            return
+        self._last_refresh = time.monotonic()
+        self._update_index()
+
+    def _update_index(self):
+        # Swaps in the newest saved index once another process has saved one, and makes the changes made since, see
+        # add_document
+        if self._index_directory is not None:
+            version = model_store.current_version(self._index_directory)
+            if version is not None and version != self.index_version:
+                try:
+                    loaded = self._read_index(version)
+                except (OSError, KeyError, model_store.SnapshotNotFoundError):
+                    pass  # Removed or not fully written, so the current index is kept until the next check
+                else:
+                    self._set_index(loaded)
+                    return
+        with self._changes_lock:
+            self._index = self._apply_changes(self._index)
+
+    # -------------------------------------------------------------------------
+    # Changes since the index was made
+    # -------------------------------------------------------------------------
+    # For code that changes the books, authors or genres, so the change can be searched for straight away, without
+    # making the index again (see SearchIndex). Each change is written to search_index_changes, and every process
+    # makes the changes on its index when it next calls refresh_index, as does any process that loads an index made
+    # before them. The catalog tables should be changed as well, so the documents are the same when the index is next
+    # made, after which maintenance.py deletes the changes with clear_changes.
+    def _apply_changes(self, index):
+        # index with the changes it does not have yet. Only called with _changes_lock held.
+        rows = self._connection.query("""
+            SELECT change_id,
+                document_type,
+                document_id,
+                words
+            FROM search_index_changes
+            WHERE change_id>{}
+            ORDER BY change_id ASC
+        """.format(index.last_change))
+        for change_id, document_type, document_id, words in rows:
+            try:
+                if words is None:
+                    index = index.without_document(document_type, document_id)
+                else:
+                    index = index.with_document(document_type, document_id, self.gen_tf_values(words))  # Replaces
+                    # the document if it is already in the index
+            except DocumentNotFoundError:
+                pass  # Not in this index, e.g. it was made after the document was removed
+        if rows:
+            index = index.replace(last_change=rows[-1][0])
+        return index
+
+    def _change(self, document_type, document_id, words):
+        self._connection.query("""
+            INSERT INTO search_index_changes (document_type, document_id, words)
+            VALUES ("{}", {}, {})
+        """.format(document_type, document_id, "NULL" if words is None else f'"{words}"'))
+        self._update_index()  # Including any changes made by other processes before it
+
+    def add_document(self, document_type, document_id, words):
+        # words is the text of the document, the same as in load_documents_dict. A document with the same type and id
+        # is replaced.
+        self._change(document_type, document_id, clean_data(words))
+
+    def update_document(self, document_type, document_id, words):
+        if self._index.document_position(document_type, document_id) is None:
+            raise DocumentNotFoundError(document_type, document_id)
+        self.add_document(document_type, document_id, words)
+
+    def remove_document(self, document_type, document_id):
+        if self._index.document_position(document_type, document_id) is None:
+            raise DocumentNotFoundError(document_type, document_id)
+        self._change(document_type, document_id, None)
+
+    def clear_changes(self):
+        # Deletes the changes that are in the index, once it has been saved. Any process with an older index loads the
+        # saved one before it makes any more changes on it, see _update_index.
+        self._connection.query("DELETE FROM search_index_changes WHERE change_id<={}".format(self._index.last_change))
+
+    # -------------------------------------------------------------------------
+    # Searching
+    # -------------------------------------------------------------------------
+    def tfidf_search(self, terms, number=None):
+        # The documents most similar to the search, at most number of them (all of them if it is None)
+        index = self._index  # Read once, see SearchIndex
         terms = clean_data(terms)
         term_arr = terms.split(" ")
 
-        search_tfidf = self.gen_tfidf_values(document=terms)
-        result = []
-
-        self.gen_tfidf_values(search_terms=term_arr)
-
-        for document in self._documents_dict:
-            similarity = a_total = b_total = 0 # These are used to work out the magnitude of the vectors
-            tfidf = document["tfidf"]
-
-            for k in term_arr:
-                similarity += search_tfidf[k] * tfidf[k]
-                a_total += search_tfidf[k] ** 2
-                b_total += tfidf[k] ** 2
-            
-            if similarity > 0:
-                similarity /= (math.sqrt(a_total) * math.sqrt(b_total))
-                document["similarity"] = similarity
-                result.append({
-                    "type": document["type"],
-                    "similarity": document["similarity"],
-                    "id": document["id"]
-                })
-        
-        return sorted(result, key=lambda x: (-x["similarity"], x["type"]))  # Sort by similarity descending and type ascending.
-        # This puts authors above books if the rating is the same. Order would be authors -> books -> genres, if the certainty
-        # for all of them is the same
+        search_tf = self.gen_tf_values(terms)
+        rows = {k: index.word_row(k) for k in search_tf}
+
+        a_total = 0  # Used to work out the magnitude of the search vector
+        positions, products, squares = [], [], []
+        for k in term_arr:  # A repeated word is counted each time it is in the search
+            row = rows.get(k)
+            idf = index.word_idf(k, row)
+            if idf is None:
+                continue  # Its tfidf is 0
+            search_tfidf = search_tf[k] * idf
+            a_total += search_tfidf ** 2
+
+            postings = []
+            if row is not None:
+                start, end = index.pointers[row], index.pointers[row + 1]
+                postings.append((index.positions[start:end], index.tf[start:end]))
+            if k in index.added_postings:
+                postings.append(tuple(np.array(i) for i in index.added_postings[k]))
+            for word_positions, word_tf in postings:
+                tfidf = word_tf * idf
+                positions.append(word_positions)
+                products.append(search_tfidf * tfidf)
+                squares.append(tfidf ** 2)
+
+        if not positions:
+            return []
+        documents, inverse = np.unique(np.concatenate(positions), return_inverse=True)
+        similarity = np.bincount(inverse, np.concatenate(products))  # Added up in the order of the words, the same as
+        # a loop over them
+        b_total = np.bincount(inverse, np.concatenate(squares))  # Magnitude of each document, over the search words
+        found = similarity > 0
+        if index.removed:
+            found &= ~np.isin(documents, list(index.removed))
+        documents = documents[found]
+        similarity = np.round(similarity[found] / (math.sqrt(a_total) * np.sqrt(b_total[found])),
+                              SIMILARITY_DIGITS).tolist()
+
+        types, ids = index.document_keys(documents)
+        ids = dict(zip(documents.tolist(), ids))
+        ranked = zip([-i for i in similarity], types, documents.tolist())
+        ranked = sorted(ranked) if number is None else heapq.nsmallest(number, ranked)  # Sort by similarity descending
+        # and type ascending. This puts authors above books if the rating is the same. Order would be authors -> books
+        # -> genres, if the certainty for all of them is the same. Then by document order, as the sort was stable.
+        return [
+            {"type": document_type, "similarity": -similarity, "id": ids[position]}
+            for similarity, document_type, position in ranked
+        ]
+
+    def matrix_search(self, terms, number=None):
+        # Chosen with the "search engine" setting of "matrix". Ranks the same as tfidf_search: the cosine only covers
+        # the search words, and uses the current idf values. The documents in the index are scored with two sparse
+        # matrix products over the columns of the search words, rather than by adding up each word's postings, and
+        # the documents added since the index was made are scored from their postings.
+        index = self._index  # Read once, see SearchIndex
+        terms = clean_data(terms)
+        search_tf = self.gen_tf_values(terms)
+
+        a_total = 0  # Used to work out the magnitude of the search vector
+        columns, products, squares = [], [], []  # The weights of the search words' columns in each matrix product
+        added_positions, added_products, added_squares = [], [], []
+        for word, count in collections.Counter(terms.split(" ")).items():  # A repeated word is counted each time it
+            # is in the search, the same as tfidf_search
+            row = index.word_row(word)
+            idf = index.word_idf(word, row)
+            if word not in search_tf or idf is None:
+                continue  # Its tfidf is 0
+            search_tfidf = search_tf[word] * idf
+            a_total += count * search_tfidf ** 2
+
+            if row is not None:
+                columns.append(row)
+                products.append(count * search_tfidf * idf)
+                squares.append(count * idf ** 2)
+            if word in index.added_postings:
+                word_positions, word_tf = (np.array(i) for i in index.added_postings[word])
+                added_positions.append(word_positions)
+                added_products.append(count * search_tfidf * word_tf * idf)
+                added_squares.append(count * (word_tf * idf) ** 2)
+
+        if a_total == 0:
+            return []
+        tf = index.matrix[:, columns]  # Documents by search words
+        similarity = tf.dot(np.array(products))
+        b_total = tf.multiply(tf).dot(np.array(squares))  # Magnitude of each document, over the search words
+        if index.added:
+            added_similarity = np.zeros(len(index.added))
+            added_b_total = np.zeros(len(index.added))
+            if added_positions:
+                positions = np.concatenate(added_positions) - len(index.document_ids)
+                np.add.at(added_similarity, positions, np.concatenate(added_products))
+                np.add.at(added_b_total, positions, np.concatenate(added_squares))
+            similarity = np.concatenate((similarity, added_similarity))
+            b_total = np.concatenate((b_total, added_b_total))
+        similarity = np.round(np.divide(similarity, math.sqrt(a_total) * np.sqrt(b_total),
+                                        out=np.zeros(len(similarity)), where=b_total > 0), SIMILARITY_DIGITS)
+        if index.removed:
+            similarity[list(index.removed)] = 0
+
+        found = np.flatnonzero(similarity > 0)
+        if number is not None and number < len(found):
+            cutoff = similarity[found[np.argpartition(-similarity[found], number - 1)[number - 1]]] if number else np.inf
+            found = found[similarity[found] >= cutoff]  # Everything tied with the last result, so ties are ordered
+            # the same as tfidf_search before they are cut off
+        types, ids = index.document_keys(found)
+        order = np.lexsort((found, np.array(types, dtype="U1"), -similarity[found]))[:number].tolist()
+
+        return [
+            {"type": types[i], "similarity": score, "id": ids[i]}
+            for i, score in zip(order, similarity[found[order]].tolist())
+        ]
     
     def database_search(self, search):
         output_dict = dict()
@@ -206,8 +631,11 @@ class DocumentCollection:
             except components.books.BookNotFoundError:
                 pass
     
-        search_result = self.tfidf_search(search)
-        for count, res in enumerate(search_result[:self._result_limit - addition]):
+        if self._engine == "matrix":
+            search_result = self.matrix_search(search, max(self._result_limit - addition, 0))
+        else:
+            search_result = self.tfidf_search(search, max(self._result_limit - addition, 0))
+        for count, res in enumerate(search_result):
             if res["type"] == "b":
                 temp = self._books.get_summary(res["id"])
                 temp["type"] = "b"
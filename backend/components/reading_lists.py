@@ -266,6 +266,8 @@ class ReadingLists:
             list_id=list_id
         ))
 
+        self._recommendations.notify_interaction(user_id)
+
     def add_entry(self, user_id, list_id, book_id):
         self._recommendations.delete_recommendation(user_id, book_id, bad_recommendation=False)
         # Delete recommendation when added to a list
@@ -297,6 +299,8 @@ class ReadingLists:
                 list_id=list_id
             ))
 
+            self._recommendations.notify_interaction(user_id)
+
     def move_entry(self, user_id, start_list_id, end_list_id, book_id):
         self.add_entry(user_id, end_list_id, book_id)  # This changes the date
         # added, but this is not an issue as
@@ -323,6 +327,8 @@ class ReadingLists:
         """.format(list_id=list_id, user_id=user_id))
         # Delete the list name
 
+        self._recommendations.notify_interaction(user_id)
+
     def create_list(self, user_id, list_name):
         self._connection.query("""
             INSERT INTO reading_list_names (user_id, list_name) VALUES
@@ -1,11 +1,13 @@
 # -----------------------------------------------------------------------------
 # Standard Python library imports
 # -----------------------------------------------------------------------------
-import math
+import time
 import random
-import datetime
+import collections
+import concurrent.futures
+import multiprocessing.shared_memory
 import numpy as np
-import sklearn.metrics
+import scipy.sparse
 
 # -----------------------------------------------------------------------------
 # Project imports
@@ -18,7 +20,11 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 import configuration
+import evaluation
+import ml_utilities
+import model_store
 import mysql_handler
+import nearest_neighbours
 
 # -----------------------------------------------------------------------------
 # Project imports
@@ -28,18 +34,353 @@ class NoUserPreferencesError(Exception):
         message = f"User with id {user_id}, has no preferences"
         super().__init__(message)
 
+# -----------------------------------------------------------------------------
+# Review matrix construction
+# -----------------------------------------------------------------------------
+def id_index_lookup(ids):
+    # Dense array indexed by database id, giving the matrix row/column of that id, or -1 if it is not in the matrix.
+    # Ids are auto incremented so are small and fairly dense, so this is much faster than a dictionary for arrays.
+    ids = np.asarray(ids, dtype=np.int64)
+    lookup = np.full(int(ids.max()) + 1 if len(ids) else 1, -1, dtype=np.int64)
+    lookup[ids] = np.arange(len(ids))
+    return lookup
+
+
+def ids_to_indexes(lookup, ids):
+    ids = np.asarray(ids, dtype=np.int64)
+    indexes = np.full(len(ids), -1, dtype=np.int64)
+    in_range = (ids >= 0) & (ids < len(lookup))
+    indexes[in_range] = lookup[ids[in_range]]
+    return indexes  # Unknown ids are -1, so can be filtered out by the caller
+
+
+# The query for each signal used by build_review_matrix, with where to put the condition that limits it to some of
+# the users, the column it is on, the keyword it starts with, and the type of each column. Used by
+# Recommendations.load_interactions, and by interaction_export.py, so a snapshot has exactly the same data.
+INTERACTION_QUERIES = {
+    "reviews": ("""
+        SELECT user_id,
+            book_id,
+            (overall_rating + IFNULL(character_rating, overall_rating) + IFNULL(plot_rating, overall_rating)) / 3
+        FROM reviews
+        {}
+        ORDER BY review_id;
+    """, "user_id", "WHERE", (np.int64, np.int64, float)),
+    "initial_preferences": ("""
+        SELECT initial_preferences.user_id,
+            books.book_id
+        FROM initial_preferences
+        INNER JOIN books
+            ON books.author_id=initial_preferences.author_id
+        {}
+        GROUP BY initial_preferences.user_id, books.book_id
+    """, "initial_preferences.user_id", "WHERE", (np.int64, np.int64)),
+    "reading_lists": ("""
+        SELECT reading_lists.user_id,
+            reading_lists.book_id
+        FROM reading_lists
+        INNER JOIN reading_list_names
+            ON reading_lists.list_id=reading_list_names.list_id
+        {}
+        GROUP BY reading_lists.user_id, reading_lists.book_id;
+    """, "reading_lists.user_id", "WHERE", (np.int64, np.int64)),
+    "author_following": ("""
+        SELECT author_followers.user_id,
+            books.book_id
+        FROM author_followers
+        INNER JOIN books
+            ON books.author_id=author_followers.author_id
+        {}
+    """, "author_followers.user_id", "WHERE", (np.int64, np.int64)),
+    "bad_recommendations": ("""
+        SELECT user_id,
+            book_id
+        FROM bad_recommendations
+        WHERE date_added>DATE_SUB(NOW(), INTERVAL 10 WEEK)
+        {}
+    """, "user_id", "AND", (np.int64, np.int64)),  # The same expiry as purge_interactions, so older ones are
+    # not used even if they have not been deleted yet
+    "diary_entries": ("""
+        SELECT user_id,
+            book_id,
+            (SUM(overall_rating) + SUM(IFNULL(character_rating, overall_rating)) + SUM(IFNULL(plot_rating, overall_rating))) / (COUNT(entry_id) * 3)
+        FROM diary_entries
+        {}
+        GROUP BY user_id, book_id;
+    """, "user_id", "WHERE", (np.int64, np.int64, float))
+}
+
+
+def load_interaction_snapshot(filename):
+    # The catalog ids, and the interactions in the same format as Recommendations.load_interactions, from a file made
+    # by interaction_export.py. Each column is saved as <signal>_<column number>.
+    with np.load(filename) as arrays:
+        catalog = {name: arrays[name] for name in ("user_ids", "book_ids", "genre_ids")}
+        interactions = {name: [arrays[f"{name}_{count}"] for count in range(len(types))]
+                        for name, (query, column, keyword, types) in INTERACTION_QUERIES.items()}
+    return catalog, interactions
+
+
+def build_review_matrix(interactions, user_ids, book_ids, initial_value, reading_list_increase, following_increase,
+                        bad_value, minimum_reviews, sparse=False):
+    # The users * books matrix of ratings, from the interactions of every user at once (see load_interactions). Reviews
+    # and diary entries give their ratings, initial preferences give a starting value to users with few reviews,
+    # reading lists and followed authors raise a value by a percentage, and bad recommendations overwrite it. Every
+    # signal is a set of (user, book) cells, so all the cells that are used are found once, and each rule is then a
+    # scatter into a vector of those cells, so the cost is linear in the number of interactions, not users * books.
+    num_users, num_books = len(user_ids), len(book_ids)
+    user_lookup = id_index_lookup(user_ids)
+    book_lookup = id_index_lookup(book_ids)
+
+    signals = dict()
+    for name, columns in interactions.items():
+        users = ids_to_indexes(user_lookup, columns[0])
+        books = ids_to_indexes(book_lookup, columns[1])
+        known = (users >= 0) & (books >= 0)
+        signals[name] = [users[known], books[known]] + [np.asarray(i, dtype=float)[known] for i in columns[2:]]
+
+    keys = np.concatenate([users * num_books + books for users, books, *_ in signals.values()])
+    cells, inverse = np.unique(keys, return_inverse=True)
+    values = np.zeros(len(cells))
+
+    cell_indexes = dict()
+    start = 0
+    for name, (users, *_) in signals.items():
+        cell_indexes[name] = inverse[start:start + len(users)]
+        start += len(users)
+
+    #    Reviews    #
+    users, books, ratings = signals["reviews"]
+    values[cell_indexes["reviews"]] = ratings
+    number_reviews = np.bincount(users, minlength=num_users)
+
+    #    Initial Preferences    #
+    users = signals["initial_preferences"][0]
+    has_preferences = np.zeros(num_users, dtype=bool)
+    has_preferences[users] = True
+    few_reviews = number_reviews <= minimum_reviews
+    np.add.at(values, cell_indexes["initial_preferences"][few_reviews[users]], initial_value)
+
+    active = ~few_reviews | has_preferences  # Users with few reviews and no initial preferences only use their reviews
+
+    #    Reading Lists    #
+    indexes = cell_indexes["reading_lists"][active[signals["reading_lists"][0]]]  # Unique, as the query is grouped
+    current = values[indexes]
+    values[indexes] = np.where(current == 0, initial_value, current * (1 + reading_list_increase))
+
+    #    Authors following    #
+    indexes = cell_indexes["author_following"][active[signals["author_following"][0]]]
+    indexes, counts = np.unique(indexes, return_counts=True)  # A book can be found more than once if the author is
+    # followed more than once. The first sets the initial value, and every other one is a percentage increase.
+    current = values[indexes]
+    values[indexes] = np.where(
+        current == 0,
+        initial_value * (1 + following_increase) ** (counts - 1),
+        current * (1 + following_increase) ** counts
+    )
+
+    #    Bad Recommendations    #
+    values[cell_indexes["bad_recommendations"][active[signals["bad_recommendations"][0]]]] = bad_value
+
+    #    Diary entries    #
+    users, books, ratings = signals["diary_entries"]
+    np.add.at(values, cell_indexes["diary_entries"][active[users]], ratings[active[users]])
+
+    if sparse:
+        mat = scipy.sparse.csr_matrix(
+            (values, (cells // num_books, cells % num_books)),
+            shape=(num_users, num_books)
+        )
+        mat.eliminate_zeros()  # Cells can be reset to 0 by the rules, and should not be stored
+        return mat
+
+    mat = np.zeros((num_users, num_books))
+    mat.flat[cells] = values
+    return mat
+
+
+# -----------------------------------------------------------------------------
+# Scoring
+# -----------------------------------------------------------------------------
+def top_recommendations(user_vectors, book_factors, excluded, number, book_norms=None, book_scales=None):
+    # Finds the highest scoring books, that are not excluded, for each of the given users. Returns the book indexes,
+    # which are -1 if there are not enough books that are not excluded, the dot products, and the certainties, which
+    # are the cosine similarities between the user and book vectors, limited to 1. book_scales is given if the book
+    # factors are stored as int8.
+    if book_norms is None:
+        book_norms = ml_utilities.factor_norms(book_factors, book_scales)
+
+    scores = ml_utilities.factor_scores(user_vectors, book_factors, book_scales)
+    scores[excluded] = -np.inf
+
+    number = min(number, scores.shape[1])
+    if number == 0:
+        empty = np.zeros((len(scores), 0))
+        return empty.astype(np.int64), empty, empty
+
+    top = np.argpartition(-scores, number - 1, axis=1)[:, :number]  # Only the top books are sorted
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.lexsort((top, -top_scores), axis=1)  # Highest score first, then lowest index, the same as a stable sort
+    top = np.take_along_axis(top, order, axis=1)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+    norms = np.linalg.norm(user_vectors, axis=1)[:, np.newaxis] * book_norms[top]
+    certainties = np.zeros(top_scores.shape)
+    np.divide(top_scores, norms, out=certainties, where=(norms > 0) & np.isfinite(top_scores))
+    certainties = np.minimum(certainties, 1)  # Slim chance it ends up larger than 100%, so limits it artificially.
+
+    top[~np.isfinite(top_scores)] = -1
+    return top, top_scores, certainties
+
+
+def top_books(user_vectors, book_factors, excluded, number, block_size=1024):
+    # The top book indexes for any number of users, found block_size users at a time so the full score matrix is
+    # never made. excluded is a sparse matrix, with a row for each user.
+    excluded = scipy.sparse.csr_matrix(excluded)
+    top = [np.zeros((0, min(number, len(book_factors))), dtype=np.int64)]
+    for start in range(0, len(user_vectors), block_size):
+        top.append(top_recommendations(
+            user_vectors[start:start + block_size],
+            book_factors,
+            excluded[start:start + block_size].toarray(),
+            number
+        )[0])
+    return np.concatenate(top)
+
+
+# -----------------------------------------------------------------------------
+# Training
+# -----------------------------------------------------------------------------
+def als_step(ratings, fixed, solver, hyperparam, confidence_weight, gram=None):
+    # Solves every row of ratings against the fixed factors. gram is fixed^T fixed + hyperparam * I, which can be
+    # passed in when it has already been found, so it is not repeated for every shard.
+    if gram is None:
+        gram = fixed.T.dot(fixed) + np.eye(fixed.shape[1]) * hyperparam
+    if solver == "implicit":
+        return ml_utilities.implicit_als_step(ratings, fixed, hyperparam, confidence_weight, gram=gram)
+    return ratings.dot(fixed).dot(np.linalg.inv(gram))
+
+
+_training_worker = dict()  # State of a training worker process, set once when the process is started
+
+
+def _start_training_worker(ratings, transposed, memory_names, shapes, solver, hyperparam, confidence_weight):
+    memory = [multiprocessing.shared_memory.SharedMemory(name=i) for i in memory_names]
+    _training_worker["memory"] = memory  # Kept so the buffers are not closed while in use
+    _training_worker["ratings"] = {"users": ratings, "books": transposed}
+    _training_worker["factors"] = {
+        "users": np.ndarray(shapes[0], dtype=np.float64, buffer=memory[0].buf),
+        "books": np.ndarray(shapes[1], dtype=np.float64, buffer=memory[1].buf)
+    }
+    _training_worker["solver"] = (solver, hyperparam, confidence_weight)
+
+
+def _solve_shard(solving, start, stop, gram):
+    fixed = _training_worker["factors"]["books" if solving == "users" else "users"]
+    ratings = _training_worker["ratings"][solving][start:stop]
+    _training_worker["factors"][solving][start:stop] = als_step(ratings, fixed, *_training_worker["solver"], gram=gram)
+    # Each shard writes to its own rows of the shared matrix, so nothing needs to be sent back
+
+
+class ParallelTrainer:
+    # Runs the ALS half steps over a pool of processes. Each worker is given the ratings once when it starts, and the
+    # factor matrices are held in shared memory, so each task only sends which rows to solve and the gram matrix.
+    def __init__(self, ratings, transposed, user_factors, book_factors, workers, solver, hyperparam,
+                 confidence_weight, shards_per_worker=4):
+        self._hyperparam = hyperparam
+        self._memory = []
+        factors = []
+        for initial in (user_factors, book_factors):
+            memory = multiprocessing.shared_memory.SharedMemory(create=True, size=max(1, initial.nbytes))
+            self._memory.append(memory)
+            factors.append(np.ndarray(initial.shape, dtype=np.float64, buffer=memory.buf))
+            factors[-1][:] = initial
+        self.user_factors, self.book_factors = factors
+
+        self._shards = dict()
+        for name, rows in (("users", ratings.shape[0]), ("books", ratings.shape[1])):
+            bounds = np.linspace(0, rows, workers * shards_per_worker + 1).astype(int)
+            self._shards[name] = [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+            # More shards than workers, so a worker that finishes early can take another shard
+
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_start_training_worker,
+            initargs=(ratings, transposed, [i.name for i in self._memory], [i.shape for i in factors], solver,
+                      hyperparam, confidence_weight)
+        )
+
+    def step(self, solving):
+        fixed = self.book_factors if solving == "users" else self.user_factors
+        gram = fixed.T.dot(fixed) + np.eye(fixed.shape[1]) * self._hyperparam  # Found once, rather than per shard
+        futures = [self._executor.submit(_solve_shard, solving, start, stop, gram) for start, stop in
+                   self._shards[solving]]
+        for future in futures:
+            future.result()  # Waits for every shard, and raises any error from a worker
+
+    def sweep(self):
+        self.step("users")
+        self.step("books")
+
+    def close(self):
+        self._executor.shutdown()
+        self.user_factors = self.book_factors = None  # The buffers cannot be released while an array uses them
+        for memory in self._memory:
+            memory.close()
+            memory.unlink()
+
+# -----------------------------------------------------------------------------
+# Model
+# -----------------------------------------------------------------------------
+# The parts of a trained model that the requests read. Recommendations keeps the one it serves in self._model, and
+# only ever replaces it as a whole, so a request that reads self._model once uses the same model throughout, even if
+# refresh_model swaps in a newer one part way through. cache holds what is made from the factors the first time it is
+# needed (the book norms, the gram matrix and the nearest neighbour index). It only ever holds values made from the
+# same factors, so two threads filling it at once both store the same thing.
+Model = collections.namedtuple("Model", ("version", "book_ids", "book_index_table", "book_id_lookup", "genre_ids",
+                                         "book_factors", "book_scales", "author_rows", "author_genre_ids",
+                                         "author_genre_sums", "author_genre_counts", "cache"))
+
+
 # -----------------------------------------------------------------------------
 # Recommendations
 # -----------------------------------------------------------------------------
 class Recommendations:
-    def __init__(self, connection, num_converge_iters, hyperparam, number_display_genres, initial_recommendation_mat_val, reading_list_percentage_increase, following_percentage_increase, bad_recommendation_value, minimum_required_reviews, number_recommendations, debug=False):
+    def __init__(self, connection, num_converge_iters, hyperparam, number_display_genres, initial_recommendation_mat_val, reading_list_percentage_increase, following_percentage_increase, bad_recommendation_value, minimum_required_reviews, number_recommendations, debug=False, sparse=False, solver="wals", confidence_weight=10, convergence_tolerance=0, warm_start=False, model_directory=None, fold_in=False, generation_block_size=1024, training_workers=1, early_stopping_metric="", serving_precision="float64", incremental_generation=False, number_similar_books=20, similarity_threshold=0, index_tables=16, index_bits=10, index_probes=3, reload_interval=5):
         self._connection = connection
         self._num_converge_iters = num_converge_iters
         self._hyperparam = hyperparam
-        self._num_factors = len(self._connection.query("SELECT * FROM genres"))
         self.debug = debug
-        self._num_users = len(self._connection.query("SELECT user_id FROM users"))
-        self._num_books = len(self._connection.query("SELECT book_id FROM books"))
+        self._sparse = sparse  # Keeps the ratings in CSR form, so memory grows with the number of interactions, not
+        # users * books
+        self._solver = solver  # "wals" treats every unknown rating as a 0, "implicit" uses confidence weighted ALS
+        self._confidence_weight = confidence_weight
+        self._convergence_tolerance = convergence_tolerance  # Stops fitting once the relative improvement in the
+        # training loss between sweeps is smaller than this. 0 always runs every iteration.
+        self._warm_start = warm_start
+        self._model_directory = model_directory or None  # Trained models are saved here, and loaded from here if
+        # they exist, instead of using the database
+        self.model_version = None
+        self._model = None  # See Model. Set once the factors are loaded.
+        self._fold_in = fold_in  # Updates a user's factors and recommendations as soon as they interact with a book.
+        # This is done in the request that made the change, so makes it slower. Otherwise the user is only marked as
+        # dirty, and updated by the next gen_recommendations.
+        self._generation_block_size = generation_block_size  # Number of users scored at once by gen_recommendations
+        self._training_workers = training_workers  # Number of processes used by fit. 1 trains in this process.
+        self._early_stopping_metric = early_stopping_metric  # Ranking measure from evaluation.evaluate that stops fit
+        # once it gets worse on the held out ratings. An empty string does not use it.
+        self._serving_precision = serving_precision  # float64, float32 or int8. The precision the factors are kept at
+        # once they are trained. Training is always float64.
+        self.user_scales = self.book_scales = None  # Only used for int8 factors
+        self._author_rows = None  # Author id to its row of author_genre_sums, made with the model
+        self._incremental_generation = incremental_generation  # Default for gen_recommendations
+        self._number_similar_books = number_similar_books  # Number of similar books stored for each book
+        self._similarity_threshold = similarity_threshold  # Books need to be more similar than this to be stored
+        self._index_tables = index_tables  # Size of the nearest neighbour index of the book factors, see
+        self._index_bits = index_bits  # nearest_neighbours.RandomProjectionIndex. More tables and probes, or fewer
+        self._index_probes = index_probes  # bits, find more of the exact neighbours but are slower.
+        self._reload_interval = reload_interval  # Seconds between checks for a newer saved model, see refresh_model
+        self._last_refresh = time.monotonic()
         self._number_recommendations = number_recommendations
         self._min_required_reviews = minimum_required_reviews
         self._initial_recommendation_mat_val = initial_recommendation_mat_val
@@ -49,6 +390,7 @@ class Recommendations:
         self._num_display_genres = number_display_genres
         self.test_mse_record = []
         self.train_mse_record = []
+        self.train_loss_record = []
         self._list_users_no_preferences = {i[0] for i in self._connection.query(
             "SELECT user_id FROM users WHERE preferences_set=FALSE")}
         # Uses a set as it is faster for 'item in var' operations
@@ -58,8 +400,108 @@ class Recommendations:
         # sparsity of data, and preferences for recommendations, which would affect
         # how easily recommendations can change.
 
-        self.gen_lookup_tables()
-        self._load_book_factors()
+        if self._model_directory is not None and model_store.current_version(self._model_directory) is not None:
+            self.load_model()
+        else:
+            self._load_catalog()
+            self._load_book_factors()
+            self.gen_author_profiles()
+            self._model = self._make_model()
+
+    def _load_catalog(self, catalog=None):
+        # catalog is the ids from an interaction snapshot, see interaction_export. Otherwise they are queried.
+        if catalog is None:
+            self.gen_lookup_tables()
+        else:
+            self._set_lookup_tables(catalog["user_ids"], catalog["book_ids"], catalog["genre_ids"])
+        self._num_factors = len(self.genre_ids)
+        self._num_users = len(self.user_ids)
+        self._num_books = len(self.book_ids)
+
+    def load_model(self, version=None):
+        self.model_version, arrays = model_store.load_snapshot(self._model_directory, version=version)
+        # The arrays are memory mapped and read only, so are shared with every other process that loads them
+
+        self.user_factors = arrays["user_factors"]
+        self.book_factors = arrays["book_factors"]
+        self._set_lookup_tables(arrays["user_ids"], arrays["book_ids"], arrays["genre_ids"])
+        self._num_users, self._num_factors = self.user_factors.shape
+        self._num_books = len(self.book_factors)
+        self._factor_user_ids = arrays["user_ids"]
+        self._factor_book_ids = arrays["book_ids"]
+        self.user_scales = arrays.get("user_scales")
+        self.book_scales = arrays.get("book_scales")
+
+        if ml_utilities.factor_precision(self.book_factors, self.book_scales) != self._serving_precision:
+            self._compact_model()  # Saved at a different precision, so is converted, and is no longer shared
+
+        if "author_genre_ids" in arrays:
+            self._set_author_profiles(arrays["author_ids"], arrays["author_genre_ids"], arrays["author_genre_sums"],
+                                      arrays["author_genre_counts"])
+        else:
+            self.gen_author_profiles()  # Saved before the profiles (or their genres) were, so they are made from the
+            # database once, rather than by the requests that use them
+
+        index = None
+        index_arrays = {i: arrays["book_index_" + i] for i in ("planes", "codes", "order")
+                        if "book_index_" + i in arrays}
+        if len(index_arrays) == 3 and index_arrays["planes"].shape[:2] == (self._index_tables, self._index_bits):
+            index = nearest_neighbours.RandomProjectionIndex.from_arrays(
+                self.book_factors, index_arrays, self.book_scales, self._index_probes)  # Loaded rather than built,
+            # unless the settings have changed
+
+        model = self._make_model(index)
+        self.book_index(model)
+        self._book_norms(model)  # Made now, rather than by the first request to use them
+        self._model = model
+
+    def refresh_model(self):
+        # Called between requests by each server process. Swaps in the newest saved model once one has been saved by
+        # maintenance.py, which is also what trains it.
+        if self._model_directory is None or time.monotonic() - self._last_refresh < self._reload_interval:
+            return
+        self._last_refresh = time.monotonic()
+
+        version = model_store.current_version(self._model_directory)
+        if version is not None and version != self._model.version:
+            try:
+                self.load_model(version)  # Requests only read self._model, which is replaced by one assignment once
+                # everything else has loaded, so it is never partly old and partly new, and the old arrays are freed
+                # once nothing refers to them
+            except (OSError, KeyError, model_store.SnapshotNotFoundError):
+                pass  # Removed or not fully written, so the current model is kept until the next check
+
+    def _make_model(self, index=None):
+        return Model(self.model_version, self.book_ids, self.book_index_table, self._book_id_lookup, self.genre_ids,
+                     self.book_factors, self.book_scales, self._author_rows, self.author_genre_ids,
+                     self.author_genre_sums, self.author_genre_counts, dict() if index is None else {"index": index})
+
+    def _compact_model(self):
+        self.user_factors, self.user_scales = ml_utilities.compact_factors(
+            ml_utilities.expand_factors(self.user_factors, self.user_scales), self._serving_precision)
+        self.book_factors, self.book_scales = ml_utilities.compact_factors(
+            ml_utilities.expand_factors(self.book_factors, self.book_scales), self._serving_precision)
+
+    def save_model(self):
+        arrays = {
+            "user_factors": self.user_factors,
+            "book_factors": self.book_factors,
+            "user_ids": self.user_ids,
+            "book_ids": self.book_ids,
+            "genre_ids": self.genre_ids
+        }
+        if self.book_scales is not None:
+            arrays["user_scales"] = self.user_scales
+            arrays["book_scales"] = self.book_scales
+        arrays.update({"book_index_" + k: v for k, v in self.book_index().to_arrays().items()})
+        if self._author_rows is not None:
+            arrays["author_ids"] = self.author_ids
+            arrays["author_genre_ids"] = self.author_genre_ids
+            arrays["author_genre_sums"] = self.author_genre_sums
+            arrays["author_genre_counts"] = self.author_genre_counts
+        self.model_version = model_store.save_snapshot(self._model_directory, arrays)  # Saved at the serving
+        # precision, so the processes that load it can map it directly
+        self._model = self._model._replace(version=self.model_version)
 
     def _load_book_factors(self):
         self.book_factors = np.zeros((self._num_books, self._num_factors))
@@ -73,163 +515,377 @@ class Recommendations:
         """)
 
         for i, j, k in res:
-            book_id = list(self.book_lookup_table.keys())[list(self.book_lookup_table.values()).index(i)]
+            book_id = self.book_index_table[i]
             match_strengths = [float(z) for z in j.split(",")]
-            genre_ids = [list(self.genre_lookup_table.keys())[list(self.genre_lookup_table.values()).index(int(z))] for z in k.split(",")]
+            genre_ids = [self.genre_index_table[int(z)] for z in k.split(",")]
 
             for genre, match in zip(genre_ids, match_strengths):
                 self.book_factors[book_id][genre] = match
 
-    def fit(self):
-        train, test, = self.create_train_test()
+        self.user_factors = np.zeros((self._num_users, self._num_factors))  # User factors are not stored in the
+        # database, so are found by fit or fold_in_user
+        self._factor_user_ids = None
+        self._factor_book_ids = self.book_ids
+        self.user_scales = self.book_scales = None
+        self._compact_model()
+
+    def fit(self, snapshot=None):
+        # snapshot is a file made by interaction_export, which is trained from instead of querying the database, so
+        # the same data can be trained on repeatedly. The results are still saved to the database.
+        if snapshot is None:
+            self.purge_interactions()
+            self._load_catalog()  # The saved model may be from an older catalog
+            train, test, = self.create_train_test()
+        else:
+            catalog, interactions = load_interaction_snapshot(snapshot)
+            self._load_catalog(catalog)
+            train, test, = self.create_train_test(self.gen_review_matrix_bulk(interactions))
+
+        if self._solver == "implicit":
+            train = scipy.sparse.csr_matrix(train)  # Converted once, rather than every step
+            transposed = train.T.tocsr()
+        else:
+            transposed = train.T
 
-        self._num_users, self._num_books = train.shape
+        self._initialise_factors()
+        self.train_loss_record = []
+        self.validation_record = []
 
-        self.book_factors = np.random.random((self._num_books, self._num_factors))
-        self.user_factors = np.random.random((self._num_users, self._num_factors))
+        if self._early_stopping_metric:
+            held_out = (scipy.sparse.csr_matrix(test != 0).astype(np.int8) -
+                        scipy.sparse.csr_matrix(train != 0).astype(np.int8)) > 0  # The ratings removed from train
+            validation_users = np.flatnonzero(held_out.getnnz(axis=1))  # Only these can be scored
+            held_out = held_out[validation_users]
+            validation_excluded = scipy.sparse.csr_matrix(train != 0)[validation_users]
+        best = None  # (user factors, book factors) of the iteration with the best held out ranking
 
         if self.debug:  # Debug is about 10 times slower
             self.test_mse_record = []
             self.train_mse_record = []
 
-            for i in range(self._num_converge_iters):
-                print(f"Iteration {i + 1} of {self._num_converge_iters} Start")
-                self.user_factors = self.wals_step(train, self.book_factors)
-                self.book_factors = self.wals_step(train.T, self.user_factors)
-
-                predict = self.predict()
+        trainer = None
+        if self._training_workers > 1:
+            trainer = ParallelTrainer(train, transposed, self.user_factors, self.book_factors, self._training_workers,
+                                      self._solver, self._hyperparam, self._confidence_weight)
+            self.user_factors, self.book_factors = trainer.user_factors, trainer.book_factors
+            # The trainer updates the shared matrices in place, so the loss etc. can be found the same way as serially
 
-                self.train_mse_record.append(self.mean_squared_error(train, predict))
-                self.test_mse_record.append(self.mean_squared_error(test, predict))
-                print(f"Iteration {i + 1} of {self._num_converge_iters} End")
+        try:
+            for i in range(self._num_converge_iters):
+                if self.debug:
+                    print(f"Iteration {i + 1} of {self._num_converge_iters} Start")
 
+                if trainer is None:
+                    self.user_factors = self.solve_step(train, self.book_factors)
+                    self.book_factors = self.solve_step(transposed, self.user_factors)
+                else:
+                    trainer.sweep()
+                self.train_loss_record.append(self.training_loss(train))
+
+                if self.debug:
+                    self.train_mse_record.append(self.ratings_error(train))
+                    self.test_mse_record.append(self.ratings_error(test))
+                    print(f"Iteration {i + 1} of {self._num_converge_iters} End")
+
+                if self._early_stopping_metric:
+                    self.validation_record.append(evaluation.evaluate(
+                        top_books(self.user_factors[validation_users], self.book_factors, validation_excluded,
+                                  self._number_recommendations, self._generation_block_size),
+                        held_out
+                    )[self._early_stopping_metric])
+                    if self.validation_record[-1] > max(self.validation_record[:-1], default=-np.inf):
+                        best = (np.array(self.user_factors), np.array(self.book_factors))  # Copied, as the
+                        # factors are changed in place by the parallel trainer
+
+                if self.converged() or self.validation_stopped():
+                    break
+        finally:
+            if trainer is not None:
+                self.user_factors = np.array(trainer.user_factors)  # Copied out, as the shared memory is released
+                self.book_factors = np.array(trainer.book_factors)
+                trainer.close()
+
+        if best is not None:
+            self.user_factors, self.book_factors = best  # The iterations after it were over fitting
+
+        if self.debug:
             return self.test_mse_record, self.train_mse_record
 
+        self._factor_user_ids = self.user_ids
+        self._factor_book_ids = self.book_ids
+
+        self.save_book_genres()  # Not included in the debug option, as it increases time cost,
+        # and would likely be rerun a lot to find optimum parameters, so is unnecessary.
+        self.gen_author_profiles()  # From the genres that were just saved
+        self._compact_model()
+        self._model = self._make_model()  # Served from now on
+        if self._model_directory is not None:
+            self.save_model()
+
+    def _initialise_factors(self):
+        book_ids = self.book_ids
+        user_ids = self.user_ids
+
+        if (self._warm_start and self.book_factors.shape == (self._num_books, self._num_factors)
+                and np.array_equal(self._factor_book_ids, book_ids) and self.book_factors.any()):
+            self.book_factors = np.array(ml_utilities.expand_factors(self.book_factors, self.book_scales),
+                                         dtype=np.float64)  # Starts from the last saved factors, which are close to
+            # the result if only a few ratings have changed, so fewer iterations are needed. This is a copy, as the
+            # saved factors may be memory mapped.
         else:
-            for i in range(self._num_converge_iters):
-                self.user_factors = self.wals_step(train, self.book_factors)
-                self.book_factors = self.wals_step(train.T, self.user_factors)
+            self.book_factors = np.random.random((self._num_books, self._num_factors))
 
-            self.save_book_genres()  # Not included in the debug option, as it increases time cost,
-            # and would likely be rerun a lot to find optimum parameters, so is unnecessary.
+        if (self._warm_start and self._factor_user_ids is not None and np.array_equal(self._factor_user_ids, user_ids)
+                and self.user_factors.shape == (self._num_users, self._num_factors)):
+            self.user_factors = np.array(ml_utilities.expand_factors(self.user_factors, self.user_scales),
+                                         dtype=np.float64)
+        else:
+            self.user_factors = np.random.random((self._num_users, self._num_factors))  # These are replaced by the
+            # first step, which solves the user factors from the book factors
+        self.user_scales = self.book_scales = None
+
+    def training_loss(self, train):
+        if self._solver == "implicit":  # The implicit model predicts preference, so is compared to 1 for known ratings
+            train = train.copy()
+            train.data = np.ones(len(train.data))
+        return self.ratings_error(train)
+
+    def converged(self):
+        if len(self.train_loss_record) < 2:
+            return False
+
+        previous, current = self.train_loss_record[-2:]
+        if previous == 0:
+            return True
+        return (previous - current) / previous < self._convergence_tolerance
+
+    def validation_stopped(self, patience=2):
+        # Stops once the held out ranking has not improved for patience iterations, as more iterations after that are
+        # over fitting the training data. One bad iteration is allowed for, as the measure is noisy.
+        if len(self.validation_record) <= patience:
+            return False
+        return max(self.validation_record[-patience:]) <= max(self.validation_record[:-patience])
 
     def save_book_genres(self):
-        query = "INSERT INTO book_genres (book_id, genre_id, match_strength) VALUES "
+        values = []
         for count, facts in enumerate(self.book_factors):
             # i will be the rating for each the genres.
             book_id = self.book_lookup_table[count]
-            temp = ",".join(f"({book_id}, {self.genre_lookup_table[i]}, {strength})" for i, strength in enumerate(facts) if strength > 0)
-            if len(temp):
-                query += temp + ","
+            values += [f"({book_id}, {self.genre_lookup_table[i]}, {strength})" for i, strength in enumerate(facts) if strength > 0]
 
-        self._connection.query("DELETE FROM book_genres")  # Done here to minimise time without data in DB
-        self._connection.query(query[:-1])
-
-    def predict(self):
-        return self.user_factors.dot(self.book_factors.T)
-
-    def gen_review_matrix(self):
-        # x = np.array([[0.0 for i in range(num_books)] for k in range(num_users)])
-        mat = np.zeros((self._num_users, self._num_books))
-        for user in self.user_lookup_table:
-            user_id = self.user_lookup_table[user]
-            #    Reviews    #
-            reviews = self._connection.query("""
-                SELECT book_id,
-                    (overall_rating + IFNULL(character_rating, overall_rating) + IFNULL(plot_rating, overall_rating)) / 3
-                FROM reviews
-                WHERE user_id={}
-                GROUP BY review_id;
-            """.format(user_id))
-
-            for book_id, rating in reviews:
-                used_book_id = list(self.book_lookup_table.values()).index(book_id)  # This finds the key for the value stored in the lookup table.
-                # geeksforgeeks.org/python-get-key-from-value-in-dictionary
-                mat[user][used_book_id] = float(rating)
-
-            #    Initial Preferences    #
-            books = self._connection.query("""
-                SELECT books.book_id
-                FROM initial_preferences
-                INNER JOIN books
-                    ON books.author_id=initial_preferences.author_id
-                WHERE initial_preferences.user_id={}
-                GROUP BY books.book_id
-            """.format(user_id))  # Get a user's existing preferences
-
-            if len(reviews) <= self._min_required_reviews:
-                if len(books):
-                    for i in books:
-                        used_book_id = list(self.book_lookup_table.values()).index(i[0])
-                        mat[user][used_book_id] += self._initial_recommendation_mat_val  # This is a non-zero value so recommendation is made.
-                        # This is not affected by the average preference expressed by all the user's selected authors.
-                else:
-                    continue # The user has not set up any initial preferences yet.
-            elif len(books):
-                self._connection.query("""
-                    DELETE FROM initial_preferences
-                    WHERE user_id={}
-                """.format(user_id))
-
-            #    Reading Lists    #
-            lists = self._connection.query("""
-                SELECT reading_lists.book_id
-                FROM reading_lists
-                INNER JOIN reading_list_names
-                    ON reading_lists.list_id=reading_list_names.list_id
-                WHERE reading_lists.user_id={}
-                GROUP BY reading_lists.book_id;
-            """.format(user_id))
+        self._connection.replace_table("book_genres", ("book_id", "genre_id", "match_strength"), values)
+        # Swapped in all at once, so the genres are never missing while they are being written
 
-            for i in lists:
-                used_book_id = list(self.book_lookup_table.values()).index(i[0])
-                if mat[user][used_book_id] == 0:
-                    mat[user][used_book_id] = self._initial_recommendation_mat_val
-                else:
-                    mat[user][used_book_id] *= (1 + self._reading_list_percentage_increase)
-
-            #    Authors following    #
-            following = self._connection.query("""
-                SELECT books.book_id
-                FROM author_followers
-                INNER JOIN books
-                    ON books.author_id=author_followers.author_id
-                WHERE user_id={}
-            """.format(user_id))
+    def gen_author_profiles(self):
+        # The sum and number of each genre's match strengths over each author's books, so the average genres of any
+        # set of authors can be found without querying every book they have written. Authors without any books are
+        # included, with zeros, so the author ids are also every author that can be chosen.
+        res = self._connection.query("""
+            SELECT authors.author_id,
+                book_genres.genre_id,
+                SUM(book_genres.match_strength),
+                COUNT(book_genres.match_strength)
+            FROM authors
+            LEFT JOIN books
+                ON authors.author_id=books.author_id
+            LEFT JOIN book_genres
+                ON books.book_id=book_genres.book_id
+            GROUP BY authors.author_id, book_genres.genre_id;
+        """)
 
-            for i in following:
-                used_book_id = list(self.book_lookup_table.values()).index(int(i[0]))
-                if mat[user][used_book_id] == 0:
-                    mat[user][used_book_id] = self._initial_recommendation_mat_val
-                else:
-                    mat[user][used_book_id] *= (1 + self._following_percentage_increase)
-
-            #    Bad Recommendations    #
-            for book in self.get_bad_recommendations(user_id):
-                used_book_id = list(self.book_lookup_table.values()).index(book)
-                mat[user][used_book_id] = self._bad_recommendation_val  # = is used in case there is a good value here. It should be marked as bad.
-
-            #    Diary entries    #
-            entries = self._connection.query("""
-                SELECT book_id,
-                    (SUM(overall_rating) + SUM(IFNULL(character_rating, overall_rating)) + SUM(IFNULL(plot_rating, overall_rating))) / (COUNT(entry_id) * 3)
-                FROM diary_entries
-                WHERE user_id={}
-                GROUP BY book_id;
-            """.format(user_id))
+        author_ids = np.array(sorted({i[0] for i in res}), dtype=np.int64)
+        sums = np.zeros((len(author_ids), self._num_factors))
+        counts = np.zeros((len(author_ids), self._num_factors))
+        for author_id, genre_id, total, count in res:
+            if genre_id in self.genre_index_table:  # None if the author has no books, and genres added since the
+                # model was trained have no factor
+                row = np.searchsorted(author_ids, author_id)
+                sums[row, self.genre_index_table[genre_id]] = total
+                counts[row, self.genre_index_table[genre_id]] = count
+
+        self._set_author_profiles(author_ids, self.genre_ids, sums, counts)
+
+    def _set_author_profiles(self, author_ids, genre_ids, sums, counts):
+        self.author_ids = author_ids
+        self.author_genre_ids = np.array(genre_ids, dtype=np.int64)  # The genre of each column of the sums and counts
+        self.author_genre_sums = sums
+        self.author_genre_counts = counts
+        self._author_rows = {author_id: row for row, author_id in enumerate(author_ids.tolist())}
+
+    def save_book_similarities(self):
+        # Item-item similarities from co-occurrence. Each book is a column of the users * books matrix of which users
+        # have read, reviewed or listed it, so the cosine similarity of two columns measures how many of the same users
+        # have interacted with both. Only the most similar books are stored, so serving them is a single lookup.
+        book_ids = self.book_ids
+        users, books = self._query_columns("""
+            SELECT user_id,
+                book_id
+            FROM reading_lists
+            UNION
+            SELECT user_id,
+                book_id
+            FROM reviews
+            UNION
+            SELECT user_id,
+                book_id
+            FROM diary_entries
+        """, (np.int64, np.int64))  # UNION removes any duplicates, so each pair is only counted once
+
+        columns = ids_to_indexes(self._book_id_lookup, books)
+        known = columns >= 0
+        rows = np.unique(users[known], return_inverse=True)[1]  # Every user that has interacted with anything
+
+        interactions = scipy.sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, columns[known])),
+            shape=(rows.max(initial=-1) + 1, len(book_ids))
+        )
+        books, similar, similarities = ml_utilities.top_column_similarities(
+            interactions,
+            self._number_similar_books,
+            self._similarity_threshold
+        )
+
+        self._connection.replace_table(
+            "book_similarities",
+            ("book_id", "similar_book_id", "similarity"),
+            [f"({book_ids[i]}, {book_ids[k]}, {s})" for i, k, s in zip(books, similar, similarities)]
+        )  # Swapped in all at once, so the similar books are never missing
 
-            for book_id, rating in entries:
-                used_book_id = list(self.book_lookup_table.values()).index(book_id)
-                mat[user][used_book_id] += float(rating)  # += is used incase there is already a value at that index
+    def predict(self):
+        return ml_utilities.factor_scores(
+            ml_utilities.expand_factors(self.user_factors, self.user_scales),
+            self.book_factors,
+            self.book_scales
+        )
+
+    def ratings_error(self, ratings):
+        if not scipy.sparse.issparse(ratings):
+            return self.mean_squared_error(ratings, self.predict())
+
+        ratings = ratings.tocoo()  # Only the known cells are predicted, so the full users * books matrix is never made
+        predict = np.einsum("ij,ij->i", self.user_factors[ratings.row], self.book_factors[ratings.col])
+        return np.mean((ratings.data - predict) ** 2)
+
+    def _query_columns(self, query, types):
+        res = self._connection.query(query)
+        if not len(res):
+            return [np.zeros(0, dtype=i) for i in types]
+        return [np.array(column, dtype=i) for column, i in zip(zip(*res), types)]  # Ratings are given as Decimals,
+        # which numpy casts to float.
 
-        return mat
+    @staticmethod
+    def _user_filter(column, user_ids, keyword="WHERE"):
+        if user_ids is None:
+            return ""
+        return "{} {} IN ({})".format(keyword, column, ",".join(str(i) for i in user_ids))
+
+    def _query_interactions(self, name, user_ids=None):
+        query, column, keyword, types = INTERACTION_QUERIES[name]
+        return self._query_columns(query.format(self._user_filter(column, user_ids, keyword)), types)
+
+    def load_interactions(self, user_ids=None):
+        # Gets each signal for every user with one query each, rather than several queries per user. If user_ids is
+        # given, only the interactions for those users are found. Only reads, so it is safe to use while serving
+        # requests (e.g. by fold_in_user). The rows that are no longer used are deleted by purge_interactions.
+        return {name: self._query_interactions(name, user_ids) for name in INTERACTION_QUERIES}
+
+    def purge_interactions(self):
+        # Deletes the rows that load_interactions and build_review_matrix already ignore, so the tables do not keep
+        # growing. Done with the training, rather than by requests.
+        self._connection.query("""
+            DELETE FROM initial_preferences
+            WHERE user_id IN (
+                SELECT user_id
+                FROM reviews
+                GROUP BY user_id
+                HAVING COUNT(review_id)>{}
+            )
+        """.format(self._min_required_reviews))  # Initial preferences are not needed once the user has enough
+        # reviews
+        self._connection.query("""
+            DELETE FROM bad_recommendations
+            WHERE date_added<=DATE_SUB(NOW(), INTERVAL 10 WEEK)
+        """)  # Bad recommendations expire after 10 weeks, so a book can be recommended again if the user's
+        # preferences have changed. load_interactions and load_exclusions already ignore the expired rows.
+
+    def load_exclusions(self, user_ids=None, include_recent=True, model=None):
+        # Finds the books that should not be recommended to each user with a single query, as a sparse users * books
+        # boolean matrix. These are books that were recommended in the last 2 days, books in the users' standard
+        # reading lists, and bad recommendations. The rows are the given users, or every user in the lookup table.
+        # The columns are the books of the served model if it is given, or of the model being trained.
+        book_id_lookup, num_books = ((self._book_id_lookup, self._num_books) if model is None else
+                                     (model.book_id_lookup, len(model.book_ids)))
+        recent = """
+            SELECT user_id,
+                book_id
+            FROM recommendations
+            WHERE date_added>=DATE_SUB(NOW(), INTERVAL 2 DAY)
+            {}
+            UNION
+        """.format(self._user_filter("user_id", user_ids, keyword="AND"))
+
+        users, books = self._query_columns("""
+            {recent}
+            SELECT reading_lists.user_id,
+                reading_lists.book_id
+            FROM reading_lists
+            INNER JOIN reading_list_names
+                ON reading_lists.list_id=reading_list_names.list_id
+            WHERE reading_list_names.list_name IN (
+                    "Currently Reading",
+                    "Have Read",
+                    "Want To Read"
+                )
+                {reading_list_users}
+            UNION
+            SELECT user_id,
+                book_id
+            FROM bad_recommendations
+            WHERE date_added>DATE_SUB(NOW(), INTERVAL 10 WEEK)
+                {bad_recommendation_users}
+        """.format(
+            recent=recent if include_recent else "",
+            reading_list_users=self._user_filter("reading_lists.user_id", user_ids, keyword="AND"),
+            bad_recommendation_users=self._user_filter("user_id", user_ids, keyword="AND")
+        ), (np.int64, np.int64))  # Note that this covers the diary entries as well, as entries cannot be made unless
+        # it is in the have read/currently reading list. UNION removes any duplicates.
+
+        if user_ids is None:
+            rows = ids_to_indexes(self._user_id_lookup, users)
+            num_rows = len(self.user_ids)
+        else:
+            rows = ids_to_indexes(id_index_lookup(user_ids), users)
+            num_rows = len(user_ids)
+        columns = ids_to_indexes(book_id_lookup, books)
+        known = (rows >= 0) & (columns >= 0)
+
+        return scipy.sparse.csr_matrix(
+            (np.ones(np.count_nonzero(known), dtype=bool), (rows[known], columns[known])),
+            shape=(num_rows, num_books)
+        )
+
+    def gen_review_matrix_bulk(self, interactions=None):
+        return build_review_matrix(
+            self.load_interactions() if interactions is None else interactions,
+            self.user_ids,
+            self.book_ids,
+            self._initial_recommendation_mat_val,
+            self._reading_list_percentage_increase,
+            self._following_percentage_increase,
+            self._bad_recommendation_val,
+            self._min_required_reviews,
+            sparse=self._sparse
+        )
 
     def create_train_test(self, ratings=None):
         if ratings is None:
-            self.ratings = self.gen_review_matrix()
+            self.ratings = self.gen_review_matrix_bulk()
         else:
             self.ratings = ratings
 
+        if scipy.sparse.issparse(self.ratings):
+            return self._create_train_test_sparse(), self.ratings
+
         train = self.ratings.copy()
 
         while self.ratings.tolist() == train.tolist():
@@ -247,6 +903,29 @@ class Recommendations:
 
         return train, self.ratings
 
+    def _create_train_test_sparse(self):
+        # Holds out 20% of each user's ratings, by ranking the stored values of each row in a random order, rather than
+        # going through a dense copy of the matrix.
+        ratings = self.ratings.tocsr()
+        row_lengths = np.diff(ratings.indptr)
+        rows = np.repeat(np.arange(ratings.shape[0]), row_lengths)
+
+        order = np.lexsort((np.random.random(ratings.nnz), rows))  # Random order, within each row
+        rank = np.empty(ratings.nnz, dtype=np.int64)
+        rank[order] = np.arange(ratings.nnz) - ratings.indptr[rows[order]]
+        test = rank < np.round(row_lengths * 0.2)[rows]
+
+        if not test.any() and ratings.nnz:  # The training data must be different to the ratings
+            test[np.random.randint(ratings.nnz)] = True
+
+        train = ratings.copy()
+        train.data[test] = 0.0
+        train.eliminate_zeros()
+        return train
+
+    def solve_step(self, ratings, fixed):
+        return als_step(ratings, fixed, self._solver, self._hyperparam, self._confidence_weight)
+
     def wals_step(self, ratings, fixed):
         A = fixed.T.dot(fixed) + np.eye(self._num_factors) * self._hyperparam
         B = ratings.dot(fixed)
@@ -254,90 +933,198 @@ class Recommendations:
         return B.dot(A_inv)
 
     def gen_lookup_tables(self):
-        self.user_lookup_table = dict()
-        users = self._connection.query("SELECT user_id FROM users")
-        for count, i in enumerate(users):
-            self.user_lookup_table[count] = i[0]
+        self._set_lookup_tables(
+            [i[0] for i in self._connection.query("SELECT user_id FROM users")],
+            [i[0] for i in self._connection.query("SELECT book_id FROM books")],
+            [i[0] for i in self._connection.query("SELECT genre_id FROM genres")]
+        )
+
+    def _set_lookup_tables(self, user_ids, book_ids, genre_ids):
+        # The lookup tables go from a matrix index to a database id, the index tables from an id to its index, and the
+        # id arrays are the ids in index order, for converting many at once. The index tables are dictionaries, so
+        # each lookup does not search through every id.
+        self.user_ids = np.array(user_ids, dtype=np.int64)
+        self.book_ids = np.array(book_ids, dtype=np.int64)
+        self.genre_ids = np.array(genre_ids, dtype=np.int64)
+
+        self.user_lookup_table = dict(enumerate(self.user_ids.tolist()))
+        self.book_lookup_table = dict(enumerate(self.book_ids.tolist()))
+        self.genre_lookup_table = dict(enumerate(self.genre_ids.tolist()))
+
+        self.user_index_table = {user_id: index for index, user_id in self.user_lookup_table.items()}
+        self.book_index_table = {book_id: index for index, book_id in self.book_lookup_table.items()}
+        self.genre_index_table = {genre_id: index for index, genre_id in self.genre_lookup_table.items()}
+
+        self._user_id_lookup = id_index_lookup(self.user_ids)  # Dense, see id_index_lookup
+        self._book_id_lookup = id_index_lookup(self.book_ids)
+
+    def gen_recommendations(self, incremental=None):
+        # Scores blocks of users at once, so the full users * books prediction matrix is never made, and everything is
+        # written with one insert. If incremental, only the users that have interacted with anything since the last
+        # run are recommended to, and every other user keeps their current recommendations.
+        if incremental is None:
+            incremental = self._incremental_generation
+        started = self._connection.query("SELECT NOW()")[0][0]  # Users marked after this are kept for the next run
 
-        self.book_lookup_table = dict()
-        books = self._connection.query("SELECT book_id FROM books")
-        for count, i in enumerate(books):
-            self.book_lookup_table[count] = i[0]
+        self._list_users_no_preferences = {i[0] for i in self._connection.query(
+            "SELECT user_id FROM users WHERE preferences_set=FALSE")}
 
-        self.genre_lookup_table = dict()
-        genres = self._connection.query("SELECT genre_id FROM genres")
-        for count, i in enumerate(genres):
-            self.genre_lookup_table[count] = i[0]
+        user_ids = self.user_ids
+        book_ids = self.book_ids
+        book_norms = ml_utilities.factor_norms(self.book_factors, self.book_scales)  # Found once, rather than for
+        # every recommendation
 
-    def gen_recommendations(self):
-        predictions = self.predict()
+        users = np.flatnonzero(~np.isin(user_ids, list(self._list_users_no_preferences)))
+        if incremental:
+            users = users[np.isin(user_ids[users], self.get_dirty_users())]
+            exclusions = self.load_exclusions(user_ids[users].tolist()) if len(users) else None  # Row i is users[i]
+            rows = np.arange(len(users))
+        else:
+            exclusions = self.load_exclusions()
+            rows = users
+
+        values = []
+        for start in range(0, len(users), self._generation_block_size):
+            block = users[start:start + self._generation_block_size]
+
+            top, scores, certainties = top_recommendations(
+                ml_utilities.expand_factors(self.user_factors, self.user_scales, block),
+                self.book_factors,
+                exclusions[rows[start:start + self._generation_block_size]].toarray(),
+                self._number_recommendations,
+                book_norms,
+                self.book_scales
+            )
 
-        query = "INSERT INTO recommendations (user_id, book_id, certainty) VALUES "
+            for row, user in enumerate(block):
+                values += [f"({user_ids[user]}, {book_ids[i]}, {c})" for i, c in zip(top[row], certainties[row]) if i >= 0]
 
-        self._list_users_no_preferences = {i[0] for i in self._connection.query(
-            "SELECT user_id FROM users WHERE preferences_set=FALSE")}
+        if not incremental or len(users):
+            with self._connection.transaction():  # The old recommendations are never missing, and the ones written
+                # by requests while this is running (e.g. by add_user) are kept, as they are recent
+                self._connection.query("""
+                    DELETE FROM recommendations
+                    WHERE date_added<=DATE_SUB(NOW(), INTERVAL 2 DAY)
+                    {}
+                """.format(self._user_filter("user_id", None if not incremental else user_ids[users].tolist(),
+                                              keyword="AND")))  # Only the rows of the users that are rewritten
+                self._connection.insert_rows("recommendations", ("user_id", "book_id", "certainty"), values)
 
-        for user, books in enumerate(predictions):
-            user_books = []
-            user_id = self.user_lookup_table[user]
-
-            if user_id not in self._list_users_no_preferences:
-                avoid_recs = {
-                    i[0] for i in self._connection.query("""
-                        SELECT book_id
-                        FROM recommendations
-                        WHERE user_id={}
-                            AND date_added>=DATE_SUB(NOW(), INTERVAL 2 DAY)
-                    """.format(user_id))
-                }  # sets are faster for "is val in list" operations
-
-                res = self._connection.query("""
-                    SELECT book_id
-                    FROM reading_lists
-                    INNER JOIN reading_list_names
-                        ON reading_lists.list_id=reading_list_names.list_id
-                    WHERE reading_lists.user_id={}
-                        AND reading_list_names.list_name IN (
-                            "Currently Reading",
-                            "Have Read",
-                            "Want To Read"
-                        )
-                """.format(user_id))  # Note that this covers the diary entries as well, as entries cannot be made unless it is in the have read/currently reading list
-
-                for i in res:
-                    avoid_recs.add(i[0])
-
-                for i in self.get_bad_recommendations(user_id):
-                    avoid_recs.add(i)
-
-                for book, rating in enumerate(books):
-                    book_id = self.book_lookup_table[book]
-                    if book_id not in avoid_recs:
-                        user_books.append({
-                            "id": book_id,
-                            "dot_product": rating
-                        })
-
-                user_books.sort(key=lambda x: x["dot_product"], reverse=True)
-                user_books = user_books[:self._number_recommendations]
-
-                for count, i in enumerate(user_books):  # Done after as this is faily expensive, to avoid unecessary calculations
-                    user_books[count]["certainty"] = self.calculate_certainty(
-                        i["id"],
-                        user_id,
-                        i["dot_product"]
-                    )
-
-                if len(user_books):
-                    query += ",".join(
-                        f"({user_id}, {i['id']}, {i['certainty']})" for i in user_books[:self._number_recommendations]) + ","
+        self._connection.query("DELETE FROM dirty_users WHERE date_added<'{}'".format(started))  # Users marked in the
+        # same second as started may have been marked after they were read, so are kept
 
+    def mark_dirty(self, user_id):
         self._connection.query("""
-            DELETE FROM recommendations
-            WHERE date_added<=DATE_SUB(NOW(), INTERVAL 2 DAY)
-        """)
-
-        self._connection.query(query[:-1])
+            INSERT INTO dirty_users (user_id) VALUES ({})
+            ON DUPLICATE KEY UPDATE date_added=NOW()
+        """.format(user_id))  # The date is updated, so a change during gen_recommendations is not cleared by it
+
+    def get_dirty_users(self):
+        return [i[0] for i in self._connection.query("SELECT user_id FROM dirty_users")]
+
+    def notify_interaction(self, user_id):
+        # Called by the other components whenever a user reviews, changes a list, follows an author, writes in their
+        # diary, or removes a recommendation
+        self.mark_dirty(user_id)
+        if self._fold_in:
+            self.fold_in_user(user_id)
+
+    def fold_in_user(self, user_id):
+        # Solves the factors of a single user against the fixed book factors, which is the same as half of an ALS
+        # step for one row, so does not need the full model to be refit.
+        model = self._model  # Read once, so everything is solved against the same model, see Model
+        ratings = build_review_matrix(
+            self.load_interactions(user_ids=[user_id]),
+            [user_id],
+            model.book_ids,
+            self._initial_recommendation_mat_val,
+            self._reading_list_percentage_increase,
+            self._following_percentage_increase,
+            self._bad_recommendation_val,
+            self._min_required_reviews,
+            sparse=True
+        )
+
+        books = np.unique(ratings.indices)  # Only the books the user has interacted with are needed, so only they
+        # are expanded if the factors are compact
+        fixed = ml_utilities.expand_factors(model.book_factors, model.book_scales, books)
+        ratings = ratings[:, books]
+
+        if self._solver == "implicit":
+            user_vec = ml_utilities.implicit_als_step(
+                ratings,
+                fixed,
+                self._hyperparam,
+                self._confidence_weight,
+                gram=self._book_gram(model)
+            )[0]
+        else:
+            user_vec = np.linalg.solve(self._book_gram(model), ratings.dot(fixed)[0])  # A is symmetric, so
+            # this is the same as B.dot(A_inv) in wals_step
+        # The factors are only used for the user's recommendations, rather than written into the model, as the served
+        # model is never changed. The next training includes the interactions they were solved from.
+
+        if ratings.nnz:  # Nothing can be recommended without any interactions
+            preferences_set = self._connection.query(
+                "SELECT preferences_set FROM users WHERE user_id={}".format(user_id))
+            if len(preferences_set) and preferences_set[0][0]:
+                self._replace_user_recommendations(user_id, user_vec, model)
+
+        return user_vec
+
+    def _book_gram(self, model):
+        # Y^T Y + regularisation * I only changes when the book factors change, so is kept with the model between
+        # fold ins
+        if "gram" not in model.cache:
+            book_factors = ml_utilities.expand_factors(model.book_factors, model.book_scales)
+            model.cache["gram"] = book_factors.T.dot(book_factors) + np.eye(book_factors.shape[1]) * self._hyperparam
+        return model.cache["gram"]
+
+    def book_index(self, model=None):
+        # Built the first time it is needed for a model, unless it was loaded with it
+        model = self._model if model is None else model
+        if "index" not in model.cache:
+            model.cache["index"] = nearest_neighbours.RandomProjectionIndex(
+                model.book_factors, model.book_scales, self._index_tables, self._index_bits, self._index_probes)
+        return model.cache["index"]
+
+    def nearest_books(self, number, book_id=None, vector=None, metric="cosine"):
+        # The ids of the books closest to a book, or to a vector in the factor space (e.g. a user's factors), with
+        # their scores, highest first. Approximate, so some of the exact nearest books may be missed.
+        model = self._model
+        if book_id is not None:
+            if book_id not in model.book_index_table:
+                return []  # Added since the model was trained
+            indexes, scores = self.book_index(model).query_index(
+                model.book_index_table[book_id], number, metric)
+        else:
+            indexes, scores = self.book_index(model).query(vector, number, metric)
+        return [(int(model.book_ids[i]), float(k)) for i, k in zip(indexes, scores)]
+
+    def _book_norms(self, model):
+        # Kept with the model between requests, the same as _book_gram
+        if "norms" not in model.cache:
+            model.cache["norms"] = ml_utilities.factor_norms(model.book_factors, model.book_scales)
+        return model.cache["norms"]
+
+    def _replace_user_recommendations(self, user_id, user_vec, model):
+        book_ids = model.book_ids
+        excluded = self.load_exclusions([user_id], include_recent=False, model=model)  # The current
+        # recommendations are replaced, so can be recommended again
+
+        top, scores, certainties = top_recommendations(
+            user_vec[np.newaxis],
+            model.book_factors,
+            excluded.toarray(),
+            self._number_recommendations,
+            self._book_norms(model),
+            model.book_scales
+        )
+
+        values = [f"({user_id}, {book_ids[i]}, {c})" for i, c in zip(top[0], certainties[0]) if i >= 0]
+        with self._connection.transaction():  # The user never has no recommendations between the two
+            self._connection.query("DELETE FROM recommendations WHERE user_id={}".format(user_id))
+            self._connection.insert_rows("recommendations", ("user_id", "book_id", "certainty"), values)
 
     def delete_recommendation(self, user_id, book_id, bad_recommendation=True):
         # This includes marking a recommendation as bad - it is implicitly the same thing
@@ -357,39 +1144,14 @@ class Recommendations:
                     book_id=book_id
                 )
             )
+            self.notify_interaction(user_id)  # Not done otherwise, as adding to a reading list removes the
+            # recommendation, and notifies once it has been added
 
     def get_bad_recommendations(self, user_id):
-        bad_recommendations = self._connection.query("""
-            SELECT recommendation_id,
-                book_id,
-                date_added
-            FROM bad_recommendations
-            WHERE user_id={}
-        """.format(user_id))
-
-        reading_list_items = self._connection.query("""
-            SELECT reading_lists.book_id
-            FROM reading_lists
-            WHERE reading_lists.user_id={}
-        """.format(user_id))
-
-        return_vals = []
-        remove = []
-        for rec_id, book, date in bad_recommendations:
-            if date + datetime.timedelta(weeks=10) > datetime.datetime.now():
-                # 10 week expiry, so it can start recommending books if the user's preferences have changed. 10 weeks is
-                # a long enough time for it to be plausible to be a good recommendation
-                return_vals.append(book)
-            else:
-                remove.append(rec_id)
-
-        if len(remove):
-            self._connection.query(
-                "DELETE FROM bad_recommendations WHERE recommendation_id IN ({})".format(",".join(str(i) for i in remove))
-            )
-            # Delete expired recommendations.
-
-        return return_vals
+        # The books the user has marked as bad recommendations in the last 10 weeks, which is the expiry used by
+        # build_review_matrix, so they can be recommended again if the user's preferences have changed. Only reads, as
+        # the expired rows are deleted by purge_interactions.
+        return self._query_interactions("bad_recommendations", [user_id])[1].tolist()
 
     def get_user_recommendations(self, user_id):
         items = self._connection.query("""
@@ -471,32 +1233,18 @@ class Recommendations:
                 "cover": i[2],
             } for i in res]
 
-    def calculate_certainty(self, book_id, user_id, dot_product, user_vec=None):
-        if user_vec is None:
-            user_id = list(self.user_lookup_table.values()).index(user_id)
-            user_vec = [i for i in self.user_factors[user_id]]
-
-        book_id = list(self.book_lookup_table.values()).index(book_id)
-        book_vec = [i for i in self.book_factors[book_id]]
-
-        abs_book_vec = math.sqrt(sum(i ** 2 for i in book_vec))
-        abs_user_vec = math.sqrt(sum(i ** 2 for i in user_vec))
-
-        try:
-            similarity = dot_product / (abs_book_vec * abs_user_vec)
-            if similarity > 1:  # Slim chance it ends up larger than 100%, so limits it artificially.
-                similarity = 1
-        except ZeroDivisionError:
-            similarity = 0
-
-        return similarity
-
     def add_user(self, user_id, author_ids):
         vals = [f"({user_id}, {author_id})" for author_id in author_ids]
-        available_authors = {i[0] for i in self._connection.query("SELECT author_id FROM authors")}
-        users = {i[0] for i in self._connection.query("SELECT user_id FROM users")}
-
-        if set(author_ids).issubset(available_authors) and user_id in users:
+        authors_exist = len(author_ids) > 0 and len(self._connection.query("""
+            SELECT author_id
+            FROM authors
+            WHERE author_id IN ({})
+        """.format(",".join(str(int(i)) for i in set(author_ids))))) == len(set(author_ids))  # Primary key lookups,
+        # as authors added since the profiles were made are not in them
+        user_exists = len(self._connection.query("SELECT user_id FROM users WHERE user_id={}".format(user_id))) > 0
+
+        if authors_exist and user_exists:
+            model = self._model  # Read once, see Model
             self._connection.query(
                 "INSERT INTO initial_preferences (user_id, author_id) VALUES {}".format(
                     ",".join(vals)
@@ -508,58 +1256,47 @@ class Recommendations:
                 SET preferences_set=TRUE
                 WHERE user_id={}
             """.format(user_id))
-
-            res = self._connection.query("""
-                    SELECT AVG(book_genres.match_strength),
-                        book_genres.genre_id
-                    FROM book_genres
-                    INNER JOIN books
-                        ON book_genres.book_id=books.book_id
-                    INNER JOIN authors
-                        ON books.author_id=authors.author_id
-                    WHERE authors.author_id IN ({})
-                    GROUP BY book_genres.genre_id;
-                """.format(
-                    ",".join(str(i) for i in author_ids)
-                )
+            self.mark_dirty(user_id)  # So they are included by the next incremental gen_recommendations
+
+            rows = sorted({model.author_rows[i] for i in author_ids if i in model.author_rows})  # Authors added
+            # since the profiles were made have no row until the next training, so only the others are used
+            counts = model.author_genre_counts[rows].sum(axis=0)
+            averages = np.zeros(len(counts))
+            np.divide(model.author_genre_sums[rows].sum(axis=0), counts, out=averages, where=counts > 0)
+            # The average strength of each genre over the authors' books
+            if np.array_equal(model.author_genre_ids, model.genre_ids):
+                target_vec = averages
+            else:  # Made with different genres than the model's factors, so each column is matched to its factor by
+                # genre id. Genres the model has no factor for are left out, and factors without a column are 0.
+                genre_index = {genre_id: index for index, genre_id in enumerate(model.genre_ids.tolist())}
+                columns = [column for column, genre_id in enumerate(model.author_genre_ids.tolist())
+                           if genre_id in genre_index]
+                target_vec = np.zeros(len(model.genre_ids))
+                target_vec[[genre_index[i] for i in model.author_genre_ids[columns].tolist()]] = averages[columns]
+
+            top, scores, certainties = top_recommendations(
+                target_vec[np.newaxis],
+                model.book_factors,
+                np.zeros((1, len(model.book_ids)), dtype=bool),  # A new user has not read anything
+                self._number_recommendations,
+                self._book_norms(model),
+                model.book_scales
             )
 
-            target_vec = np.zeros(self._num_factors)
-
-            for avg, genre_id in res:
-                genre = list(self.genre_lookup_table.values()).index(genre_id)
-                target_vec[genre] = avg
-
-            rec = (target_vec * self.book_factors).T
-
-            output = []
-            for count, val in enumerate(rec[0]):
-                output.append({
-                    "book_id": self.book_lookup_table[count],
-                    "strength": val
-                })
-
-            output.sort(key=lambda x: x["strength"], reverse=True)
-
-            output = output[:self._number_recommendations]
-
-            for count, i in enumerate(output):
-                output[count]["certainty"] = self.calculate_certainty(
-                    i["book_id"],
-                    user_id,
-                    float(i["strength"]), # Convert the numpy float to a normal float so it can be used
-                    target_vec
-                )
+            output = [{
+                "book_id": int(model.book_ids[i]),
+                "strength": float(score),
+                "certainty": float(certainty)
+            } for i, score, certainty in zip(top[0].tolist(), scores[0], certainties[0]) if i >= 0]
 
-            self._connection.query("INSERT INTO recommendations (user_id, book_id, certainty) VALUES {}".format(",".join(f"({user_id}, {i['book_id']}, {i['certainty']})" for i in output)))
+            if len(output):
+                self._connection.query("INSERT INTO recommendations (user_id, book_id, certainty) VALUES {}".format(",".join(f"({user_id}, {i['book_id']}, {i['certainty']})" for i in output)))
 
             return output
 
     @staticmethod
     def mean_squared_error(true, pred):
-        mask = np.nonzero(true)
-        mse = sklearn.metrics.mean_squared_error(true[mask], pred[mask])
-        return mse
+        return evaluation.masked_mean_squared_error(true, pred)
 
 
 # -----------------------------------------------------------------------------
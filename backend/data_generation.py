@@ -460,6 +460,22 @@ recommendations = components.recommendations.Recommendations(
     config.get("recommendations bad_recommendations_matrix_value"),
     config.get("recommendations minimum_required_reviews"),
     config.get("recommendations number_recommendations"),
+    sparse=config.get("recommendations sparse_training"),
+    solver=config.get("recommendations solver"),
+    confidence_weight=config.get("recommendations confidence_weight"),
+    convergence_tolerance=config.get("recommendations convergence_tolerance"),
+    warm_start=config.get("recommendations warm_start"),
+    model_directory=config.get("recommendations model_directory"),
+    generation_block_size=config.get("recommendations generation_block_size"),
+    training_workers=config.get("recommendations training_workers"),
+    early_stopping_metric=config.get("recommendations early_stopping_metric"),
+    serving_precision=config.get("recommendations serving_precision"),
+    incremental_generation=config.get("recommendations incremental_generation"),
+    number_similar_books=config.get("recommendations number_similar_books"),
+    similarity_threshold=config.get("recommendations similarity_threshold"),
+    index_tables=config.get("recommendations index_tables"),
+    index_bits=config.get("recommendations index_bits"),
+    index_probes=config.get("recommendations index_probes")
 )
 # This needs to be later, as the number of genres would be incorrect if it were done at the start
 
@@ -469,4 +485,5 @@ print("Finished user preference generation 9/11")
 
 print("Started user recommendation generation 10/11")
 recommendations.gen_recommendations()
+recommendations.save_book_similarities()
 print("Finished user recommendation generation 10/11")
\ No newline at end of file
@@ -0,0 +1,90 @@
+# -----------------------------------------------------------------------------
+# Third party Python library imports
+# -----------------------------------------------------------------------------
+import numpy as np
+import scipy.sparse
+
+# -----------------------------------------------------------------------------
+# Error measures
+# -----------------------------------------------------------------------------
+def masked_mean_squared_error(true, predicted):
+    # Mean squared error over the known (non-zero) ratings only, as the unknown ratings are not 0, just not known.
+    mask = true != 0
+    if not mask.any():
+        return 0.0
+    return float(np.mean((true[mask] - predicted[mask]) ** 2))
+
+
+# -----------------------------------------------------------------------------
+# Ranking measures
+# -----------------------------------------------------------------------------
+# Each function takes the top books of every user at once, as a users * k array of book indexes, where -1 is an empty
+# position, and relevant, a sparse users * books matrix of the held out books that should have been recommended.
+# The per user functions return one value per user, so they can be averaged, or compared between users.
+def hits_at_k(top, relevant):
+    # True where the recommended book is relevant to that user. The (user, book) pairs are turned into single keys, so
+    # this is one search, rather than a loop over the users.
+    relevant = scipy.sparse.coo_matrix(relevant)
+    num_books = relevant.shape[1]
+    keys = np.arange(len(top))[:, np.newaxis] * num_books + top
+    relevant_keys = relevant.row.astype(np.int64) * num_books + relevant.col
+    return np.isin(keys, relevant_keys[relevant.data != 0]) & (top >= 0)
+
+
+def number_relevant(relevant):
+    return np.asarray((scipy.sparse.csr_matrix(relevant) != 0).sum(axis=1)).flatten()
+
+
+def precision_at_k(hits):
+    return hits.sum(axis=1) / max(hits.shape[1], 1)
+
+
+def recall_at_k(hits, num_relevant):
+    recall = np.zeros(len(hits))
+    np.divide(hits.sum(axis=1), num_relevant, out=recall, where=num_relevant > 0)
+    return recall
+
+
+def ndcg_at_k(hits, num_relevant):
+    discounts = 1 / np.log2(np.arange(hits.shape[1]) + 2)
+    dcg = hits.dot(discounts)
+    ideal = np.concatenate(([0], np.cumsum(discounts)))[np.minimum(num_relevant, hits.shape[1])]
+    # The best possible DCG puts every relevant book first
+    ndcg = np.zeros(len(hits))
+    np.divide(dcg, ideal, out=ndcg, where=ideal > 0)
+    return ndcg
+
+
+def average_precision(hits, num_relevant):
+    # Mean of the precision at the position of each hit, out of the most hits that were possible in k positions
+    precision = np.cumsum(hits, axis=1) / np.arange(1, hits.shape[1] + 1)
+    average = np.zeros(len(hits))
+    np.divide((precision * hits).sum(axis=1), np.minimum(num_relevant, hits.shape[1]), out=average,
+              where=num_relevant > 0)
+    return average
+
+
+def catalog_coverage(top, num_books):
+    # Fraction of the books that are recommended to at least one user
+    if num_books == 0:
+        return 0.0
+    return len(np.unique(top[top >= 0])) / num_books
+
+
+def evaluate(top, relevant):
+    # Every measure, averaged over the users that have at least one relevant book, as a user with nothing held out
+    # cannot be scored.
+    num_relevant = number_relevant(relevant)
+    hits = hits_at_k(top, relevant)
+    users = num_relevant > 0
+    if not users.any():
+        return {"precision": 0.0, "recall": 0.0, "ndcg": 0.0, "map": 0.0,
+                "coverage": catalog_coverage(top, relevant.shape[1])}
+
+    return {
+        "precision": float(np.mean(precision_at_k(hits[users]))),
+        "recall": float(np.mean(recall_at_k(hits[users], num_relevant[users]))),
+        "ndcg": float(np.mean(ndcg_at_k(hits[users], num_relevant[users]))),
+        "map": float(np.mean(average_precision(hits[users], num_relevant[users]))),
+        "coverage": catalog_coverage(top, relevant.shape[1])
+    }
@@ -0,0 +1,217 @@
+# -----------------------------------------------------------------------------
+# Standard Python library imports
+# -----------------------------------------------------------------------------
+import os
+import sys
+import json
+import itertools
+import concurrent.futures
+
+# -----------------------------------------------------------------------------
+# Third party Python library imports
+# -----------------------------------------------------------------------------
+import numpy as np
+import scipy.sparse
+
+# -----------------------------------------------------------------------------
+# Project imports
+# -----------------------------------------------------------------------------
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import components.recommendations
+
+import configuration
+import evaluation
+import mysql_handler
+
+# -----------------------------------------------------------------------------
+# Search space
+# -----------------------------------------------------------------------------
+# Each key is the name of the configuration variable, without "recommendations ". Any variable that is not in the
+# grid uses its value from the configuration files.
+DEFAULT_GRID = {
+    "hyperparameter": [0.01, 0.1, 1],
+    "number_converge_iterations": [10, 20, 40],
+    "inital_recommendation_matrix_value": [0.25, 0.5, 1],
+    "reading_list_percentage_increase": [0.25, 0.5],
+    "author_following_percentage_increase": [0.25, 0.5]
+}
+
+
+def expand_grid(grid, defaults):
+    names = list(defaults)
+    values = [grid.get(name, [defaults[name]]) for name in names]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+# -----------------------------------------------------------------------------
+# Cross validation
+# -----------------------------------------------------------------------------
+def assign_folds(interactions, book_id_range, folds, seed):
+    # Every (user, book) cell that can be in the review matrix is given a fold, before any matrix is made, so every
+    # configuration is tested on the same splits even though the values (and which cells are 0) change.
+    cells = np.unique(np.concatenate([
+        np.asarray(columns[0], dtype=np.int64) * book_id_range + np.asarray(columns[1], dtype=np.int64)
+        for columns in interactions.values()
+    ]))  # Keyed on the database ids, as the matrix indexes are not known yet
+    return cells, np.random.default_rng(seed).integers(0, folds, len(cells))
+
+
+_search_worker = dict()  # State of a search worker process, set once when the process is started
+
+
+def _start_search_worker(interactions, user_ids, book_ids, cells, cell_fold, fixed):
+    _search_worker.update(
+        interactions=interactions, user_ids=user_ids, book_ids=book_ids, cells=cells, cell_fold=cell_fold, fixed=fixed
+    )
+
+
+def evaluate_fold(parameters, fold):
+    worker = _search_worker
+    fixed = worker["fixed"]
+    ratings = components.recommendations.build_review_matrix(
+        worker["interactions"],
+        worker["user_ids"],
+        worker["book_ids"],
+        parameters["inital_recommendation_matrix_value"],
+        parameters["reading_list_percentage_increase"],
+        parameters["author_following_percentage_increase"],
+        fixed["bad_recommendations_matrix_value"],
+        fixed["minimum_required_reviews"],
+        sparse=True
+    ).tocoo()
+
+    keys = (np.asarray(worker["user_ids"], dtype=np.int64)[ratings.row] * fixed["book_id_range"] +
+            np.asarray(worker["book_ids"], dtype=np.int64)[ratings.col])
+    held_out = worker["cell_fold"][np.searchsorted(worker["cells"], keys)] == fold
+
+    train = scipy.sparse.csr_matrix(
+        (ratings.data[~held_out], (ratings.row[~held_out], ratings.col[~held_out])), shape=ratings.shape
+    )
+    test = scipy.sparse.csr_matrix(
+        (ratings.data[held_out], (ratings.row[held_out], ratings.col[held_out])), shape=ratings.shape
+    )
+    transposed = train.T.tocsr()
+
+    generator = np.random.default_rng(fixed["seed"] + fold)  # The same start for every configuration
+    book_factors = generator.random((ratings.shape[1], fixed["num_factors"]))
+    user_factors = np.zeros((ratings.shape[0], fixed["num_factors"]))
+    for i in range(parameters["number_converge_iterations"]):
+        user_factors = components.recommendations.als_step(
+            train, book_factors, fixed["solver"], parameters["hyperparameter"], fixed["confidence_weight"]
+        )
+        book_factors = components.recommendations.als_step(
+            transposed, user_factors, fixed["solver"], parameters["hyperparameter"], fixed["confidence_weight"]
+        )
+
+    results = dict()
+    for name, matrix in (("train", train.tocoo()), ("test", test.tocoo())):
+        predict = np.einsum("ij,ij->i", user_factors[matrix.row], book_factors[matrix.col])
+        target = np.ones(matrix.nnz) if fixed["solver"] == "implicit" else matrix.data  # As in training_loss
+        results[name + "_mse"] = float(np.mean((target - predict) ** 2)) if matrix.nnz else 0.0
+
+    relevant = (test > 0).tocsr()  # Books the user rated badly are not counted as relevant
+    users = np.flatnonzero(relevant.getnnz(axis=1))
+    top = components.recommendations.top_books(
+        user_factors[users], book_factors, train[users] != 0, fixed["number_recommendations"]
+    )  # The books in the training data are not recommended, the same as gen_recommendations
+    results.update(evaluation.evaluate(top, relevant[users]))
+    return results
+
+
+def search(interactions, user_ids, book_ids, grid, defaults, fixed, folds=5, workers=None):
+    cells, cell_fold = assign_folds(interactions, fixed["book_id_range"], folds, fixed["seed"])
+    configurations = expand_grid(grid, defaults)
+
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_start_search_worker,
+            initargs=(interactions, user_ids, book_ids, cells, cell_fold, fixed)
+    ) as executor:  # The interactions are sent to each worker once, and each task only sends its parameters
+        futures = [[executor.submit(evaluate_fold, parameters, fold) for fold in range(folds)]
+                   for parameters in configurations]
+
+        results = []
+        for parameters, fold_futures in zip(configurations, futures):
+            fold_results = [future.result() for future in fold_futures]
+            results.append({
+                "parameters": parameters,
+                "metrics": {name: float(np.mean([i[name] for i in fold_results])) for name in fold_results[0]},
+                "folds": fold_results
+            })
+
+    results.sort(key=lambda x: x["metrics"]["test_mse"])
+    return results
+
+
+# -----------------------------------------------------------------------------
+# Command line
+# -----------------------------------------------------------------------------
+# python3 hyperparameter_search.py [grid=<json file>] [folds=<number>] [workers=<number>] [output=<json file>]
+#                                  [snapshot=<.npz file>]
+# The grid file has the same format as DEFAULT_GRID. The results are sorted by the mean held out MSE, and include the
+# ranking measures from evaluation.evaluate. snapshot is a file made by interaction_export.py, which is used instead of
+# the database, so every search is over the same data.
+if __name__ == "__main__":
+    arguments = dict(argument.split("=", 1) for argument in sys.argv[1:])
+
+    config = configuration.Configuration("./project_config.conf", default_conf_filename="./default_config.json")
+    connection = mysql_handler.Connection(
+        user=config.get("mysql username"),
+        password=config.get("mysql password"),
+        schema=config.get("mysql schema"),
+        host=config.get("mysql host")
+    )
+    recommendations = components.recommendations.Recommendations(
+        connection,
+        config.get("recommendations number_converge_iterations"),
+        config.get("recommendations hyperparameter"),
+        config.get("number_display_genres"),
+        config.get("recommendations inital_recommendation_matrix_value"),
+        config.get("recommendations reading_list_percentage_increase"),
+        config.get("recommendations author_following_percentage_increase"),
+        config.get("recommendations bad_recommendations_matrix_value"),
+        config.get("recommendations minimum_required_reviews"),
+        config.get("recommendations number_recommendations")
+    )  # Without a model directory, so it loads the lookup tables of the current catalog, not those of a saved model
+    if "snapshot" in arguments:
+        catalog, interactions = components.recommendations.load_interaction_snapshot(arguments["snapshot"])
+        recommendations._load_catalog(catalog)  # The lookup tables of the snapshot instead
+    else:
+        interactions = recommendations.load_interactions()  # Only reads, so the search does not change the
+        # database. Loaded once, and every configuration is made from it.
+
+    if "grid" in arguments:
+        with open(arguments["grid"], "r") as f:
+            grid = json.load(f)
+    else:
+        grid = DEFAULT_GRID
+
+    user_ids = recommendations.user_ids.tolist()
+    book_ids = recommendations.book_ids.tolist()
+    results = search(
+        interactions,
+        user_ids,
+        book_ids,
+        grid,
+        {name: config.get("recommendations " + name) for name in DEFAULT_GRID},
+        {
+            "book_id_range": max(book_ids, default=0) + 1,  # Used to give each (user, book) pair a single key
+            "num_factors": recommendations._num_factors,
+            "bad_recommendations_matrix_value": config.get("recommendations bad_recommendations_matrix_value"),
+            "minimum_required_reviews": config.get("recommendations minimum_required_reviews"),
+            "number_recommendations": config.get("recommendations number_recommendations"),
+            "solver": config.get("recommendations solver"),
+            "confidence_weight": config.get("recommendations confidence_weight"),
+            "seed": 0
+        },
+        folds=int(arguments.get("folds", 5)),
+        workers=int(arguments["workers"]) if "workers" in arguments else None
+    )
+
+    output = json.dumps(results, indent=4)
+    if "output" in arguments:
+        with open(arguments["output"], "w") as f:
+            f.write(output)
+    else:
+        print(output)
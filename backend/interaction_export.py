@@ -0,0 +1,95 @@
+# -----------------------------------------------------------------------------
+# Standard Python library imports
+# -----------------------------------------------------------------------------
+import os
+import sys
+
+# -----------------------------------------------------------------------------
+# Third party Python library imports
+# -----------------------------------------------------------------------------
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# Project imports
+# -----------------------------------------------------------------------------
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import components.recommendations
+
+import configuration
+import mysql_handler
+
+# -----------------------------------------------------------------------------
+# Column types
+# -----------------------------------------------------------------------------
+# Ids are INT columns, so fit in 32 bits, and the ratings are averages of small integers, so 32 bit floats are exact
+# enough. This halves the size of the snapshot compared to the types used in memory.
+ID_TYPE = np.int32
+VALUE_TYPE = np.float32
+
+CATALOG_QUERIES = {
+    "user_ids": "SELECT user_id FROM users",
+    "book_ids": "SELECT book_id FROM books",
+    "genre_ids": "SELECT genre_id FROM genres"
+}  # The same order as Recommendations.gen_lookup_tables, so the indexes are the same
+
+
+# -----------------------------------------------------------------------------
+# Export
+# -----------------------------------------------------------------------------
+def stream_columns(connection, query, types, batch_size):
+    # Reads the result a batch at a time, converting each batch to compact arrays straight away, so only one batch of
+    # Python tuples exists at once.
+    batches = [[] for i in types]
+    for rows in connection.stream(query, batch_size):
+        for batch, column, dtype in zip(batches, zip(*rows), types):
+            batch.append(np.array(column, dtype=dtype))
+    return [np.concatenate(batch) if batch else np.zeros(0, dtype=dtype) for batch, dtype in zip(batches, types)]
+
+
+def export_interactions(connection, filename, batch_size=100000):
+    # Saves every signal used to train the recommendations, and the ids of the catalog, to a .npz file with one array
+    # per column, named <signal>_<column number>, which is read by components.recommendations.load_interaction_snapshot.
+    # The file is written under a temporary name and then renamed, so a partially written snapshot is never read.
+    arrays = dict()
+    for name, query in CATALOG_QUERIES.items():
+        arrays[name] = stream_columns(connection, query, (ID_TYPE,), batch_size)[0]
+
+    for name, (query, column, keyword, types) in components.recommendations.INTERACTION_QUERIES.items():
+        columns = stream_columns(
+            connection,
+            query.format(""),  # Every user
+            [ID_TYPE if dtype == np.int64 else VALUE_TYPE for dtype in types],
+            batch_size
+        )
+        for count, values in enumerate(columns):
+            arrays[f"{name}_{count}"] = values
+
+    temp_filename = filename + ".tmp.npz"  # np.savez adds .npz if the name does not end with it
+    np.savez(temp_filename, **arrays)
+    os.replace(temp_filename, filename)
+    return {name: len(values) for name, values in arrays.items()}
+
+
+# -----------------------------------------------------------------------------
+# Command line
+# -----------------------------------------------------------------------------
+# python3 interaction_export.py <output .npz file> [batch_size=<number>]
+# The file can then be given to Recommendations.fit(snapshot=...), or to hyperparameter_search.py, so training does not
+# query the database.
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python3 interaction_export.py <output .npz file> [batch_size=<number>]")
+        sys.exit(1)
+    arguments = dict(argument.split("=", 1) for argument in sys.argv[2:])
+
+    config = configuration.Configuration("./project_config.conf", default_conf_filename="./default_config.json")
+    connection = mysql_handler.Connection(
+        user=config.get("mysql username"),
+        password=config.get("mysql password"),
+        schema=config.get("mysql schema"),
+        host=config.get("mysql host")
+    )
+
+    for name, rows in export_interactions(connection, sys.argv[1], int(arguments.get("batch_size", 100000))).items():
+        print(f"{name}: {rows}")
@@ -1,10 +1,18 @@
+# -----------------------------------------------------------------------------
+# Standard Python library imports
+# -----------------------------------------------------------------------------
+import sys
+
 # -----------------------------------------------------------------------------
 # Project imports
 # -----------------------------------------------------------------------------
 import components.accounts
+import components.information_retrieval
 import components.recommendations
 
 import configuration
+import interaction_export
+import model_store
 import mysql_handler
 
 # -----------------------------------------------------------------------------
@@ -40,6 +48,22 @@ recommendations = components.recommendations.Recommendations(
     config.get("recommendations bad_recommendations_matrix_value"),
     config.get("recommendations minimum_required_reviews"),
     config.get("recommendations number_recommendations"),
+    sparse=config.get("recommendations sparse_training"),
+    solver=config.get("recommendations solver"),
+    confidence_weight=config.get("recommendations confidence_weight"),
+    convergence_tolerance=config.get("recommendations convergence_tolerance"),
+    warm_start=config.get("recommendations warm_start"),
+    model_directory=config.get("recommendations model_directory"),
+    generation_block_size=config.get("recommendations generation_block_size"),
+    training_workers=config.get("recommendations training_workers"),
+    early_stopping_metric=config.get("recommendations early_stopping_metric"),
+    serving_precision=config.get("recommendations serving_precision"),
+    incremental_generation=config.get("recommendations incremental_generation"),
+    number_similar_books=config.get("recommendations number_similar_books"),
+    similarity_threshold=config.get("recommendations similarity_threshold"),
+    index_tables=config.get("recommendations index_tables"),
+    index_bits=config.get("recommendations index_bits"),
+    index_probes=config.get("recommendations index_probes")
 )
 
 # -----------------------------------------------------------------------------
@@ -54,5 +78,37 @@ for i in sessions.get_session_id_list():
 # -----------------------------------------------------------------------------
 # Recommendations
 # -----------------------------------------------------------------------------
-recommendations.fit()
+if config.get("recommendations model_directory"):
+    training_lock = model_store.acquire_training_lock(config.get("recommendations model_directory"))
+    if training_lock is None:
+        sys.exit(0)  # Another process is already training a model
+    # Held until this script exits
+
+if config.get("recommendations interaction_snapshot"):
+    snapshot = model_store.resolve_directory(config.get("recommendations interaction_snapshot"))
+    interaction_export.export_interactions(connection, snapshot)  # Streamed, so the database is only read once, and
+    # is not queried while training
+    recommendations.fit(snapshot=snapshot)
+    recommendations.purge_interactions()  # Not done by fit when it trains from a snapshot, so the same snapshot
+    # can be trained on again. The rows it deletes are ignored by the training either way.
+else:
+    recommendations.fit()
 recommendations.gen_recommendations()
+recommendations.save_book_similarities()
+
+# -----------------------------------------------------------------------------
+# Search index
+# -----------------------------------------------------------------------------
+if config.get("search index_directory"):
+    information_retrieval = components.information_retrieval.DocumentCollection(
+        connection,
+        None,  # Only used to show search results
+        None,
+        None,
+        config.get("search number_results"),
+        index_directory=config.get("search index_directory"),
+        load=False  # Made below, rather than loaded
+    )
+    information_retrieval.make_index()  # From the database, with the idf values worked out again from it
+    information_retrieval.save_index()  # Loaded by the server processes the next time they check for one
+    information_retrieval.clear_changes()  # Now in the saved index
@@ -5,6 +5,9 @@
 # https://milvus.io/docs/metric.md
 import math
 
+import numpy as np
+import scipy.sparse
+
 
 def jaccard_similarity(set_1, set_2):
     # set_1 and set_2 must be sets not lists.
@@ -20,8 +23,133 @@ def cosine_similarity(arr1, arr2):
             )
         )
 
+def top_column_similarities(matrix, number, threshold=0, block_size=1024):
+    # Cosine similarity between the columns of a sparse matrix, keeping only the most similar number other columns of
+    # each column, that are more similar than threshold. The products of block_size columns with every other column are
+    # found at once, so only pairs of columns that share a non-zero row are ever found, and the full columns * columns
+    # matrix is never made. Returns the column, the similar column and the similarity of each pair, ordered by column,
+    # then highest similarity.
+    matrix = scipy.sparse.csc_matrix(matrix, dtype=np.float64)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).flatten())
+    transposed = matrix.T.tocsr()
+
+    columns, similar, similarities = [], [], []
+    for start in range(0, matrix.shape[1], block_size):
+        block = transposed[start:start + block_size].dot(matrix).tocoo()
+        column = block.row + start
+        similarity = block.data / (norms[column] * norms[block.col])  # The norms cannot be 0, as the product is not
+        keep = (block.col != column) & (similarity > threshold)
+        column, other, similarity = column[keep], block.col[keep], similarity[keep]
+
+        order = np.lexsort((other, -similarity, column))  # Most similar first, then lowest index
+        column, other, similarity = column[order], other[order], similarity[order]
+        rank = np.arange(len(column)) - np.searchsorted(column, column)  # Position within its column
+        keep = rank < number
+
+        columns.append(column[keep])
+        similar.append(other[keep])
+        similarities.append(similarity[keep])
+
+    if not columns:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    return np.concatenate(columns), np.concatenate(similar), np.concatenate(similarities)
+
 # -----------------------------------------------------------------------------
 # Error measures
 # -----------------------------------------------------------------------------
 def mean_squared_error(true, predicted):
     return sum((i - k)**2 for i, k in zip(true, predicted)) / len(true)
+
+# -----------------------------------------------------------------------------
+# Matrix factorisation
+# -----------------------------------------------------------------------------
+# http://yifanhu.net/PUB/cf.pdf - Collaborative Filtering for Implicit Feedback Datasets (Hu, Koren, Volinsky)
+def implicit_als_step(ratings, fixed, regularisation, confidence_weight, block_memory=2 ** 22, gram=None):
+    # Solves (Y^T C_u Y + regularisation * I) x_u = Y^T C_u p_u for every row u, where the confidence is
+    # c_ui = 1 + confidence_weight * r_ui, and the preference p_ui is 1 if the rating is known, and 0 otherwise.
+    # Y^T C_u Y = Y^T Y + Y^T (C_u - I) Y, and C_u - I is only non-zero for the known ratings, so the cost grows with
+    # the number of known ratings, not the size of the matrix.
+    ratings = scipy.sparse.csr_matrix(ratings)
+    num_rows = ratings.shape[0]
+    num_factors = fixed.shape[1]
+
+    if gram is None:
+        gram = fixed.T.dot(fixed) + np.eye(num_factors) * regularisation  # Shared by every row, so only found once
+    result = np.zeros((num_rows, num_factors))
+
+    block_size = max(1, block_memory // (num_factors ** 2))  # Limits the memory used by the stacked matrices
+    for start in range(0, num_rows, block_size):
+        block = ratings[start:start + block_size]
+        factors = fixed[block.indices]  # Only the rows of the fixed matrix that have a rating in this block
+        weighted = factors * (confidence_weight * block.data)[:, np.newaxis]  # (C_u - I) Y, for the known ratings
+        row_sums = scipy.sparse.csr_matrix(
+            (np.ones(block.nnz), np.arange(block.nnz), block.indptr),
+            shape=(block.shape[0], block.nnz)
+        )  # Multiplying by this adds together the values that belong to each row
+
+        A = np.repeat(gram[np.newaxis], block.shape[0], axis=0)
+        for factor in range(num_factors):
+            A[:, factor, :] += row_sums.dot(weighted * factors[:, factor, np.newaxis])
+
+        b = row_sums.dot(weighted + factors)  # C_u p_u, as p_u is 1 for every known rating
+
+        lower = np.linalg.cholesky(A)  # A is symmetric positive definite, because of the regularisation
+        y = np.linalg.solve(lower, b[:, :, np.newaxis])
+        result[start:start + block_size] = np.linalg.solve(lower.transpose(0, 2, 1), y)[:, :, 0]
+
+    return result
+
+# -----------------------------------------------------------------------------
+# Compact factor storage
+# -----------------------------------------------------------------------------
+# Serving only ranks books, so the factors can be kept at a lower precision than they are trained at. "int8" stores
+# each row as whole numbers from -127 to 127, and a scale, so row i is values[i] * scales[i]. The other precisions
+# are numpy dtypes, and have no scales. int8 changes the recommendations: each value is only kept to within half a
+# step, so books whose scores are close can swap places, and a different book can enter a user's top books. float32
+# almost always ranks the same as float64. See benchmarks.serving_precision.
+def quantise_rows(matrix):
+    matrix = np.asarray(matrix)
+    scales = np.abs(matrix).max(axis=1, initial=0) / 127
+    scales[scales == 0] = 1  # Rows of 0s are stored as 0s
+    values = np.round(matrix / scales[:, np.newaxis]).astype(np.int8)
+    return values, scales.astype(np.float32)
+
+
+def compact_factors(matrix, precision):
+    if precision == "int8":
+        return quantise_rows(matrix)
+    return np.asarray(matrix, dtype=precision), None  # Not copied if it is already that precision
+
+
+def factor_precision(values, scales=None):
+    return "int8" if scales is not None else str(values.dtype)
+
+
+def expand_factors(values, scales=None, rows=None):
+    # The factors as floats, only for the given rows if rows is not None, so the whole matrix is not expanded
+    if rows is not None:
+        values = values[rows]
+        scales = None if scales is None else scales[rows]
+    if scales is None:
+        return values
+    return values * scales[:, np.newaxis]
+
+
+def factor_scores(vectors, values, scales=None, block_size=4096):
+    # vectors . rows^T. The scale of each row can be applied after the dot product, as it is the same for the whole row
+    if scales is None:
+        return vectors.dot(values.T)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scores = np.empty(vectors.shape[:-1] + (len(values),), dtype=np.float32)
+    for start in range(0, len(values), block_size):
+        scores[..., start:start + block_size] = vectors.dot(values[start:start + block_size].T.astype(np.float32))
+        # numpy has no int8 matrix multiplication, so the values are multiplied as float32, a block of rows at a
+        # time, so the whole matrix is never copied at four times its size
+    scores *= scales
+    return scores
+
+
+def factor_norms(values, scales=None):
+    if scales is None:
+        return np.linalg.norm(values, axis=1)
+    return np.linalg.norm(values.astype(np.float32), axis=1) * scales
@@ -0,0 +1,107 @@
+# ------------------------------------------------------------------------------
+# Standard Python library imports
+# ------------------------------------------------------------------------------
+import os
+import fcntl
+import shutil
+
+# ------------------------------------------------------------------------------
+# Third party Python library imports
+# ------------------------------------------------------------------------------
+import numpy as np
+
+# ------------------------------------------------------------------------------
+# Custom exceptions
+# ------------------------------------------------------------------------------
+class SnapshotNotFoundError(Exception):
+    def __init__(self, directory):
+        message = f"Directory '{directory}' does not contain a saved snapshot"
+        super().__init__(message)
+
+
+# ------------------------------------------------------------------------------
+# Snapshots
+# ------------------------------------------------------------------------------
+# Each snapshot is a directory of .npy files, named v<version>, so each array can be memory mapped on its own. The
+# CURRENT file holds the newest complete version, and is only changed once the snapshot has been fully written, so
+# a reader can never see a partially written snapshot.
+def resolve_directory(directory):
+    return os.path.join(os.path.split(os.path.dirname(__file__))[0], directory)
+    # Relative to the project root, the same as the configuration files. Absolute paths are unchanged.
+
+
+def current_version(directory):
+    try:
+        with open(os.path.join(resolve_directory(directory), "CURRENT"), "r") as f:
+            return int(f.read())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def save_snapshot(directory, arrays, keep=2):
+    directory = resolve_directory(directory)
+    os.makedirs(directory, exist_ok=True)
+
+    version = (current_version(directory) or 0) + 1
+    temp_path = os.path.join(directory, f".v{version}.tmp")
+    shutil.rmtree(temp_path, ignore_errors=True)  # Left over if a previous save was interrupted
+    os.makedirs(temp_path)
+
+    for name, array in arrays.items():
+        np.save(os.path.join(temp_path, name + ".npy"), np.ascontiguousarray(array))
+
+    os.rename(temp_path, os.path.join(directory, f"v{version}"))
+
+    with open(os.path.join(directory, ".CURRENT.tmp"), "w") as f:
+        f.write(str(version))
+    os.replace(os.path.join(directory, ".CURRENT.tmp"), os.path.join(directory, "CURRENT"))  # Atomic
+
+    for old_version in range(version - keep, 0, -1):
+        path = os.path.join(directory, f"v{old_version}")
+        if not os.path.isdir(path):
+            break
+        shutil.rmtree(path)  # Processes that have mapped these files can still read them until they unmap them
+
+    return version
+
+
+def load_snapshot(directory, version=None, mmap=True):
+    directory = resolve_directory(directory)
+    if version is None:
+        version = current_version(directory)
+    if version is None:
+        raise SnapshotNotFoundError(directory)
+
+    path = os.path.join(directory, f"v{version}")
+    arrays = dict()
+    for filename in os.listdir(path):
+        if filename.endswith(".npy"):
+            arrays[filename[:-4]] = np.load(os.path.join(path, filename), mmap_mode="r" if mmap else None)
+            # Memory mapped files are shared between processes through the page cache, and are only read when used
+
+    return version, arrays
+
+
+# ------------------------------------------------------------------------------
+# Training lock
+# ------------------------------------------------------------------------------
+# Held by the process that is training a new snapshot, so only one is trained at once. The operating system releases
+# it if the process stops, so it is never left behind.
+def acquire_training_lock(directory):
+    directory = resolve_directory(directory)
+    os.makedirs(directory, exist_ok=True)
+    lock_file = open(os.path.join(directory, "TRAINING"), "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None  # Another process is training
+    return lock_file  # Released when it is closed
+
+
+def is_training(directory):
+    lock_file = acquire_training_lock(directory)
+    if lock_file is None:
+        return True
+    lock_file.close()
+    return False
@@ -1,7 +1,9 @@
 # ------------------------------------------------------------------------------
 # Standard Python library imports
 # ------------------------------------------------------------------------------
+import re
 import time
+import contextlib
 
 # ------------------------------------------------------------------------------
 # Third party Python library imports
@@ -17,6 +19,7 @@ class Connection:
         self._password = password
         self._schema = schema
         self._host = host
+        self._in_transaction = False
         self._connect() # Establish database connection
         self._query_time = None
 
@@ -38,6 +41,8 @@ class Connection:
         try:
             self._cursor.execute(query)
         except mysql.connector.Error:
+            if self._in_transaction:
+                raise  # Reconnecting would lose the earlier queries of the transaction
             self._connect() # Some databases specifies connections close after
                 # certain amount of time inactive. This repoens the connection
                 # if a timeout occurs
@@ -50,13 +55,100 @@ class Connection:
             result = [] # Incase the method does not provide any result, like
                 # INSERT
 
-        self._connection.commit() # Applies changes from the query to the db
+        if not self._in_transaction:
+            self._connection.commit() # Applies changes from the query to the db
 
         self._query_time = time.time() - start_time
 
         return result # Use tuples as they are faster
 
 
+    @contextlib.contextmanager
+    def transaction(self):
+        # The queries made inside are committed together when it ends, or not at all if any of them fails, so other
+        # connections never see part of the changes
+        self._in_transaction = True
+        try:
+            yield
+        except BaseException:
+            self._connection.rollback()
+            raise
+        else:
+            self._connection.commit()
+        finally:
+            self._in_transaction = False
+
+    def stream(self, query, batch_size=10000):
+        # Yields the rows in lists of at most batch_size, as they are read from the server, so the whole result is
+        # never held in memory at once. Uses its own unbuffered cursor, which needs to be fully read before any other
+        # query is made.
+        cursor = self._connection.cursor(buffered=False)
+        try:
+            cursor.execute(query)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            if self._connection.unread_result:
+                self._connection.consume_results()  # Stopped before the end, so the rest is discarded
+            cursor.close()
+
+    def max_packet_size(self):
+        if getattr(self, "_max_packet_size", None) is None:
+            self._max_packet_size = int(self.query("SELECT @@max_allowed_packet")[0][0])  # Only changes if the server
+            # is restarted, so is only found once
+        return self._max_packet_size
+
+    def insert_rows(self, table, columns, rows, chunk_size=None, update_columns=None):
+        # rows are the formatted "(a, b, c)" value strings. They are inserted with as few statements as possible, with
+        # each statement being at most chunk_size characters, which defaults to half the server's max_allowed_packet,
+        # so a large insert cannot be rejected for being too large. If update_columns is given, a row with the same
+        # primary key as an existing row updates those columns of it instead.
+        if chunk_size is None:
+            chunk_size = self.max_packet_size() // 2
+        start = "INSERT INTO {} ({}) VALUES ".format(table, ", ".join(columns))
+        end = ""
+        if update_columns is not None:
+            end = " ON DUPLICATE KEY UPDATE " + ", ".join("{0}=VALUES({0})".format(i) for i in update_columns)
+
+        chunk = []
+        length = len(start) + len(end)
+        for row in rows:
+            if chunk and length + len(row) + 1 > chunk_size:
+                self.query(start + ",".join(chunk) + end)
+                chunk = []
+                length = len(start) + len(end)
+            chunk.append(row)
+            length += len(row) + 1  # Includes the comma
+
+        if chunk:
+            self.query(start + ",".join(chunk) + end)
+
+    def replace_table(self, table, columns, rows, keep=None, chunk_size=None):
+        # Replaces the contents of a table without it ever being empty or partially written. The new rows are written
+        # to a copy of the table, which is then swapped with the live table with RENAME TABLE, which is atomic. keep is
+        # a WHERE condition for rows of the live table to copy into the new one. Rows written to the live table while
+        # the copy is being made are lost, so this is only for tables that are only written in bulk, such as
+        # book_genres, and not for tables that are also written by requests, such as recommendations.
+        staging = table + "_staging"
+        old = table + "_old"
+
+        self.query("DROP TABLE IF EXISTS {}".format(staging))  # Left over if a previous replace failed
+        create = self.query("SHOW CREATE TABLE {}".format(table))[0][1]  # CREATE TABLE ... LIKE does not copy the
+        # foreign keys, so the copy is made from the full definition
+        create = re.sub(r"CONSTRAINT `[^`]+` ", "", create)  # Constraint names are unique in the schema, so the copy's
+        # are generated as <table>_ibfk_<number>, which RENAME TABLE changes to the new table name
+        self.query(create.replace("`{}`".format(table), "`{}`".format(staging), 1))
+        if keep is not None:
+            self.query("INSERT INTO {} SELECT * FROM {} WHERE {}".format(staging, table, keep))
+        self.insert_rows(staging, columns, rows, chunk_size)
+
+        self.query("DROP TABLE IF EXISTS {}".format(old))
+        self.query("RENAME TABLE {table} TO {old}, {staging} TO {table}".format(table=table, old=old, staging=staging))
+        self.query("DROP TABLE {}".format(old))
+
     @property
     def query_time(self):
         return self._query_time
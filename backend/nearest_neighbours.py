@@ -0,0 +1,118 @@
+# -----------------------------------------------------------------------------
+# Third party Python library imports
+# -----------------------------------------------------------------------------
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# Project imports
+# -----------------------------------------------------------------------------
+import ml_utilities
+
+# -----------------------------------------------------------------------------
+# Random projection index
+# -----------------------------------------------------------------------------
+# Approximate nearest neighbours by cosine similarity. Each table splits the space with num_bits random hyperplanes,
+# and the side of each hyperplane a vector is on gives one bit of its bucket code, so vectors with a small angle
+# between them are likely to share a bucket. A query only scores the vectors in its buckets, and the buckets one bit
+# away from it, on the hyperplanes it is closest to (the probes). More tables or probes find more of the true
+# neighbours, but score more vectors. Fewer bits make larger buckets, which does the same.
+class RandomProjectionIndex:
+    def __init__(self, vectors, scales=None, num_tables=16, num_bits=10, probes=3, max_candidates=0, seed=0,
+                 planes=None, codes=None, order=None, block_size=65536):
+        # vectors can be compact int8 factors, with scales, see ml_utilities.compact_factors. planes, codes and order
+        # are only given when loading a saved index, see from_arrays.
+        self._vectors = vectors
+        self._scales = scales
+        self.probes = probes
+        self.max_candidates = max_candidates  # Most vectors scored by a query. 0 scores all of them.
+
+        if planes is None:
+            planes = np.random.default_rng(seed).normal(size=(num_tables, num_bits, vectors.shape[1]))
+        self._planes = planes  # tables * bits * dimensions
+
+        if codes is None:
+            keys = np.concatenate([
+                self._bucket_keys(self._projections(ml_utilities.expand_factors(
+                    vectors, scales, np.arange(block, min(block + block_size, len(vectors)))
+                )))
+                for block in range(0, max(len(vectors), 1), block_size)
+            ]).T.flatten()  # Table by table
+            order = np.argsort(keys, kind="stable")
+            codes = keys[order]  # Sorted, so each bucket is a range of positions found by a binary search
+            order = (order % len(vectors)).astype(np.int64)  # The vector in each position
+
+        self._codes = codes
+        self._order = order
+        self._num_vectors = len(vectors)
+
+    def _projections(self, vectors):
+        # vectors * tables * bits, as one matrix product
+        num_tables, num_bits, dimensions = self._planes.shape
+        return vectors.dot(self._planes.reshape(-1, dimensions).T).reshape(len(vectors), num_tables, num_bits)
+
+    @staticmethod
+    def _bucket_keys(projections):
+        # Each vector's bucket in each table, as a single number for every bucket of every table, so all the tables
+        # are searched at once. vectors * tables.
+        num_tables, num_bits = projections.shape[1:]
+        codes = (projections > 0).astype(np.float32).dot(2.0 ** np.arange(num_bits, dtype=np.float32))
+        # As floats so the product uses BLAS, which is exact for up to 24 bits
+        return codes.astype(np.int64) + (np.arange(num_tables, dtype=np.int64) << num_bits)
+
+    def candidates(self, vector):
+        # Indexes of the vectors in the same buckets as the vector, or one bit away from them
+        projections = self._projections(np.asarray(vector, dtype=np.float64)[np.newaxis])
+        keys = self._bucket_keys(projections)[0]
+
+        closest = np.argsort(np.abs(projections[0]), axis=1)[:, :self.probes]  # The bits most likely to be wrong
+        keys = np.concatenate((keys, (keys[:, np.newaxis] ^ (1 << closest)).flatten()))
+
+        starts = np.searchsorted(self._codes, keys, side="left")
+        lengths = np.searchsorted(self._codes, keys, side="right") - starts
+        positions = np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        # Every position in every range, without a loop over the buckets
+
+        found = np.bincount(self._order[positions], minlength=self._num_vectors)  # Number of buckets each is in
+        candidates = np.flatnonzero(found > 0)
+        if self.max_candidates and len(candidates) > self.max_candidates:
+            # Only the vectors in the most buckets, as they are the most likely to be close
+            candidates = np.sort(candidates[np.argpartition(-found[candidates], self.max_candidates - 1)[
+                                            :self.max_candidates]])
+        return candidates
+
+    def query(self, vector, number, metric="cosine", exclude=None):
+        # The indexes and scores of the closest vectors, highest first. metric is "cosine", or "dot" for the same
+        # score as the recommendations. exclude is a list of indexes that are not returned.
+        candidates = self.candidates(vector)
+        if exclude is not None:
+            candidates = candidates[~np.isin(candidates, exclude)]
+
+        scores = ml_utilities.factor_scores(
+            np.asarray(vector)[np.newaxis],
+            self._vectors[candidates],
+            None if self._scales is None else self._scales[candidates]
+        )[0]
+        if metric == "cosine":
+            norms = ml_utilities.factor_norms(
+                self._vectors[candidates], None if self._scales is None else self._scales[candidates]
+            ) * np.linalg.norm(vector)
+            scores = np.divide(scores, norms, out=np.zeros(len(scores)), where=norms > 0)
+
+        number = min(number, len(candidates))
+        top = np.argpartition(-scores, number - 1)[:number] if number else np.zeros(0, dtype=np.int64)
+        top = top[np.lexsort((candidates[top], -scores[top]))]  # Highest first, then lowest index
+        return candidates[top], scores[top]
+
+    def query_index(self, index, number, metric="cosine"):
+        # The closest vectors to one of the indexed vectors, not including itself
+        vector = ml_utilities.expand_factors(self._vectors, self._scales, [index])[0]
+        return self.query(vector, number, metric, exclude=[index])
+
+    def to_arrays(self):
+        # Saved with the model snapshot by Recommendations.save_model, so loading a model does not rebuild the index
+        return {"planes": self._planes, "codes": self._codes, "order": self._order}
+
+    @classmethod
+    def from_arrays(cls, vectors, arrays, scales=None, probes=3):
+        return cls(vectors, scales, probes=probes, planes=arrays["planes"], codes=arrays["codes"],
+                   order=arrays["order"])
@@ -51,17 +51,6 @@ number_home_summaries = config.get("home number_home_summaries")  # This is a
 # -----------------------------------------------------------------------------
 # Class instantiation
 # -----------------------------------------------------------------------------
-diaries = components.diaries.Diaries(connection)
-genres = components.genres.Genres(connection)
-sessions = components.accounts.Sessions(
-    connection,
-    config.get("session_id_length")
-)
-authors = components.authors.Authors(
-    connection,
-    config.get("number_display_genres"),
-    number_home_summaries
-)
 recommendations = components.recommendations.Recommendations(
     connection,
     config.get("recommendations number_converge_iterations"),
@@ -73,6 +62,29 @@ recommendations = components.recommendations.Recommendations(
     config.get("recommendations bad_recommendations_matrix_value"),
     config.get("recommendations minimum_required_reviews"),
     config.get("recommendations number_recommendations"),
+    sparse=config.get("recommendations sparse_training"),
+    solver=config.get("recommendations solver"),
+    confidence_weight=config.get("recommendations confidence_weight"),  # The same solver as the model was trained
+    # with, as fold_in_user solves the user's factors the same way
+    model_directory=config.get("recommendations model_directory"),
+    fold_in=config.get("recommendations fold_in_updates"),
+    serving_precision=config.get("recommendations serving_precision"),
+    index_tables=config.get("recommendations index_tables"),
+    index_bits=config.get("recommendations index_bits"),
+    index_probes=config.get("recommendations index_probes"),
+    reload_interval=config.get("recommendations reload_interval")
+)
+diaries = components.diaries.Diaries(connection, recommendations)  # Created after recommendations, as they notify it
+genres = components.genres.Genres(connection)
+sessions = components.accounts.Sessions(
+    connection,
+    config.get("session_id_length")
+)
+authors = components.authors.Authors(
+    connection,
+    config.get("number_display_genres"),
+    number_home_summaries,
+    recommendations
 )
 reading_lists = components.reading_lists.ReadingLists(
     connection,
@@ -85,7 +97,9 @@ books = components.books.Books(
     reading_lists,
     config.get("home number_about_similarities"),
     number_home_summaries,
-    config.get("number_display_genres")
+    config.get("number_display_genres"),
+    recommendations,
+    similar_from_factors=config.get("home similar_books_from_factors")
 )
 accounts = components.accounts.Accounts(
     connection,
@@ -99,7 +113,10 @@ information_retrieval = components.information_retrieval.DocumentCollection(
     books,
     authors,
     genres,
-    config.get("search number_results")
+    config.get("search number_results"),
+    engine=config.get("search engine"),
+    index_directory=config.get("search index_directory"),
+    reload_interval=config.get("search reload_interval")
 )
 
 
@@ -115,6 +132,8 @@ class Middleware(object):
         self._log.output_message(f"Create Middleware object")
 
     def __call__(self, environ, start_response):
+        recommendations.refresh_model()  # Between requests, so a request never sees part of a new model
+        information_retrieval.refresh_index()
         target_name = environ_manipulation.application.get_target(environ)
         self._log.output_message(f"Attempting to redirect to {target_name} application")
         target_application = self._routes.get(target_name) or ErrorHandler("404 Not Found", log)
@@ -1258,13 +1277,14 @@ class SearchingHandler(Handler):
             if res is not None:
                 book_id, title = res
                 if book_id is not None:
-                    result["because_read"] = books.get_similar_items(book_id)
+                    result["because_read"] = books.get_read_together_items(book_id) or books.get_similar_items(book_id)
+                    # Uses genres if nobody else has read it
                     result["because_read_title"] = title
             res = reading_lists.get_newest_addition(user_id)
             if res is not None:
                 book_id, title = res
                 if book_id is not None:
-                    result["because_added"] = books.get_similar_items(book_id)
+                    result["because_added"] = books.get_read_together_items(book_id) or books.get_similar_items(book_id)
                     result["because_added_title"] = title
             result["favourite_authors"] = authors.get_author_favourite_data(user_id)
             
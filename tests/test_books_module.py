@@ -51,6 +51,18 @@ books = components.books.Books(
     config.get("number_display_genres")
 )
 
+
+class NearestBooks:
+    # Gives the results of Recommendations.nearest_books, without a trained model
+    def __init__(self, nearest):
+        self._nearest = nearest
+        self.calls = []
+
+    def nearest_books(self, number, book_id=None, vector=None, metric="cosine"):
+        self.calls.append((number, book_id))
+        return self._nearest.get(book_id, [])[:number]
+
+
 def test_leave_review():
     input("Press any key to proceed")
     print("check addition for review for book 1, user 2.")
@@ -123,6 +135,27 @@ class BooksTest(unittest.TestCase):
             500
         )
 
+    def test_similar_books_genres_by_default(self):
+        nearest = NearestBooks({1: [(3, 0.9), (4, 0.8)]})
+        genre_books = components.books.Books(connection, reading_lists, 2, number_home_summaries,
+                                             config.get("number_display_genres"), nearest)
+
+        exp = [{'author': 'Author 1', 'title': 'Book 5', 'book_id': 5, 'cover': ''}, {'author': 'Author 2', 'title': 'Book 2', 'book_id': 2, 'cover': ''}]
+        assert (genre_books.get_similar_items(1) == exp)
+        assert (nearest.calls == [])
+
+    def test_similar_books_from_factors(self):
+        nearest = NearestBooks({1: [(3, 0.9), (4, 0.8)]})
+        factor_books = components.books.Books(connection, reading_lists, 2, number_home_summaries,
+                                              config.get("number_display_genres"), nearest, similar_from_factors=True)
+
+        exp = [{'author': 'Author 3', 'title': 'Book 3', 'book_id': 3, 'cover': ''}, {'author': 'Author 2', 'title': 'Book 4', 'book_id': 4, 'cover': ''}]
+        assert (factor_books.get_similar_items(1) == exp)
+        assert (nearest.calls == [(2, 1)])
+
+        exp = [{'author': 'Author 3', 'title': 'Book 3', 'book_id': 3, 'cover': ''}, {'author': 'Author 2', 'title': 'Book 4', 'book_id': 4, 'cover': ''}]
+        assert (factor_books.get_similar_items(2) == exp)  # Not in the model, so by its genres
+
     def test_summary_data_id(self):
         exp = {'author': 'Author 1', 'title': 'Book 1', 'book_id': 1, 'cover': ''}
         assert (books.get_summary(1) == exp)
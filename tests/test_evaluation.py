@@ -0,0 +1,66 @@
+import unittest
+import math
+import sys
+import os
+
+import numpy as np
+import scipy.sparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + "/backend/")
+
+import evaluation
+
+
+class EvaluationTest(unittest.TestCase):
+    def setUp(self):
+        self.top = np.array([
+            [1, 2, 3],
+            [4, 0, -1],  # Only 2 books could be recommended
+            [0, 1, 2]
+        ])
+        self.relevant = scipy.sparse.csr_matrix(np.array([
+            [0, 1, 0, 1, 0],
+            [1, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0]  # Nothing held out, so is not counted
+        ]))
+
+    def test_hits(self):
+        exp = np.array([
+            [True, False, True],
+            [False, True, False],
+            [False, False, False]
+        ])
+
+        out = evaluation.hits_at_k(self.top, self.relevant)
+
+        assert (np.array_equal(exp, out))
+
+    def test_per_user(self):
+        hits = evaluation.hits_at_k(self.top, self.relevant)[:2]
+        num_relevant = evaluation.number_relevant(self.relevant)[:2]
+
+        assert (np.allclose(evaluation.precision_at_k(hits), [2 / 3, 1 / 3]))
+        assert (np.allclose(evaluation.recall_at_k(hits, num_relevant), [1, 1]))
+        assert (np.allclose(
+            evaluation.ndcg_at_k(hits, num_relevant),
+            [(1 + 1 / 2) / (1 + 1 / math.log2(3)), (1 / math.log2(3)) / 1]
+        ))
+        assert (np.allclose(evaluation.average_precision(hits, num_relevant), [(1 + 2 / 3) / 2, 1 / 2]))
+
+    def test_evaluate(self):
+        out = evaluation.evaluate(self.top, self.relevant)
+
+        assert (math.isclose(out["precision"], 0.5))
+        assert (math.isclose(out["recall"], 1))
+        assert (math.isclose(out["map"], ((1 + 2 / 3) / 2 + 1 / 2) / 2))
+        assert (math.isclose(out["coverage"], 1))  # Every book is recommended to someone
+
+    def test_masked_mean_squared_error(self):
+        true = np.array([[1, 0], [0, 3]])
+        predicted = np.array([[2, 5], [5, 3]])
+
+        assert (evaluation.masked_mean_squared_error(true, predicted) == 0.5)  # The 0 ratings are not known
+
+
+if __name__ == '__main__':
+    unittest.main()
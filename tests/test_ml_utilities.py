@@ -4,6 +4,8 @@ import unittest
 import sys
 import os
 
+import numpy as np
+
 sys.path.append("/".join(os.getcwd().split("/")[:-1]) + "/backend/")
 
 import ml_utilities
@@ -21,6 +23,64 @@ class ApplicationTest(unittest.TestCase):
 
     # mean_squared_error is not used
 
+    def test_implicit_als_step(self):
+        ratings = (np.random.random((30, 20)) < 0.2) * np.random.randint(1, 6, (30, 20))
+        fixed = np.random.random((20, 4))
+
+        out = ml_utilities.implicit_als_step(ratings, fixed, 0.1, 10, block_memory=100)  # Forces several blocks
+
+        for row, values in enumerate(ratings):
+            confidence = np.diag(1 + 10 * values)
+            preference = (values > 0).astype(float)
+            exp = np.linalg.solve(
+                fixed.T.dot(confidence).dot(fixed) + np.eye(4) * 0.1,
+                fixed.T.dot(confidence).dot(preference)
+            )
+
+            assert (np.allclose(exp, out[row]))
+
+    def test_top_column_similarities(self):
+        matrix = (np.random.random((40, 15)) < 0.3).astype(float)
+        norms = np.linalg.norm(matrix, axis=0)
+
+        columns, similar, similarities = ml_utilities.top_column_similarities(matrix, 3, 0.1, block_size=4)
+
+        for column in range(15):
+            exp = []
+            for other in range(15):
+                if other != column and norms[column] > 0 and norms[other] > 0:
+                    similarity = matrix[:, column].dot(matrix[:, other]) / (norms[column] * norms[other])
+                    if similarity > 0.1:
+                        exp.append((-similarity, other))
+            exp.sort()
+
+            assert ([i[1] for i in exp[:3]] == similar[columns == column].tolist())
+            assert (np.allclose([-i[0] for i in exp[:3]], similarities[columns == column]))
+
+    def test_quantise_rows(self):
+        factors = np.random.random((20, 6)) - 0.5
+        factors[3] = 0
+
+        values, scales = ml_utilities.quantise_rows(factors)
+
+        assert (values.dtype == np.int8)
+        assert (np.abs(values).max() <= 127)
+        assert (np.allclose(ml_utilities.expand_factors(values, scales), factors, atol=scales.max() / 2))  # Within
+        # half a step of the original
+        assert (not ml_utilities.expand_factors(values, scales)[3].any())
+
+    def test_factor_scores(self):
+        vectors = np.random.random((5, 6))
+        values, scales = ml_utilities.quantise_rows(np.random.random((20, 6)))
+
+        exp = vectors.dot(ml_utilities.expand_factors(values, scales).T)
+        out = ml_utilities.factor_scores(vectors, values, scales)
+
+        assert (np.allclose(exp, out, rtol=1e-5))
+        assert (np.array_equal(ml_utilities.factor_scores(vectors, values, scales, block_size=3), out))  # Scored a
+        # few rows at a time
+        assert (np.allclose(ml_utilities.factor_scores(vectors[0], values, scales, block_size=3), out[0], rtol=1e-5))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,75 @@
+import tempfile
+import unittest
+import sys
+import os
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + "/backend/")
+
+import model_store
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.directory = self._directory.name
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test_no_snapshot(self):
+        assert (model_store.current_version(self.directory) is None)
+
+        self.assertRaises(
+            model_store.SnapshotNotFoundError,
+            model_store.load_snapshot,
+            self.directory
+        )
+
+    def test_round_trip(self):
+        arrays = {
+            "factors": np.random.random((10, 4)),
+            "ids": np.arange(10, dtype=np.int64)
+        }
+
+        version = model_store.save_snapshot(self.directory, arrays)
+        out_version, out = model_store.load_snapshot(self.directory)
+
+        assert (version == out_version == 1)
+        assert (set(out.keys()) == {"factors", "ids"})
+        assert (np.array_equal(out["factors"], arrays["factors"]))
+        assert (np.array_equal(out["ids"], arrays["ids"]))
+
+    def test_memory_mapped(self):
+        model_store.save_snapshot(self.directory, {"factors": np.random.random((10, 4))})
+        version, out = model_store.load_snapshot(self.directory)
+
+        assert (isinstance(out["factors"], np.memmap))
+        assert (not out["factors"].flags.writeable)
+
+    def test_versions(self):
+        for i in range(4):
+            model_store.save_snapshot(self.directory, {"value": np.array([i])}, keep=2)
+
+        assert (model_store.current_version(self.directory) == 4)
+        assert (model_store.load_snapshot(self.directory)[1]["value"][0] == 3)
+        assert (model_store.load_snapshot(self.directory, version=3)[1]["value"][0] == 2)
+        assert (sorted(os.listdir(self.directory)) == ["CURRENT", "v3", "v4"])  # Older versions are removed
+
+    def test_training_lock(self):
+        assert (not model_store.is_training(self.directory))
+
+        lock_file = model_store.acquire_training_lock(self.directory)
+
+        assert (lock_file is not None)
+        assert (model_store.is_training(self.directory))
+        assert (model_store.acquire_training_lock(self.directory) is None)  # Only one process can train at once
+
+        lock_file.close()
+
+        assert (not model_store.is_training(self.directory))
+
+
+if __name__ == '__main__':
+    unittest.main()
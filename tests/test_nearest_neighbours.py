@@ -0,0 +1,62 @@
+import unittest
+import sys
+import os
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + "/backend/")
+
+import ml_utilities
+import nearest_neighbours
+
+
+class RandomProjectionIndexTest(unittest.TestCase):
+    def setUp(self):
+        generator = np.random.default_rng(0)
+        centres = generator.normal(size=(20, 8))
+        self.vectors = centres[generator.integers(0, 20, 2000)] + generator.normal(size=(2000, 8)) * 0.3
+        self.index = nearest_neighbours.RandomProjectionIndex(self.vectors, num_tables=8, num_bits=8, probes=2)
+
+    def exact(self, index, number):
+        norms = np.linalg.norm(self.vectors, axis=1)
+        scores = self.vectors.dot(self.vectors[index]) / (norms * norms[index])
+        scores[index] = -np.inf
+        return np.argsort(-scores)[:number]
+
+    def test_recall(self):
+        recall = [len(np.intersect1d(self.index.query_index(i, 10)[0], self.exact(i, 10))) / 10 for i in range(50)]
+
+        assert (np.mean(recall) > 0.9)
+
+    def test_query_index(self):
+        indexes, scores = self.index.query_index(5, 10)
+
+        assert (5 not in indexes)
+        assert (len(indexes) == 10)
+        assert (np.all(np.diff(scores) <= 0))  # Highest first
+
+    def test_dot(self):
+        vector = np.ones(8)
+        indexes, scores = self.index.query(vector, 5, metric="dot")
+
+        assert (np.allclose(scores, self.vectors[indexes].dot(vector)))
+
+    def test_from_arrays(self):
+        loaded = nearest_neighbours.RandomProjectionIndex.from_arrays(self.vectors, self.index.to_arrays(), probes=2)
+
+        for i in range(10):
+            exp = self.index.query_index(i, 10)
+            out = loaded.query_index(i, 10)
+            assert (np.array_equal(exp[0], out[0]))
+            assert (np.allclose(exp[1], out[1]))
+
+    def test_compact(self):
+        values, scales = ml_utilities.compact_factors(self.vectors, "int8")
+        index = nearest_neighbours.RandomProjectionIndex(values, scales, num_tables=8, num_bits=8, probes=2)
+        recall = [len(np.intersect1d(index.query_index(i, 10)[0], self.exact(i, 10))) / 10 for i in range(50)]
+
+        assert (np.mean(recall) > 0.8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,446 @@
+import unittest
+import unittest.mock
+import contextlib
+import tempfile
+import re
+import sys
+import os
+
+import numpy as np
+import scipy.sparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + "/backend/")
+
+import components.recommendations
+import interaction_export
+import ml_utilities
+
+
+class Interactions:
+    # Gives the rows Recommendations reads from the database, and keeps every query that is made
+    def __init__(self):
+        self.queries = []
+        self.transactions = []
+        self.tables = {
+            "users": [(1,), (2,), (3,)],
+            "books": [(1,), (2,), (3,), (4,)],
+            "genres": [(1,), (2,)],
+            "book_genres": [(1, "0.9,0.1", "1,2"), (2, "0.2,0.8", "1,2"), (3, "0.5", "1"), (4, "0.7", "2")],
+            "reviews": [(1, 1, 4.0), (1, 2, 2.0), (2, 3, 5.0), (3, 4, 1.0), (4, 2, 3.5)],
+            "initial_preferences": [(2, 1)],
+            "reading_lists": [(1, 3), (3, 1)],
+            "author_followers": [(3, 2)],
+            "bad_recommendations": [],
+            "diary_entries": [(2, 3, 4.0)]
+        }
+        self.exclusions = []  # (user_id, book_id) of the books that should not be recommended
+        self.now = 0  # Time given by NOW()
+        self.dirty_users = dict()  # user_id -> date_added
+        self.authors = [1, 2, 3, 5]  # Author 5 was added after the profiles were made
+        self.author_profiles = [(1, 1, 1.4, 2), (1, 2, 0.1, 1), (2, 1, 0.2, 1), (2, 2, 1.5, 2), (2, 3, 0.4, 1),
+                                (3, None, None, 0)]  # Genre 3 was added after the model was trained
+
+    def query(self, query):
+        self.queries.append(" ".join(query.split()))
+        if "dirty_users" in query or "NOW()" in query.split("FROM")[0]:
+            return self.dirty_users_query(" ".join(query.split()))
+        elif "SELECT user_id, book_id FROM reading_lists UNION" in " ".join(query.split()):
+            rows = sorted({i[:2] for table in ("reading_lists", "reviews", "diary_entries")
+                           for i in self.tables[table]})
+        elif "reading_list_names" in query and "FROM bad_recommendations" in query:
+            rows = self.exclusions
+        elif "UNION" in query or "SELECT preferences_set" in query:
+            rows = [(1,)] if "SELECT preferences_set" in query else []
+        elif "preferences_set=FALSE" in query:
+            rows = []
+        elif "SELECT authors.author_id" in query:
+            rows = self.author_profiles
+        elif "FROM authors" in query:
+            authors = re.search(r"author_id IN \(([\d,]+)\)", query).group(1).split(",")
+            rows = [(i,) for i in self.authors if str(i) in authors]
+        else:
+            rows = []
+            for table, table_rows in self.tables.items():
+                if query.strip().startswith("SELECT") and re.search(r"FROM {}\b".format(table), query):
+                    rows = table_rows
+                    break
+
+        users = re.search(r"user_id IN \(([\d,]+)\)", query)
+        if users and query.strip().startswith("SELECT"):
+            rows = [i for i in rows if str(i[0]) in users.group(1).split(",")]
+        return rows
+
+    def dirty_users_query(self, query):
+        if query == "SELECT NOW()":
+            return [(self.now,)]
+        elif query.startswith("INSERT INTO dirty_users"):
+            self.dirty_users[int(re.search(r"VALUES \((\d+)\)", query).group(1))] = self.now
+        elif query.startswith("DELETE FROM dirty_users"):
+            before = int(re.search(r"date_added<'(\d+)'", query).group(1))
+            self.dirty_users = {user: date for user, date in self.dirty_users.items() if date >= before}
+        elif query.startswith("SELECT user_id FROM dirty_users"):
+            return [(i,) for i in self.dirty_users]
+        return []
+
+    def stream(self, query, batch_size):
+        rows = self.query(query)
+        for start in range(0, len(rows), batch_size):
+            yield rows[start:start + batch_size]
+
+    @contextlib.contextmanager
+    def transaction(self):
+        start = len(self.queries)
+        yield
+        self.transactions.append(self.queries[start:])  # The queries that were committed together
+
+    def insert_rows(self, table, columns, values, update_columns=None):
+        self.queries.append("INSERT INTO {} ({}) VALUES {}".format(table, ", ".join(columns), ", ".join(values)))
+
+    def replace_table(self, table, columns, values):
+        self.queries.append("REPLACE {} ({}) VALUES {}".format(table, ", ".join(columns), ", ".join(values)))
+
+
+def recommendations_model(connection, **settings):
+    return components.recommendations.Recommendations(connection, 10, 0.1, 2, 3, 0.1, 0.1, -1, 1, 2, **settings)
+
+
+class FoldInTest(unittest.TestCase):
+    def setUp(self):
+        self.connection = Interactions()
+
+    def assert_full_solve(self, solver):
+        recommendations = recommendations_model(self.connection, solver=solver, confidence_weight=10, fold_in=True)
+        ratings = recommendations.gen_review_matrix_bulk()
+        if solver == "implicit":
+            expected = ml_utilities.implicit_als_step(scipy.sparse.csr_matrix(ratings), recommendations.book_factors,
+                                                      0.1, 10)
+        else:
+            expected = recommendations.wals_step(ratings, recommendations.book_factors)
+
+        for index, user_id in enumerate(recommendations.user_ids.tolist()):
+            assert (np.allclose(recommendations.fold_in_user(user_id), expected[index]))
+
+    def test_wals(self):
+        self.assert_full_solve("wals")
+
+    def test_implicit(self):
+        self.assert_full_solve("implicit")
+
+    def test_read_only(self):
+        recommendations = recommendations_model(self.connection, fold_in=True)
+        recommendations.fold_in_user(1)
+
+        assert (not any(i.startswith("DELETE FROM initial_preferences") or
+                        i.startswith("DELETE FROM bad_recommendations") for i in self.connection.queries))
+
+    def test_new_user(self):
+        recommendations = recommendations_model(self.connection, fold_in=True)
+        user_vec = recommendations.fold_in_user(4)  # Only has a review, as it signed up after the model was made
+
+        assert (4 not in recommendations.user_index_table)
+        assert (user_vec.any())
+
+    def test_model_unchanged(self):
+        recommendations = recommendations_model(self.connection, fold_in=True)
+        model = recommendations._model
+        book_factors = model.book_factors.copy()
+        recommendations.fold_in_user(1)
+        recommendations.fold_in_user(4)
+
+        assert (recommendations._model is model)
+        assert (np.array_equal(model.book_factors, book_factors))
+
+    def test_refresh_model(self):
+        with tempfile.TemporaryDirectory() as directory:
+            trainer = recommendations_model(self.connection, model_directory=directory)
+            trainer.save_model()
+            server = recommendations_model(self.connection, model_directory=directory, fold_in=True,
+                                           reload_interval=0)
+            old = server._model
+            server.fold_in_user(1)
+
+            trainer.book_factors = trainer.book_factors * 2
+            trainer._model = trainer._make_model()
+            trainer.save_model()  # As if maintenance.py had trained a new model
+            server.refresh_model()
+
+            assert (old.version == 1 and server._model.version == 2)
+            assert (np.allclose(server._model.book_factors, old.book_factors * 2))
+            assert ("norms" in server._model.cache and "index" in server._model.cache)  # Made before it was swapped in
+            assert ("gram" in old.cache and "gram" not in server._model.cache)  # Each model has its own
+            assert (np.allclose(server._book_gram(server._model), old.book_factors.T.dot(old.book_factors) * 4 +
+                                np.eye(2) * 0.1))
+
+    def test_notify_interaction(self):
+        recommendations = recommendations_model(self.connection, fold_in=True)
+        recommendations.notify_interaction(2)
+
+        assert ("INSERT INTO dirty_users (user_id) VALUES (2) ON DUPLICATE KEY UPDATE date_added=NOW()"
+                in self.connection.queries)
+        transaction = self.connection.transactions[-1]
+        assert (transaction[0] == "DELETE FROM recommendations WHERE user_id=2")
+        assert (transaction[1].startswith("INSERT INTO recommendations (user_id, book_id, certainty) VALUES (2, "))
+
+    def test_notify_interaction_without_fold_in(self):
+        recommendations = recommendations_model(self.connection)
+        recommendations.notify_interaction(2)
+
+        assert (any(i.startswith("INSERT INTO dirty_users") for i in self.connection.queries))
+        assert (not any("recommendations (user_id" in i or "DELETE FROM recommendations" in i
+                        for i in self.connection.queries))
+
+
+class GenerationTest(unittest.TestCase):
+    def setUp(self):
+        self.connection = Interactions()
+        self.connection.exclusions = [(1, 3), (3, 1), (3, 2)]
+
+    def generate(self, **settings):
+        recommendations = recommendations_model(self.connection, **settings)
+        generator = np.random.default_rng(0)
+        recommendations.user_factors = generator.normal(size=(3, 2))
+        recommendations.book_factors = generator.normal(size=(4, 2))
+        recommendations.gen_recommendations(incremental=False)
+
+        rows = re.findall(r"\((\d+), (\d+), (-?[\d.e-]+)\)", self.connection.queries[-2])
+        return recommendations, [(int(i[0]), int(i[1]), float(i[2])) for i in rows]
+
+    def test_recommendations(self):
+        recommendations, rows = self.generate()
+
+        expected = []
+        for user, user_vec in enumerate(recommendations.user_factors):
+            scores = recommendations.book_factors.dot(user_vec)
+            for book in np.argsort(-scores, kind="stable"):
+                user_id, book_id = int(recommendations.user_ids[user]), int(recommendations.book_ids[book])
+                if (user_id, book_id) not in self.connection.exclusions and \
+                        len([i for i in expected if i[0] == user_id]) < 2:
+                    expected.append((user_id, book_id, min(scores[book] / (np.linalg.norm(user_vec) *
+                                                                           np.linalg.norm(recommendations.book_factors[book])), 1)))
+
+        assert ([i[:2] for i in rows] == [i[:2] for i in expected])
+        assert (np.allclose([i[2] for i in rows], [i[2] for i in expected]))
+
+    def test_blocks(self):
+        rows = self.generate()[1]
+        block_rows = self.generate(generation_block_size=1)[1]
+
+        assert ([i[:2] for i in block_rows] == [i[:2] for i in rows])
+        assert (np.allclose([i[2] for i in block_rows], [i[2] for i in rows]))
+
+
+class ExclusionTest(unittest.TestCase):
+    def setUp(self):
+        self.connection = Interactions()
+        self.connection.exclusions = [(1, 3), (3, 1), (3, 2), (2, 9), (8, 1)]  # Book 9 and user 8 are not in the model
+        self.recommendations = recommendations_model(self.connection)
+
+    def test_every_user(self):
+        queries = len(self.connection.queries)
+        exclusions = self.recommendations.load_exclusions()
+
+        assert (len(self.connection.queries) == queries + 1)  # Every user at once
+        assert (exclusions.toarray().tolist() == [[False, False, True, False], [False] * 4,
+                                                  [True, True, False, False]])
+
+    def test_users(self):
+        exclusions = self.recommendations.load_exclusions([3, 1, 8])
+
+        assert (exclusions.toarray().tolist() == [[True, True, False, False], [False, False, True, False],
+                                                  [True, False, False, False]])  # Rows in the order given
+        assert ("user_id IN (3,1,8)" in self.connection.queries[-1])
+
+    def test_without_recent(self):
+        self.recommendations.load_exclusions(include_recent=False)
+
+        assert ("FROM recommendations" not in self.connection.queries[-1])
+        assert ("FROM bad_recommendations" in self.connection.queries[-1])
+
+    def test_bad_recommendations(self):
+        self.connection.tables["bad_recommendations"] = [(1, 3), (2, 1), (1, 4)]
+        queries = len(self.connection.queries)
+
+        assert (self.recommendations.get_bad_recommendations(1) == [3, 4])
+        assert (self.recommendations.get_bad_recommendations(3) == [])
+        assert ("INTERVAL 10 WEEK" in self.connection.queries[-1])  # Expired ones are not included
+        assert (not any(i.startswith("DELETE") for i in self.connection.queries[queries:]))  # Only read
+
+
+class IncrementalGenerationTest(unittest.TestCase):
+    def setUp(self):
+        self.connection = Interactions()
+        self.recommendations = recommendations_model(self.connection)
+
+    def generated_users(self):
+        queries = [i for i in self.connection.queries if i.startswith("INSERT INTO recommendations")]
+        self.connection.queries = []
+        return sorted({int(i) for i in re.findall(r"\((\d+), \d+, ", queries[-1])}) if queries else []
+
+    def test_dirty_users(self):
+        self.recommendations.mark_dirty(2)
+        self.connection.now = 1
+        self.recommendations.gen_recommendations(incremental=True)
+
+        assert (self.generated_users() == [2])  # Only the marked user
+        assert (self.connection.dirty_users == dict())
+
+        self.recommendations.gen_recommendations(incremental=True)
+
+        assert (self.generated_users() == [])  # Nothing has changed since
+
+    def test_marked_while_generating(self):
+        self.recommendations.mark_dirty(2)
+        self.recommendations.gen_recommendations(incremental=True)  # Started in the same second
+
+        assert (self.generated_users() == [2])
+        assert (2 in self.connection.dirty_users)  # Could have been marked after it was read, so is generated again
+
+        self.connection.now = 1
+        self.recommendations.gen_recommendations(incremental=True)
+
+        assert (self.generated_users() == [2])
+        assert (self.connection.dirty_users == dict())
+
+    def test_full(self):
+        self.recommendations.mark_dirty(2)
+        self.connection.now = 1
+        self.recommendations.gen_recommendations(incremental=False)
+
+        assert (self.generated_users() == [1, 2, 3])
+        assert (self.connection.dirty_users == dict())
+
+
+class BookSimilarityTest(unittest.TestCase):
+    def test_similarities(self):
+        connection = Interactions()
+        connection.tables["reviews"].append((2, 9, 3.0))  # A book that is not in the catalog
+        recommendations_model(connection, number_similar_books=2).save_book_similarities()
+
+        rows = re.findall(r"\((\d+), (\d+), ([\d.]+)\)", connection.queries[-1])
+
+        assert (connection.queries[-1].startswith("REPLACE book_similarities (book_id, similar_book_id, similarity)"))
+        assert ([(int(i[0]), int(i[1])) for i in rows] == [(1, 4), (1, 2), (2, 1), (2, 3), (3, 1), (3, 2), (4, 1)])
+        # The most similar first, then the lowest id, and only books with a user in common
+        assert (np.allclose([float(i[2]) for i in rows], [2 ** -0.5, 0.5, 0.5, 0.5, 0.5, 0.5, 2 ** -0.5]))
+
+
+class InteractionSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.connection = Interactions()
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "interactions.npz")
+        interaction_export.export_interactions(self.connection, self.filename, batch_size=2)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_snapshot(self):
+        catalog, interactions = components.recommendations.load_interaction_snapshot(self.filename)
+        expected = recommendations_model(self.connection).load_interactions()
+
+        assert (catalog["user_ids"].tolist() == [1, 2, 3])
+        assert (catalog["book_ids"].tolist() == [1, 2, 3, 4])
+        assert (set(interactions) == set(expected))
+        for name, columns in expected.items():
+            assert (len(interactions[name]) == len(columns))
+            assert (all(np.allclose(i, k) for i, k in zip(interactions[name], columns)))
+
+    def test_fit(self):
+        recommendations = recommendations_model(self.connection)
+        self.connection.queries = []
+        recommendations.fit(snapshot=self.filename)
+
+        assert (not any(i.startswith("DELETE") for i in self.connection.queries))  # Left to maintenance.py
+        assert (not any(i.startswith("SELECT") and "FROM reviews" in i for i in self.connection.queries))
+        # Trained from the snapshot
+        assert (recommendations.user_ids.tolist() == [1, 2, 3])
+        assert (recommendations.book_factors.shape == (4, 2))
+
+
+class EarlyStoppingTest(unittest.TestCase):
+    def test_best_factors(self):
+        class Recommendations(components.recommendations.Recommendations):
+            def training_loss(self, train):
+                iterations.append(self.book_factors.copy())  # The factors of each iteration
+                return super().training_loss(train)
+
+        iterations = []
+        recommendations = recommendations_model(Interactions(), early_stopping_metric="precision",
+                                                convergence_tolerance=-1)
+        recommendations.__class__ = Recommendations
+        with unittest.mock.patch.object(components.recommendations.evaluation, "evaluate",
+                                        side_effect=[{"precision": i} for i in (0.1, 0.5, 0.3, 0.2)]):
+            recommendations.fit()
+
+        assert (len(iterations) == 4)  # Stopped after 2 iterations without an improvement
+        assert (np.allclose(recommendations.book_factors, iterations[1]))  # The best held out ranking
+        assert (not np.allclose(recommendations.book_factors, iterations[3]))
+
+
+class AuthorProfileTest(unittest.TestCase):
+    def setUp(self):
+        self.connection = Interactions()
+        self.recommendations = recommendations_model(self.connection)
+
+    def test_profiles(self):
+        assert (self.recommendations.author_ids.tolist() == [1, 2, 3])
+        assert (np.allclose(self.recommendations.author_genre_sums, [[1.4, 0.1], [0.2, 1.5], [0, 0]]))
+        assert (np.allclose(self.recommendations.author_genre_counts, [[2, 1], [1, 2], [0, 0]]))
+
+    def test_scoring(self):
+        queries = len(self.connection.queries)
+        result = self.recommendations.add_user(1, [1])  # Average genres of (0.7, 0.1)
+
+        assert ([i["book_id"] for i in result] == [1, 3])
+        assert (np.allclose([i["strength"] for i in result], [0.64, 0.35]))
+        assert (np.allclose([i["certainty"] for i in result],
+                            [0.64 / (np.linalg.norm([0.7, 0.1]) * np.linalg.norm([0.9, 0.1])),
+                             0.35 / (np.linalg.norm([0.7, 0.1]) * 0.5)]))
+        assert ("INSERT INTO initial_preferences (user_id, author_id) VALUES (1, 1)" in self.connection.queries)
+        assert (not any("SELECT authors.author_id" in i for i in self.connection.queries[queries:]))  # Not remade
+
+    def test_author_without_profile(self):
+        assert (self.recommendations.add_user(1, [1, 5]) == self.recommendations.add_user(1, [1]))
+
+    def test_unknown_author(self):
+        assert (self.recommendations.add_user(1, [1, 9]) is None)
+        assert (not any(i.startswith("INSERT INTO initial_preferences") for i in self.connection.queries))
+
+    def test_wider_profiles(self):
+        expected = self.recommendations.add_user(1, [2])
+        self.recommendations._set_author_profiles(
+            self.recommendations.author_ids,
+            [1, 2, 3],
+            np.hstack((self.recommendations.author_genre_sums, np.ones((3, 1)))),
+            np.hstack((self.recommendations.author_genre_counts, np.ones((3, 1))))
+        )  # Made with a genre the model does not have a factor for
+        self.recommendations._model = self.recommendations._make_model()
+
+        assert (self.recommendations.add_user(1, [2]) == expected)
+
+    def test_profile_genre_order(self):
+        expected = self.recommendations.add_user(1, [2])
+        self.recommendations._set_author_profiles(
+            self.recommendations.author_ids,
+            [3, 2],
+            np.hstack((np.ones((3, 1)), self.recommendations.author_genre_sums[:, [1]])),
+            np.hstack((np.ones((3, 1)), self.recommendations.author_genre_counts[:, [1]]))
+        )  # Made after genre 1 was removed and genre 3 was added
+        self.recommendations._model = self.recommendations._make_model()
+        result = self.recommendations.add_user(1, [2])
+
+        assert (result != expected)
+        assert (np.allclose([i["strength"] for i in result],
+                            [0.75 * i for i in (0.8, 0.7)]))  # Only genre 2, with an average of 0.75
+
+    def test_saved_profiles(self):
+        with tempfile.TemporaryDirectory() as directory:
+            trainer = recommendations_model(self.connection, model_directory=directory)
+            trainer.save_model()
+            server = recommendations_model(self.connection, model_directory=directory)
+
+            assert (server._model.author_genre_ids.tolist() == [1, 2])
+            assert (server.add_user(1, [1]) == trainer.add_user(1, [1]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,310 @@
+import tempfile
+import unittest
+import math
+import random
+import re
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + "/backend/")
+
+import components.information_retrieval
+
+
+class Documents:
+    # Gives the rows DocumentCollection reads from the database
+    def __init__(self, books, genres, authors):
+        self._books = books
+        self._genres = genres
+        self._authors = authors
+        self.words = []  # (word_id, word) rows of unique_words, see gen_idf_values
+        self.changes = []  # Rows of search_index_changes
+        self.last_change_id = 0  # AUTO_INCREMENT of change_id, which is never reused
+        self.queries = []
+        self.inserts = []
+
+    def query(self, query):
+        self.queries.append(query)
+        if "search_index_changes" in query:
+            return self.changes_query(" ".join(query.split()))
+        elif "SELECT word_id, word FROM unique_words" in query:
+            return self.words
+        elif "FROM books" in query:
+            return self._books
+        elif "FROM genres" in query:
+            return self._genres
+        elif "FROM authors" in query:
+            return self._authors
+        elif "FROM unique_words" in query:
+            documents = [title + " " + author for title, book_id, author in self._books] + \
+                        [i[0] for i in self._genres + self._authors]
+            words = {word for document in documents for word in document.split(" ")}
+            return [(word, math.log10(len(documents) / sum(word in i.split(" ") for i in documents)))
+                    for word in words]
+        return []
+
+    def changes_query(self, query):
+        if query.startswith("SELECT MAX(change_id)"):
+            return [(self.changes[-1][0] if self.changes else None,)]
+        elif query.startswith("INSERT"):
+            document_type, document_id, words = re.search(r'VALUES \("(\w)", (\d+), (NULL|"[\w ]*")\)', query).groups()
+            self.last_change_id += 1
+            self.changes.append((self.last_change_id, document_type, int(document_id),
+                                 None if words == "NULL" else words.strip('"')))
+        elif query.startswith("SELECT"):
+            after = int(re.search(r"change_id>(\d+)", query).group(1))
+            return [i for i in self.changes if i[0] > after]
+        elif query.startswith("DELETE"):
+            before = int(re.search(r"change_id<=(\d+)", query).group(1))
+            self.changes = [i for i in self.changes if i[0] > before]
+        return []
+
+    def insert_rows(self, table, columns, values, update_columns=None):
+        self.inserts.append((table, columns, values, update_columns))
+
+
+class SearchIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.connection = Documents(
+            [("the hunger games", 1, "suzanne collins"), ("catching fire", 2, "suzanne collins"),
+             ("the fire within", 3, "chris d lacey")],
+            [("fantasy", 1), ("science fiction", 2)],
+            [("suzanne collins", 1), ("chris d lacey", 2)]
+        )
+        self.collection = components.information_retrieval.DocumentCollection(self.connection, None, None, None, 10)
+
+    def test_search(self):
+        result = self.collection.tfidf_search("Fire!")
+
+        assert ([(i["type"], i["id"]) for i in result] == [("b", 2), ("b", 3)])
+        assert (math.isclose(result[0]["similarity"], 1))
+        assert (self.collection.tfidf_search("fire", 1) == result[:1])
+
+    def test_scan(self):
+        terms = "the fire, suzanne fire"  # A repeated word is counted each time
+        idf = dict(self.connection.query("SELECT word, idf_values FROM unique_words"))
+        search = [(word, terms.replace(",", "").split(" ").count(word) / 4 * idf[word])
+                  for word in terms.replace(",", "").split(" ")]
+
+        expected = []
+        for position, document in enumerate(self.collection._documents_dict):  # Every document, one at a time
+            products = [(weight, document["tf"].get(word, 0) * idf[word]) for word, weight in search]
+            similarity = sum(i * k for i, k in products)
+            if similarity > 0:
+                similarity /= math.sqrt(sum(i ** 2 for i, k in products)) * math.sqrt(sum(k ** 2 for i, k in products))
+                expected.append((-similarity, document["type"], position, document["id"]))
+        expected.sort()
+
+        result = self.collection.tfidf_search(terms)
+
+        assert ([(i["type"], i["id"]) for i in result] == [(i[1], i[3]) for i in expected])
+        assert (all(math.isclose(i["similarity"], -k[0]) for i, k in zip(result, expected)))
+        assert (self.collection.tfidf_search(terms, 2) == result[:2])
+
+    def test_saved_index(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.collection._index_directory = directory
+            self.collection.save_index()
+            loaded = components.information_retrieval.DocumentCollection(self.connection, None, None, None, 10,
+                                                                        index_directory=directory)
+
+            assert (loaded.index_version == self.collection.index_version)
+            assert (loaded.tfidf_search("suzanne collins") == self.collection.tfidf_search("suzanne collins"))
+
+    def test_changes(self):
+        self.collection.add_document("b", 4, "mockingjay suzanne collins")
+        self.collection.remove_document("b", 2)
+
+        assert ([(i["type"], i["id"]) for i in self.collection.tfidf_search("mockingjay")] == [("b", 4)])
+        assert ([(i["type"], i["id"]) for i in self.collection.tfidf_search("catching")] == [])
+
+        self.collection.update_document("b", 4, "the ballad of songbirds and snakes suzanne collins")
+
+        assert (self.collection.tfidf_search("mockingjay") == [])
+        assert ((4, "b") in [(i["id"], i["type"]) for i in self.collection.tfidf_search("ballad")])
+        self.assertRaises(
+            components.information_retrieval.DocumentNotFoundError,
+            self.collection.remove_document,
+            "b",
+            2
+        )
+
+    def test_changes_kept(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.collection._index_directory = directory
+            self.collection.save_index()
+            self.collection.add_document("b", 4, "mockingjay suzanne collins")
+            self.collection.remove_document("b", 2)
+            self.collection.load_index()  # As if a newer index had been saved
+
+            assert ([(i["type"], i["id"]) for i in self.collection.tfidf_search("mockingjay")] == [("b", 4)])
+            assert (self.collection.tfidf_search("catching") == [])
+
+    def test_other_process(self):
+        other = components.information_retrieval.DocumentCollection(self.connection, None, None, None, 10,
+                                                                   reload_interval=0)
+        self.collection.add_document("b", 4, "mockingjay suzanne collins")
+        self.collection.remove_document("b", 2)
+
+        assert (other.tfidf_search("mockingjay") == [])  # Until it checks for changes
+        other.refresh_index()
+        assert ([(i["type"], i["id"]) for i in other.tfidf_search("mockingjay")] == [("b", 4)])
+        assert (other.tfidf_search("catching") == [])
+
+        other.refresh_index()  # Each change is only made once
+        assert ([(i["type"], i["id"]) for i in other.tfidf_search("suzanne")] ==
+                [(i["type"], i["id"]) for i in self.collection.tfidf_search("suzanne")])
+
+    def test_cleared_changes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            server = components.information_retrieval.DocumentCollection(self.connection, None, None, None, 10,
+                                                                        index_directory=directory, reload_interval=0)
+            server.add_document("b", 4, "mockingjay suzanne collins")
+            self.connection._books = self.connection._books + [("mockingjay", 4, "suzanne collins")]  # The catalog
+            # was changed as well
+
+            maintenance = components.information_retrieval.DocumentCollection(self.connection, None, None, None, 10,
+                                                                              index_directory=directory, load=False)
+            maintenance.load_documents()
+            maintenance.save_index()
+            maintenance.clear_changes()
+
+            assert (self.connection.changes == [])
+            server.add_document("b", 5, "sunrise on the reaping suzanne collins")  # Loads the saved index first
+
+            assert (server.index_version == maintenance.index_version)
+            assert ([(i["type"], i["id"]) for i in server.tfidf_search("mockingjay")] == [("b", 4)])
+            assert ([(i["type"], i["id"]) for i in server.tfidf_search("reaping")] == [("b", 5)])
+
+    def test_index_unchanged(self):
+        index = self.collection._index
+        self.collection.add_document("b", 4, "mockingjay suzanne collins")
+        self.collection.remove_document("b", 2)
+
+        assert (self.collection._index is not index)
+        assert (not index.added and not index.removed)  # A search that read it before the changes is not affected
+
+
+class MatrixSearchTest(unittest.TestCase):
+    def setUp(self):
+        self.connection = Documents(
+            [("the hunger games", 1, "suzanne collins"), ("catching fire", 2, "suzanne collins"),
+             ("the fire within", 3, "chris d lacey")],
+            [("fantasy", 1), ("science fiction", 2)],
+            [("suzanne collins", 1), ("chris d lacey", 2)]
+        )
+        self.collection = components.information_retrieval.DocumentCollection(self.connection, None, None, None, 10,
+                                                                               engine="matrix")
+
+    def test_ranking(self):
+        terms = "suzanne fire"
+        idf = self.collection.idf_values
+        search = {word: 0.5 * idf[word] for word in terms.split(" ")}
+
+        expected = []
+        for position, document in enumerate(self.collection._documents_dict):
+            tfidf = {word: document["tf"].get(word, 0) * idf[word] for word in search}  # Only the search words
+            similarity = sum(weight * tfidf[word] for word, weight in search.items())
+            if similarity > 0:
+                similarity /= math.sqrt(sum(i ** 2 for i in search.values())) * \
+                              math.sqrt(sum(i ** 2 for i in tfidf.values()))
+                expected.append((-similarity, document["type"], position, document["id"]))
+        expected.sort()
+
+        result = self.collection.matrix_search(terms)
+
+        assert ([(i["type"], i["id"]) for i in result] == [(i[1], i[3]) for i in expected])
+        assert (all(math.isclose(i["similarity"], -k[0]) for i, k in zip(result, expected)))
+
+    def test_same_as_tfidf_search(self):
+        self.collection.add_document("b", 4, "mockingjay suzanne collins fire fire")
+        self.collection.update_document("b", 3, "the fire within the fire chris d lacey")
+        self.collection.remove_document("g", 1)
+
+        for terms in ("suzanne fire", "the fire fire", "fantasy", "collins catching the", "chris mockingjay", "dragon"):
+            result = self.collection.matrix_search(terms)
+            expected = self.collection.tfidf_search(terms)
+
+            assert ([(i["type"], i["id"]) for i in result] == [(i["type"], i["id"]) for i in expected])
+            assert (all(math.isclose(i["similarity"], k["similarity"]) for i, k in zip(result, expected)))
+
+    def test_same_as_tfidf_search_generated(self):
+        generator = random.Random(0)
+        words = ["fire", "ice", "dragon", "hunger", "games", "the", "within", "storm"]
+        connection = Documents(
+            [(" ".join(generator.choices(words, k=generator.randint(1, 6))), i, generator.choice(["ann", "bob"]))
+             for i in range(200)],
+            [("fantasy", 1), ("fire storm", 2)], [("ann", 1), ("bob", 2)]
+        )
+        collection = components.information_retrieval.DocumentCollection(connection, None, None, None, 10,
+                                                                         engine="matrix")
+        collection.add_document("b", 200, "fire fire ice")
+        collection.remove_document("b", 3)
+
+        for _ in range(20):
+            terms = " ".join(generator.choices(words + ["ann"], k=generator.randint(1, 3)))
+            for number in (None, 10):  # Many documents are tied, so the cut off is in the middle of a tie
+                result = collection.matrix_search(terms, number)
+                expected = collection.tfidf_search(terms, number)
+
+                assert ([(i["type"], i["id"]) for i in result] == [(i["type"], i["id"]) for i in expected])
+                assert (all(math.isclose(i["similarity"], k["similarity"]) for i, k in zip(result, expected)))
+
+    def test_number(self):
+        result = self.collection.matrix_search("suzanne fire")
+
+        assert (self.collection.matrix_search("suzanne fire", 0) == [])
+        assert (self.collection.matrix_search("suzanne fire", 2) == result[:2])
+        assert (self.collection.matrix_search("suzanne fire", 100) == result)
+        assert (self.collection.matrix_search("dragon") == [])
+
+    def test_ties(self):
+        connection = Documents([("blue fire", 1, "ann"), ("blue fire", 2, "ann"), ("red fire", 3, "bob")],
+                               [("blue fire ann", 1)], [("ann", 1)])
+        collection = components.information_retrieval.DocumentCollection(connection, None, None, None, 10,
+                                                                         engine="matrix")
+        result = [(i["type"], i["id"]) for i in collection.matrix_search("blue")]
+
+        assert (result == [("b", 1), ("b", 2), ("g", 1)])  # Then by type, then in document order
+        assert ([(i["type"], i["id"]) for i in collection.matrix_search("blue", 2)] == result[:2])
+        assert ([(i["type"], i["id"]) for i in collection.matrix_search("blue", 1)] == result[:1])
+
+    def test_changes(self):
+        self.collection.add_document("b", 4, "fire")
+        self.collection.remove_document("b", 2)
+        result = self.collection.matrix_search("fire")
+
+        assert ([(i["type"], i["id"]) for i in result] == [("b", 3), ("b", 4)])  # Tied, so in document order
+        assert (all(math.isclose(i["similarity"], 1) for i in result))
+        assert ([(i["type"], i["id"]) for i in self.collection.tfidf_search("fire")] == [("b", 3), ("b", 4)])
+
+        self.collection.update_document("b", 4, "mockingjay")
+
+        assert ([(i["type"], i["id"]) for i in self.collection.matrix_search("fire")] == [("b", 3)])
+        assert ([(i["type"], i["id"]) for i in self.collection.matrix_search("mockingjay", 1)] == [("b", 4)])
+
+
+class IdfTest(unittest.TestCase):
+    def test_idf_values(self):
+        connection = Documents([("catching fire", 2, "suzanne collins")], [("fantasy", 1)],
+                               [("suzanne collins", 1)])
+        connection.words = [(1, "fire"), (2, "suzanne"), (3, "dragon"), (4, "fantasy"), (5, "catching"),
+                            (6, "collins")]  # dragon is no longer in any document
+        collection = components.information_retrieval.DocumentCollection(connection, None, None, None, 10)
+        connection.queries = []
+        collection.gen_idf_values()
+
+        assert (connection.inserts == [(
+            "unique_words",
+            ("word_id", "word", "idf_values"),
+            [f'(1, "fire", {math.log10(3)})', f'(2, "suzanne", {math.log10(1.5)})', f'(4, "fantasy", {math.log10(3)})',
+             f'(5, "catching", {math.log10(3)})', f'(6, "collins", {math.log10(1.5)})'],
+            ("idf_values",)
+        )])  # Every word at once, updating the rows that exist
+        assert ("DELETE FROM unique_words WHERE word_id IN (3)" in connection.queries)
+        assert (collection.tfidf_search("dragon") == [])
+        assert ([i["id"] for i in collection.tfidf_search("collins")] == [1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()